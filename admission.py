@@ -0,0 +1,168 @@
+"""
+Admission control for the inference path.
+
+At most ADMISSION_MAX_IN_FLIGHT requests per process run inference at once.
+Further requests wait in a bounded queue for at most ADMISSION_QUEUE_TIMEOUT
+seconds; if the queue is full or the deadline passes, the request is shed
+immediately with 503 and a Retry-After header instead of piling up behind
+TensorFlow and exhausting memory.
+
+Waiters are served in priority order: interactive predictions ('normal')
+go ahead of background work ('low'). Training does not hold a slot at all;
+it calls yield_to_serving() between batches and pauses while predictions
+are waiting.
+
+Counts are exported through metrics.py:
+    admission_in_flight, admission_queued        (gauges)
+    admission_requests_total{result=admitted|shed_queue_full|shed_timeout}
+"""
+
+import os
+import time
+import heapq
+import itertools
+import functools
+import threading
+from contextlib import contextmanager
+
+from flask import request, Response
+
+import metrics
+
+MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', max(1, (os.cpu_count() or 2) // 2)))
+MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 16))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5))
+RETRY_AFTER_SECONDS = 2
+YIELD_MAX_WAIT_SECONDS = 2.0
+
+PRIORITIES = {'normal': 0, 'low': 1}
+
+metrics.HELP.update({
+    'admission_in_flight': 'Requests currently admitted to the inference path',
+    'admission_queued': 'Requests waiting for an inference slot',
+    'admission_requests_total': 'Admission decisions by result',
+})
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed by the admission controller."""
+
+    def __init__(self, reason):
+        super().__init__(f"Server overloaded ({reason})")
+        self.reason = reason
+
+
+class AdmissionController:
+    """Bounded in-flight limit with a bounded, deadline-aware priority queue."""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, timeout=QUEUE_TIMEOUT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiters = []   # heap of (priority, sequence)
+        self._sequence = itertools.count()
+
+    def _publish(self):
+        metrics.set_gauge('admission_in_flight', self._in_flight)
+        metrics.set_gauge('admission_queued', len(self._waiters))
+
+    def acquire(self, priority='normal', timeout=None):
+        """Take an inference slot or raise Overloaded."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        ticket = (PRIORITIES[priority], next(self._sequence))
+
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                self._publish()
+                metrics.inc('admission_requests_total', result='admitted')
+                return
+
+            if len(self._waiters) >= self.max_queue:
+                metrics.inc('admission_requests_total', result='shed_queue_full')
+                raise Overloaded('queue full')
+
+            heapq.heappush(self._waiters, ticket)
+            self._publish()
+            try:
+                while not (self._waiters[0] == ticket and self._in_flight < self.max_in_flight):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.inc('admission_requests_total', result='shed_timeout')
+                        raise Overloaded('queue timeout')
+                    self._cond.wait(remaining)
+                heapq.heappop(self._waiters)
+                self._in_flight += 1
+                metrics.inc('admission_requests_total', result='admitted')
+            except Overloaded:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                raise
+            finally:
+                self._publish()
+                # The head of the queue may have changed
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._publish()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority='normal', timeout=None):
+        """Context manager form of acquire()/release()."""
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def yield_to_serving(self, max_wait=YIELD_MAX_WAIT_SECONDS):
+        """
+        Called by low-priority background work (training batches) between
+        steps: block while interactive requests are queued or every slot is
+        busy, for at most max_wait seconds so the job still makes progress.
+        """
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            while self._waiters or self._in_flight >= self.max_in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+
+inference_admission = AdmissionController()
+
+
+def overloaded_response():
+    return Response('The server is busy identifying other plants. Please retry in a moment.',
+                    status=503, headers={'Retry-After': str(RETRY_AFTER_SECONDS)},
+                    mimetype='text/plain')
+
+
+def admission_controlled(priority='normal', methods=('POST',)):
+    """
+    Route decorator: run the view inside an inference slot, or fail fast
+    with 503 + Retry-After when overloaded. Only requests whose method is in
+    `methods` are gated (e.g. rendering the upload form is always allowed).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in methods:
+                return view(*args, **kwargs)
+            try:
+                inference_admission.acquire(priority)
+            except Overloaded:
+                return overloaded_response()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                inference_admission.release()
+        return wrapper
+    return decorator
@@ -1,8 +1,27 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from database import init_db, create_user, verify_password, save_dataset, get_all_datasets, get_all_users, add_plant, get_all_plants, get_plant_by_id, update_plant, delete_plant, get_plant_by_name
+# oneDNN on/off from the tuned CPU profile (cpu_tuning.py); must precede the TF import
+import cpu_tuning
+cpu_tuning.apply_environment('serving')
+
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, send_file, send_from_directory, abort, stream_with_context
+from database import init_db, create_user, verify_password, save_dataset, get_all_datasets, get_all_users, add_plant, get_all_plants, get_plant_by_id, update_plant, delete_plant, get_plant_by_name, get_batch_job, get_user_batch_jobs, record_predictions
 import os
 from werkzeug.utils import secure_filename
 from train_model import train_medicinal_plant_model
+from checkpointing import parse_duration
+from upload_store import store_upload
+import metrics
+from admission import admission_controlled, inference_admission
+from http_cache import (init_http_cache, conditional_page, catalog_validators, template_validators,
+                        render_plant_list, CATALOG_CACHE_CONTROL, STATIC_PAGE_CACHE_CONTROL, PLANT_LIST_FRAGMENT)
+from profiling import init_profiling, list_profiles, profile_file_path, PROFILE_SAMPLE_RATE, PROFILE_MAX_ENTRIES
+from inference import model_is_trained, identify, cascade_stats, warm_up, SIMILAR_IMAGES_K
+from prototypes import register_class, registered_classes
+import batch_jobs
+import shadow
+import chunked_upload
+import dataset_gallery
+import dashboard_stats
+import quality_gate
 from datetime import datetime
 import numpy as np
 
@@ -34,7 +53,32 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 # Initialize database on app startup
 init_db()
 
+# Opt-in request profiling (X-Profile: <PLANT_PROFILE_TOKEN> header or PROFILE_SAMPLE_RATE)
+init_profiling(app)
+
+# Immutable cache headers for content-addressed uploads
+init_http_cache(app)
+
+# Serving thread pools from the tuned profile; gunicorn workers re-apply their share
+# of the cores in wsgi.configure_worker before their runtime starts
+cpu_tuning.apply_threads('serving')
+
+# Load and warm the serving models (all batch buckets) before the first request
+if os.environ.get('PLANT_WARMUP', '1') == '1':
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"Model warm-up skipped: {str(e)}")
+
+# Resume unfinished batch jobs in every serving process, warmed up or not. Started on the
+# first request rather than at import, so a gunicorn master never runs jobs before forking
+# (its workers also start theirs in wsgi.configure_worker).
+@app.before_request
+def start_batch_runner():
+    batch_jobs.start_runner()
+
 @app.route('/')
+@conditional_page('home', lambda: template_validators('home.html'), STATIC_PAGE_CACHE_CONTROL)
 def home():
     return render_template('home.html')
 
@@ -73,6 +117,7 @@ def register_success():
     return render_template('register_complete.html')
 
 @app.route('/about')
+@conditional_page('about', lambda: template_validators('about.html'), STATIC_PAGE_CACHE_CONTROL)
 def about():
     return render_template('about.html')
 
@@ -139,7 +184,15 @@ def logout():
 def admin_dashboard():
     """Admin dashboard - shows admin control panel."""
     # Note: In production, implement proper admin authentication
-    return render_template('admin_dashboard.html')
+    return render_template('admin_dashboard.html', stats=dashboard_stats.snapshot(),
+                           shadow_report=shadow.summary())
+
+@app.route('/admin/stats/recount', methods=['POST'])
+def recount_dataset_stats():
+    """Recount dataset/ into the dashboard rollups (after files were copied in by hand)."""
+    success, message = dashboard_stats.recount_dataset()
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/view_users')
 def view_users():
@@ -206,7 +259,57 @@ def upload_dataset():
     
     # GET request - show upload form with existing datasets
     datasets = get_all_datasets()
-    return render_template('admin_upload_dataset.html', datasets=datasets)
+    return render_template('admin_upload_dataset.html', datasets=datasets,
+                           max_upload_gb=chunked_upload.MAX_UPLOAD_BYTES / (1024 ** 3))
+
+def _chunk_error_response(e):
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+@app.route('/admin/upload_dataset/chunked', methods=['POST'])
+def create_chunked_upload():
+    """Start a resumable chunked upload (see chunked_upload.py)."""
+    data = request.get_json(silent=True) or {}
+    try:
+        status = chunked_upload.create_upload(data.get('filename'), data.get('size'),
+                                              ALLOWED_EXTENSIONS, data.get('sha256'))
+    except chunked_upload.ChunkError as e:
+        return _chunk_error_response(e)
+    return jsonify(status), 201
+
+@app.route('/admin/upload_dataset/chunked/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def chunked_upload_resource(upload_id):
+    """Resume point (GET), one chunk at ?offset= (PUT), or abort (DELETE)."""
+    try:
+        if request.method == 'GET':
+            return jsonify(chunked_upload.upload_status(upload_id))
+        if request.method == 'DELETE':
+            chunked_upload.abort_upload(upload_id)
+            return jsonify({'upload_id': upload_id, 'aborted': True})
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'offset is required'}), 400
+        return jsonify(chunked_upload.write_chunk(upload_id, offset, request.stream,
+                                                  request.headers.get('X-Chunk-Checksum')))
+    except chunked_upload.ChunkError as e:
+        return _chunk_error_response(e)
+
+@app.route('/admin/upload_dataset/chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """Assemble a fully uploaded file and register it as a dataset."""
+    try:
+        filename, original_filename, filepath, file_size = chunked_upload.complete_upload(upload_id)
+    except chunked_upload.ChunkError as e:
+        return _chunk_error_response(e)
+    
+    username = session.get('username', 'admin')
+    success, message = save_dataset(filename, original_filename, filepath, file_size, username)
+    if not success:
+        return jsonify({'error': message}), 500
+    flash(f'File "{original_filename}" uploaded successfully!', 'success')
+    return jsonify({'filename': filename, 'size': file_size})
 
 @app.route('/admin/manage_plants', methods=['GET', 'POST'])
 def manage_plants():
@@ -280,15 +383,102 @@ def delete_plant_route(plant_id):
 
 @app.route('/admin/train_model')
 def train_model():
-    """Train the ML model on the current dataset."""
+    """
+    Train the ML model on the current dataset. Resumes from the last
+    checkpoint of an interrupted run. ?time_budget=90m (or
+    PLANT_TRAIN_TIME_BUDGET) stops cleanly and saves the best checkpoint.
+    ?candidate=1 trains a candidate for shadow evaluation instead of
+    replacing the production model.
+    """
     try:
-        message = train_medicinal_plant_model()
+        time_budget = request.args.get('time_budget') or os.environ.get('PLANT_TRAIN_TIME_BUDGET')
+        # Training pauses between batches while predictions are waiting
+        message = train_medicinal_plant_model(batch_hook=inference_admission.yield_to_serving,
+                                              time_budget=parse_duration(time_budget) if time_budget else None,
+                                              candidate=request.args.get('candidate') == '1')
         flash(message, 'success')
         return redirect(url_for('admin_dashboard'))
     except Exception as e:
         flash(f'Error during training: {str(e)}', 'error')
         return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/shadow')
+def shadow_evaluation():
+    """Per-class comparison of the candidate model with production."""
+    return render_template('admin_shadow.html', report=shadow.report(), backfill=shadow.backfill_status(),
+                           sample_rate=shadow.SHADOW_SAMPLE_RATE)
+
+@app.route('/admin/shadow/backfill', methods=['POST'])
+def shadow_backfill():
+    """Re-score stored uploads with the candidate model in the background."""
+    success, message = shadow.start_backfill()
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('shadow_evaluation'))
+
+@app.route('/admin/shadow/promote', methods=['POST'])
+def shadow_promote():
+    """Replace the production model with the candidate."""
+    success, message = shadow.promote_candidate()
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('admin_dashboard' if success else 'shadow_evaluation'))
+
+@app.route('/admin/register_class', methods=['GET', 'POST'])
+def register_plant_class():
+    """Add a new plant class from a few images, without retraining."""
+    if request.method == 'POST':
+        plant_name = request.form.get('plant_name', '').strip()
+        botanical_name = request.form.get('botanical_name', '').strip()
+        benefits = request.form.get('benefits', '').strip()
+        images = [f for f in request.files.getlist('images') if f.filename]
+        
+        if not plant_name or not botanical_name or not benefits:
+            flash('All fields are required.', 'error')
+            return redirect(url_for('register_plant_class'))
+        
+        if not images:
+            flash('Please select at least one image.', 'error')
+            return redirect(url_for('register_plant_class'))
+        
+        allowed_image_extensions = {'jpg', 'jpeg', 'png'}
+        if any(f.filename.rsplit('.', 1)[-1].lower() not in allowed_image_extensions for f in images):
+            flash('File type not allowed. Only JPG, JPEG, PNG are accepted.', 'error')
+            return redirect(url_for('register_plant_class'))
+        
+        try:
+            success, message = register_class(plant_name, images, botanical_name, benefits)
+            flash(message, 'success' if success else 'error')
+        except Exception as e:
+            flash(f'Error registering class: {str(e)}', 'error')
+        return redirect(url_for('register_plant_class'))
+    
+    return render_template('admin_register_class.html', classes=registered_classes())
+
+@app.route('/admin/cascade_stats')
+def cascade_stats_view():
+    """Report cascade escalation rate and blended latency for this process."""
+    return jsonify(cascade_stats.snapshot())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics, merged across worker processes."""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profiles')
+def view_profiles():
+    """List the slowest recently profiled requests."""
+    profiles = list_profiles(limit=100, order='slowest')
+    return render_template('admin_profiles.html', profiles=profiles,
+                           sample_rate=PROFILE_SAMPLE_RATE, max_entries=PROFILE_MAX_ENTRIES)
+
+@app.route('/admin/profiles/<endpoint>/<profile_id>.<kind>')
+def download_profile(endpoint, profile_id, kind):
+    """Download a stored profile (collapsed stacks or pstats)."""
+    path = profile_file_path(endpoint, profile_id, kind)
+    if path is None:
+        abort(404)
+    return send_file(os.path.abspath(path), as_attachment=True,
+                     download_name=f"{endpoint}_{profile_id}.{kind}")
+
 @app.route('/admin/view_dataset')
 def view_dataset():
     """View dataset structure and statistics."""
@@ -308,20 +498,41 @@ def view_dataset():
                          datasets=datasets, 
                          image_count=image_count)
 
+@app.route('/admin/dataset/<class_name>')
+def dataset_gallery_view(class_name):
+    """Browse one class of the dataset as thumbnails, a page at a time."""
+    gallery = dataset_gallery.gallery_page(class_name, request.args.get('page', 1, type=int))
+    if gallery is None:
+        abort(404)
+    return render_template('admin_dataset_gallery.html', gallery=gallery,
+                           classes=dataset_gallery.list_classes())
+
+@app.route('/admin/dataset/<class_name>/bulk', methods=['POST'])
+def dataset_gallery_bulk(class_name):
+    """Move the selected images to another class, or delete them."""
+    filenames = request.form.getlist('filenames')
+    action = request.form.get('action')
+    if action == 'move':
+        success, message = dataset_gallery.bulk_move(class_name, filenames, request.form.get('target_class'))
+    elif action == 'delete':
+        success, message = dataset_gallery.bulk_delete(class_name, filenames)
+    else:
+        success, message = False, 'Unknown action.'
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('dataset_gallery_view', class_name=class_name, page=request.form.get('page', 1)))
+
 @app.route('/predict', methods=['GET', 'POST'])
+@admission_controlled()
 def predict():
     """Predict plant type from uploaded image using trained model."""
-    import json
-    from tensorflow.keras.models import load_model
-    from tensorflow.keras.preprocessing import image as keras_image
-    
     prediction = None
     image_filename = None
+    thumbnail_filename = None
     
     if request.method == 'POST':
         try:
             # Check if model exists
-            if not os.path.exists(MODEL_PATH) or not os.path.exists(LABELS_PATH):
+            if not model_is_trained():
                 flash('Model has not been trained yet. Please train the model first.', 'error')
                 return render_template('predict.html')
             
@@ -340,31 +551,29 @@ def predict():
                 flash('File type not allowed. Only JPG, JPEG, PNG, GIF are accepted.', 'error')
                 return render_template('predict.html')
             
-            # Save uploaded file
+            # Save uploaded file (deduplicated by content)
             original_filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + original_filename
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
-            file.save(filepath)
-            
-            # Load model and labels
-            model = load_model(MODEL_PATH)
-            with open(LABELS_PATH, 'r') as f:
-                labels = json.load(f)
+            with metrics.timed('prediction_stage_seconds', stage='upload', route='predict'):
+                stored = store_upload(file, original_filename)
+            filepath = stored.path
             
-            # Prepare image for prediction
-            img = keras_image.load_img(filepath, target_size=(224, 224))
-            img_array = keras_image.img_to_array(img) / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
+            # Reject blurry, dark, tiny or non-plant images before the model runs
+            try:
+                quality_gate.check(filepath, route='predict')
+            except quality_gate.ImageQualityError as e:
+                flash(str(e), 'error')
+                return render_template('predict.html')
             
-            # Make prediction
-            predictions_array = model.predict(img_array, verbose=0)[0]
+            # Make prediction (fast model first, full model on low confidence,
+            # then registered few-shot classes)
+            predictions_array, labels, cascade_info, _ = identify(filepath)
+            shadow.mirror(filepath, predictions_array, labels, cascade_info['latency_ms'])
             
             # Get predicted class
             predicted_class_idx = np.argmax(predictions_array)
             predicted_class_name = labels[str(predicted_class_idx)]
             confidence = float(predictions_array[predicted_class_idx]) * 100
+            record_predictions([(predicted_class_name, confidence)])
             
             # Get all predictions with percentages
             all_predictions = {}
@@ -379,16 +588,22 @@ def predict():
             prediction = {
                 'plant_name': predicted_class_name,
                 'confidence': round(confidence, 2),
-                'all_predictions': all_predictions
+                'all_predictions': all_predictions,
+                'model_stage': cascade_info['stage'],
+                'latency_ms': cascade_info['latency_ms'],
+                'tta_views': cascade_info['tta_views']
             }
             
-            image_filename = filename
+            image_filename = stored.static_path
+            thumbnail_filename = stored.thumbnail_static_path
             
         except Exception as e:
             flash(f'Error during prediction: {str(e)}', 'error')
             return render_template('predict.html')
     
-    return render_template('predict.html', prediction=prediction, image_filename=image_filename)
+    with metrics.timed('prediction_stage_seconds', stage='render', route='predict'):
+        return render_template('predict.html', prediction=prediction, image_filename=image_filename,
+                               thumbnail_filename=thumbnail_filename)
 
 @app.route('/user/upload')
 def user_upload():
@@ -399,19 +614,16 @@ def user_upload():
     return render_template('user_upload.html')
 
 @app.route('/user/predict', methods=['POST'])
+@admission_controlled()
 def user_predict():
     """Handle user plant image prediction with detailed plant information."""
     if 'user_id' not in session:
         flash('Please log in first.', 'error')
         return redirect(url_for('user_login'))
     
-    import json
-    from tensorflow.keras.models import load_model
-    from tensorflow.keras.preprocessing import image as keras_image
-    
     try:
         # Check if model exists
-        if not os.path.exists(MODEL_PATH) or not os.path.exists(LABELS_PATH):
+        if not model_is_trained():
             flash('Model has not been trained yet. Please contact admin.', 'error')
             return redirect(url_for('user_upload'))
         
@@ -432,34 +644,40 @@ def user_predict():
             flash('File type not allowed. Only JPG, JPEG, PNG, GIF are accepted.', 'error')
             return redirect(url_for('user_upload'))
         
-        # Save uploaded file to static/uploads for display
+        # Save uploaded file to the content-addressed store for display
         original_filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-        filename = timestamp + original_filename
-        filepath = os.path.join('static/uploads', filename)
+        with metrics.timed('prediction_stage_seconds', stage='upload', route='user_predict'):
+            stored = store_upload(file, original_filename)
+        filepath = stored.path
         
-        file.save(filepath)
-        
-        # Load model and labels
-        model = load_model(MODEL_PATH)
-        with open(LABELS_PATH, 'r') as f:
-            labels = json.load(f)
-        
-        # Prepare image for prediction
-        img = keras_image.load_img(filepath, target_size=(224, 224))
-        img_array = keras_image.img_to_array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        # Reject blurry, dark, tiny or non-plant images before the model runs
+        try:
+            quality_gate.check(filepath, route='user_predict')
+        except quality_gate.ImageQualityError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('user_upload'))
         
-        # Make prediction
-        predictions_array = model.predict(img_array, verbose=0)[0]
+        # Make prediction; when the full model runs, its pooled features also find
+        # the nearest reference images (if an index exists) and registered few-shot classes
+        predictions_array, labels, cascade_info, matches = identify(filepath, k=SIMILAR_IMAGES_K)
+        shadow.mirror(filepath, predictions_array, labels, cascade_info['latency_ms'])
+        similar_images = []
+        for match in matches:
+            similar_images.append({
+                'image': os.path.relpath(match['path'], DATASET_PATH).replace(os.sep, '/'),
+                'label': match['label'],
+                'score': round(match['score'], 3)
+            })
         
         # Get predicted class
         predicted_class_idx = np.argmax(predictions_array)
         predicted_class_name = labels[str(predicted_class_idx)]
         confidence = float(predictions_array[predicted_class_idx]) * 100
+        record_predictions([(predicted_class_name, confidence)])
         
         # Get plant information from database using improved lookup
-        plant_info = get_plant_by_name(predicted_class_name)
+        with metrics.timed('prediction_stage_seconds', stage='plant_lookup', route='user_predict'):
+            plant_info = get_plant_by_name(predicted_class_name)
         
         # Get top 3 predictions
         top_predictions = []
@@ -477,21 +695,94 @@ def user_predict():
         result = {
             'predicted_plant': predicted_class_name,
             'confidence': round(confidence, 2),
-            'image_path': filename,
+            'image_path': stored.static_path,
+            'thumbnail_path': stored.thumbnail_static_path,
             'plant_info': plant_info,
-            'top_predictions': top_predictions
+            'top_predictions': top_predictions,
+            'model_stage': cascade_info['stage'],
+            'similar_images': similar_images
         }
         
-        return render_template('user_prediction_result.html', result=result)
+        with metrics.timed('prediction_stage_seconds', stage='render', route='user_predict'):
+            return render_template('user_prediction_result.html', result=result)
         
     except Exception as e:
         flash(f'Error during prediction: {str(e)}', 'error')
         return redirect(url_for('user_upload'))
 
+def _user_batch_job(job_id):
+    """Fetch a batch job owned by the logged-in user, or abort with 404."""
+    job = get_batch_job(job_id)
+    if job is None or job['user_id'] != session.get('user_id'):
+        abort(404)
+    return job
+
+@app.route('/user/batch', methods=['GET', 'POST'])
+def user_batch():
+    """Upload a ZIP or several images for background identification."""
+    if 'user_id' not in session:
+        flash('Please log in first.', 'error')
+        return redirect(url_for('user_login'))
+    
+    if request.method == 'POST':
+        if not model_is_trained():
+            flash('Model has not been trained yet. Please contact admin.', 'error')
+            return redirect(url_for('user_batch'))
+        
+        files = [f for f in request.files.getlist('files') if f.filename]
+        if not files:
+            flash('No file selected.', 'error')
+            return redirect(url_for('user_batch'))
+        
+        try:
+            job_id = batch_jobs.create_job(session['user_id'], files)
+        except Exception as e:
+            flash(f'Error creating batch: {str(e)}', 'error')
+            return redirect(url_for('user_batch'))
+        return redirect(url_for('user_batch_job', job_id=job_id))
+    
+    jobs = [dict(batch_jobs.job_progress(job), created_at=job['created_at'])
+            for job in get_user_batch_jobs(session['user_id'])]
+    return render_template('user_batch.html', jobs=jobs, max_files=batch_jobs.BATCH_MAX_FILES)
+
+@app.route('/user/batch/<job_id>')
+def user_batch_job(job_id):
+    """Progress page for one batch job."""
+    if 'user_id' not in session:
+        flash('Please log in first.', 'error')
+        return redirect(url_for('user_login'))
+    job = _user_batch_job(job_id)
+    return render_template('user_batch_job.html', job=batch_jobs.job_progress(job))
+
+@app.route('/user/batch/<job_id>/status')
+def user_batch_status(job_id):
+    """Pollable JSON progress of a batch job."""
+    return jsonify(batch_jobs.job_progress(_user_batch_job(job_id)))
+
+@app.route('/user/batch/<job_id>/results.<fmt>')
+def user_batch_results(job_id, fmt):
+    """Stream batch results as CSV or JSONL."""
+    job = _user_batch_job(job_id)
+    if fmt == 'csv':
+        rows, mimetype = batch_jobs.iter_results_csv(job['id']), 'text/csv'
+    elif fmt == 'jsonl':
+        rows, mimetype = batch_jobs.iter_results_jsonl(job['id']), 'application/x-ndjson'
+    else:
+        abort(404)
+    return Response(stream_with_context(rows), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=plant_batch_{job["id"]}.{fmt}'})
+
+@app.route('/dataset_image/<path:filename>')
+def dataset_image(filename):
+    """Serve a reference image from the dataset folder."""
+    return send_from_directory(os.path.abspath(DATASET_PATH), filename)
+
 @app.route('/user/plants')
+@conditional_page('plants', lambda: catalog_validators('user_plant_list.html', PLANT_LIST_FRAGMENT),
+                  CATALOG_CACHE_CONTROL)
 def plants_list():
-    plants = get_all_plants()  # Fetch from database
-    return render_template('user_plant_list.html', plants=plants)
+    # The plant grid is rendered once per catalog version (http_cache.py)
+    return render_template('user_plant_list.html', plant_list_html=render_plant_list())
 
 
 
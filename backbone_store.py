@@ -0,0 +1,250 @@
+"""
+Local, checksum-verified store of ImageNet backbone weights.
+
+MobileNetV2(weights="imagenet") downloads its weight file on a cold Keras
+cache, which fails on air-gapped training nodes and stalls the first run
+everywhere else. The trainer instead builds from files in STORE_DIR
+(models/backbones/), each recorded in manifest.json with its SHA-256:
+
+    python backbone_store.py import weights.h5 more/   # files or folders of Keras weight files
+    python backbone_store.py import                    # whatever is in the Keras cache (~/.keras/models)
+    python backbone_store.py fetch 1.0 224 0.35 128    # download (alpha, size) pairs on a connected machine
+    python backbone_store.py list
+    python backbone_store.py verify
+
+Files keep Keras' names (mobilenet_v2_weights_tf_dim_ordering_tf_kernels_
+<alpha>_<rows>[_no_top].h5), so the store directory can be copied between
+machines as-is. weights_path() checks a file's hash once per process (again
+only if the file changes) and raises BackboneWeightsError on a missing or
+corrupted file. A file missing from the store is imported from the Keras
+cache when it is there, and downloaded only with PLANT_BACKBONE_DOWNLOAD=1.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import urllib.request
+from datetime import datetime
+
+STORE_DIR = os.environ.get('PLANT_BACKBONE_DIR', os.path.join('models', 'backbones'))
+MANIFEST_PATH = os.path.join(STORE_DIR, 'manifest.json')
+KERAS_CACHE_DIR = os.path.join(os.environ.get('KERAS_HOME', os.path.join(os.path.expanduser('~'), '.keras')),
+                               'models')
+WEIGHTS_URL = 'https://storage.googleapis.com/tensorflow/keras-applications/mobilenet_v2/'
+DOWNLOAD_ALLOWED = os.environ.get('PLANT_BACKBONE_DOWNLOAD', '0') == '1'
+
+# Input sizes with published weights; Keras uses the 224 weights for any other size
+WEIGHT_ROWS = (96, 128, 160, 192, 224)
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+READ_SIZE = 1024 * 1024
+
+_FILENAME_PATTERN = re.compile(r'^mobilenet_v2_weights_tf_dim_ordering_tf_kernels_'
+                               r'(?P<alpha>[0-9.]+)_(?P<rows>[0-9]+)(?P<no_top>_no_top)?\.h5$')
+
+_verified = {}   # path -> (size, mtime_ns) whose hash matched the manifest
+_lock = threading.Lock()
+
+
+class BackboneWeightsError(RuntimeError):
+    """Backbone weights are missing from the store or fail their checksum."""
+
+
+def weights_rows(size):
+    """The weight file resolution Keras uses for an input of `size` pixels."""
+    return size if size in WEIGHT_ROWS else 224
+
+
+def weights_filename(alpha, rows, include_top=False):
+    """Keras' file name for MobileNetV2 ImageNet weights."""
+    return (f"mobilenet_v2_weights_tf_dim_ordering_tf_kernels_{float(alpha)}_{rows}"
+            f"{'' if include_top else '_no_top'}.h5")
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(manifest):
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def import_file(path):
+    """
+    Copy a Keras weight file into the store and record its checksum.
+    Returns (bool, message).
+    """
+    name = os.path.basename(path)
+    match = _FILENAME_PATTERN.match(name)
+    if match is None:
+        return False, f"{name}: not a MobileNetV2 ImageNet weight file name"
+    with open(path, 'rb') as f:
+        if f.read(len(HDF5_SIGNATURE)) != HDF5_SIGNATURE:
+            return False, f"{name}: not an HDF5 file (truncated or an error page?)"
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=STORE_DIR, suffix='.tmp')
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            for chunk in iter(lambda: src.read(READ_SIZE), b''):
+                digest.update(chunk)
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, os.path.join(STORE_DIR, name))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    with _lock:
+        manifest = load_manifest()
+        previous = manifest.get(name)
+        manifest[name] = {
+            'sha256': digest.hexdigest(),
+            'size': os.path.getsize(os.path.join(STORE_DIR, name)),
+            'alpha': float(match.group('alpha')),
+            'rows': int(match.group('rows')),
+            'include_top': match.group('no_top') is None,
+            'source': os.path.abspath(path),
+            'imported_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        _save_manifest(manifest)
+        _verified.pop(os.path.join(STORE_DIR, name), None)
+    if previous and previous['sha256'] != digest.hexdigest():
+        return True, f"{name}: replaced (sha256 {digest.hexdigest()[:12]}, was {previous['sha256'][:12]})"
+    return True, f"{name}: imported (sha256 {digest.hexdigest()[:12]})"
+
+
+def fetch(alpha, rows, include_top=False):
+    """Download one weight file from the Keras release bucket and import it. Returns (bool, message)."""
+    name = weights_filename(alpha, rows, include_top)
+    download_dir = tempfile.mkdtemp(prefix='backbone_')
+    try:
+        path = os.path.join(download_dir, name)
+        print(f"[INFO] Downloading {WEIGHTS_URL + name}")
+        urllib.request.urlretrieve(WEIGHTS_URL + name, path)
+        return import_file(path)
+    except OSError as e:
+        return False, f"{name}: download failed: {str(e)}"
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def verify(name, entry):
+    """Check one stored file against its manifest entry. Returns (bool, message)."""
+    path = os.path.join(STORE_DIR, name)
+    if not os.path.exists(path):
+        return False, f"{name}: missing from {STORE_DIR}"
+    actual = _sha256(path)
+    if actual != entry['sha256']:
+        return False, f"{name}: checksum mismatch (expected {entry['sha256'][:12]}, found {actual[:12]})"
+    return True, f"{name}: ok"
+
+
+def weights_path(alpha, size, include_top=False):
+    """
+    Verified local path of the ImageNet weights for a MobileNetV2 with this
+    width and input size, for MobileNetV2(weights=...). Never touches the
+    network unless PLANT_BACKBONE_DOWNLOAD=1.
+    """
+    rows = weights_rows(size)
+    name = weights_filename(alpha, rows, include_top)
+    path = os.path.join(STORE_DIR, name)
+    entry = load_manifest().get(name)
+
+    if entry is None:
+        cached = os.path.join(KERAS_CACHE_DIR, name)
+        if os.path.exists(cached):
+            success, message = import_file(cached)
+        elif DOWNLOAD_ALLOWED:
+            success, message = fetch(alpha, rows, include_top)
+        else:
+            success, message = False, "not in the store"
+        print(f"[{'INFO' if success else 'WARN'}] Backbone weights {message}")
+        entry = load_manifest().get(name)
+        if entry is None:
+            raise BackboneWeightsError(
+                f"ImageNet weights for MobileNetV2 alpha={alpha} at {rows}px are not in {STORE_DIR}. "
+                f"Import {name} with `python backbone_store.py import <file>` "
+                f"(or run `python backbone_store.py fetch {alpha} {rows}` on a machine with network access).")
+
+    stat = os.stat(path) if os.path.exists(path) else None
+    key = (stat.st_size, stat.st_mtime_ns) if stat else None
+    with _lock:
+        if key is not None and _verified.get(path) == key:
+            return path
+    success, message = verify(name, entry)
+    if not success:
+        raise BackboneWeightsError(f"{message}. Re-import it with `python backbone_store.py import <file>`.")
+    with _lock:
+        _verified[path] = key
+    return path
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    args = sys.argv[2:]
+    failed = False
+
+    if command == 'import':
+        sources = args or [KERAS_CACHE_DIR]
+        files = []
+        for source in sources:
+            if os.path.isdir(source):
+                files.extend(os.path.join(source, f) for f in sorted(os.listdir(source))
+                             if _FILENAME_PATTERN.match(f))
+            else:
+                files.append(source)
+        if not files:
+            print(f"❌ No MobileNetV2 weight files found in {', '.join(sources)}")
+            failed = True
+        for path in files:
+            success, message = import_file(path)
+            print(("✅ " if success else "❌ ") + message)
+            failed = failed or not success
+    elif command == 'fetch':
+        if not args or len(args) % 2:
+            print("Usage: python backbone_store.py fetch <alpha> <size> [<alpha> <size> ...]")
+            sys.exit(2)
+        for alpha, size in zip(args[::2], args[1::2]):
+            success, message = fetch(float(alpha), weights_rows(int(size)))
+            print(("✅ " if success else "❌ ") + message)
+            failed = failed or not success
+    elif command in ('list', 'verify'):
+        manifest = load_manifest()
+        if not manifest:
+            print(f"No backbone weights in {STORE_DIR}. Run: python backbone_store.py import <file>")
+        for name, entry in sorted(manifest.items()):
+            if command == 'verify':
+                success, message = verify(name, entry)
+                print(("✅ " if success else "❌ ") + message)
+                failed = failed or not success
+            else:
+                print(f"alpha={entry['alpha']:<5} {entry['rows']}px  {entry['size'] / 1e6:6.1f} MB  "
+                      f"sha256 {entry['sha256'][:12]}  {name}")
+    else:
+        print(__doc__)
+        sys.exit(2)
+    sys.exit(1 if failed else 0)
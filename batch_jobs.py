@@ -0,0 +1,366 @@
+"""
+Background batch identification for many photos at once.
+
+A user uploads a ZIP archive or a multi-file selection. The images are
+written to batch_jobs/<job_id>/ and a job with one row per image is created
+in SQLite (batch_jobs / batch_job_items), so nothing about the job lives
+only in memory.
+
+Each web process runs one runner thread. The runner leases the oldest
+unfinished job, then processes its pending items BATCH_SIZE at a time: it
+decodes them (images the quality gate rejects are stored as errors with
+the gate's message), runs one batched forward pass through the full model
+(inference.predict_batch), and stores the top-3 results together with the
+job counters in a single transaction. When few-shot classes are registered
+(prototypes.py) or a kNN/prototype classifier is configured, the same pass
+also returns the pooled features and every image goes through the heads
+/user/predict uses (inference.apply_heads). Because every stored batch is
+durable and the lease has to be renewed, a job whose worker died or was
+restarted is picked up by any runner once the lease expires, continuing
+with the items that are still pending. The runner calls
+yield_to_serving() between batches, so interactive predictions go first.
+It is started on the first request of each process (or by wsgi's
+post-fork hook), independent of model warm-up.
+
+The copied images are removed when a job finishes or fails; every
+CLEANUP_INTERVAL_SECONDS the runner also removes directories in
+batch_jobs/ that belong to no queued or running job (e.g. an aborted
+upload), once they are older than ORPHAN_MIN_AGE_SECONDS.
+
+Results are streamed as CSV or JSONL with iter_results_csv() /
+iter_results_jsonl(), reading the item rows in chunks.
+"""
+
+import os
+import io
+import csv
+import json
+import time
+import uuid
+import shutil
+import socket
+import zipfile
+import threading
+import multiprocessing
+import numpy as np
+
+import metrics
+import quality_gate
+from database import (create_batch_job, claim_batch_job, renew_batch_lease, get_pending_batch_items,
+                      save_batch_results, finish_batch_job, iter_batch_job_items, get_plant_by_name,
+                      get_active_batch_job_ids)
+
+BATCH_DIR = "batch_jobs"
+BATCH_SIZE = 16
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 1000))
+BATCH_MAX_FILE_BYTES = 20 * 1024 * 1024
+BATCH_MAX_TOTAL_BYTES = 2 * 1024 * 1024 * 1024  # extracted size, guards against ZIP bombs
+LEASE_SECONDS = 60
+POLL_INTERVAL_SECONDS = 2.0
+MAX_JOB_ATTEMPTS = 3
+CLEANUP_INTERVAL_SECONDS = 3600
+ORPHAN_MIN_AGE_SECONDS = 3600  # create_job() copies files before the job row exists
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
+TOP_K = 3
+
+metrics.HELP.update({
+    'batch_images_total': 'Batch identification images processed by result',
+    'batch_jobs_total': 'Batch identification jobs by final status',
+})
+
+
+def _is_image(filename):
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _copy_limited(source, path, remaining_bytes):
+    """
+    Copy a file-like object to path, refusing files over BATCH_MAX_FILE_BYTES
+    or over the job's remaining byte allowance. Returns the bytes written.
+    """
+    written = 0
+    with open(path, 'wb') as out:
+        while True:
+            chunk = source.read(1024 * 1024)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > BATCH_MAX_FILE_BYTES:
+                raise ValueError(f"{os.path.basename(path)} is larger than "
+                                 f"{BATCH_MAX_FILE_BYTES // (1024 * 1024)} MB")
+            if written > remaining_bytes:
+                raise ValueError("The batch is too large once extracted")
+            out.write(chunk)
+    return written
+
+
+def create_job(user_id, files):
+    """
+    Create a batch job from uploaded files (images and/or ZIP archives).
+
+    Args:
+        user_id: Owner of the job
+        files: werkzeug FileStorage objects
+
+    Returns:
+        The job id
+
+    Raises:
+        ValueError: If there are no images, too many images, or an image is too large
+    """
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(BATCH_DIR, job_id)
+    os.makedirs(job_dir)
+    items = []
+    total_bytes = [0]
+
+    def add(filename, source):
+        if len(items) >= BATCH_MAX_FILES:
+            raise ValueError(f"A batch can contain at most {BATCH_MAX_FILES} images")
+        # Stored under the item index; the original name is only kept in the database
+        path = os.path.join(job_dir, f"{len(items):05d}{os.path.splitext(filename)[1].lower()}")
+        total_bytes[0] += _copy_limited(source, path, BATCH_MAX_TOTAL_BYTES - total_bytes[0])
+        items.append((filename, path))
+
+    try:
+        for file in files:
+            if file.filename.lower().endswith('.zip'):
+                with zipfile.ZipFile(file.stream) as archive:
+                    for info in archive.infolist():
+                        name = info.filename.replace('\\', '/')
+                        if info.is_dir() or not _is_image(name) or '__MACOSX/' in name:
+                            continue
+                        with archive.open(info) as source:
+                            add(name, source)
+            elif _is_image(file.filename):
+                add(file.filename, file.stream)
+
+        if not items:
+            raise ValueError("No images found in the upload")
+
+        success, message = create_batch_job(job_id, user_id, items)
+        if not success:
+            raise ValueError(message)
+    except (ValueError, zipfile.BadZipFile):
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    start_runner()
+    return job_id
+
+
+def _top_predictions(probabilities, labels):
+    top = np.argsort(probabilities)[::-1][:TOP_K]
+    return [{'label': labels[str(i)], 'confidence': round(float(probabilities[i]) * 100, 2)} for i in top]
+
+
+def _process_items(items, trained_labels, labels):
+    """
+    Decode and classify a list of item rows. labels is trained_labels
+    extended with the registered few-shot classes. Returns
+    save_batch_results() tuples.
+    """
+    from inference import predict_batch, needs_embedding, apply_heads, FULL_IMG_SIZE
+    from preprocessing import load_image_uint8
+
+    batch = np.empty((len(items), FULL_IMG_SIZE[0], FULL_IMG_SIZE[1], 3), dtype=np.uint8)
+    decoded = []
+    results = []
+    for item in items:
+        try:
+            quality_gate.check(item['path'], route='batch')
+        except quality_gate.ImageQualityError as e:
+            results.append((item['item_index'], 'error', None, str(e)))
+            continue
+        except Exception:
+            pass   # unreadable: reported by the decode below
+        try:
+            load_image_uint8(item['path'], FULL_IMG_SIZE, out=batch[len(decoded)])
+            decoded.append(item)
+        except Exception as e:
+            results.append((item['item_index'], 'error', None, f"Could not read image: {str(e)}"))
+
+    if decoded:
+        features = None
+        if needs_embedding(trained_labels, labels):
+            probabilities, features = predict_batch('full_features', batch[:len(decoded)])
+        else:
+            probabilities = predict_batch('full', batch[:len(decoded)])
+        for i, (item, row) in enumerate(zip(decoded, probabilities)):
+            row = np.pad(row, (0, len(labels) - len(row)))
+            if features is not None:
+                embedding = np.asarray(features[i], dtype=np.float32)
+                embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+                try:
+                    row, _ = apply_heads(row, embedding, labels, len(trained_labels))
+                except Exception as e:
+                    print(f"[WARN] Batch prototype head skipped: {str(e)}")
+            results.append((item['item_index'], 'done', json.dumps(_top_predictions(row, labels)), None))
+    return results
+
+
+def run_job(job, owner):
+    """Process a leased job until it is finished or the lease is lost."""
+    from inference import load_labels
+    from admission import inference_admission
+    from prototypes import extend_labels
+
+    trained_labels = load_labels()
+    labels = extend_labels(trained_labels)
+    print(f"[INFO] Batch job {job['id']}: {job['processed']}/{job['total']} done, resuming")
+    while True:
+        if not renew_batch_lease(job['id'], owner, time.time(), LEASE_SECONDS):
+            print(f"[WARN] Batch job {job['id']}: lease lost")
+            return
+        items = get_pending_batch_items(job['id'], BATCH_SIZE)
+        if not items:
+            break
+        inference_admission.yield_to_serving()
+        results = _process_items(items, trained_labels, labels)
+        predicted = [(top[0]['label'], top[0]['confidence'])
+                     for top in (json.loads(r[2]) for r in results if r[1] == 'done') if top]
+        success, message = save_batch_results(job['id'], owner, results, predicted)
+        if not success:
+            print(f"[WARN] Batch job {job['id']}: {message}")
+            return
+        for _, status, _, _ in results:
+            metrics.inc('batch_images_total', result=status)
+
+    finish_batch_job(job['id'], 'done')
+    metrics.inc('batch_jobs_total', status='done')
+    shutil.rmtree(os.path.join(BATCH_DIR, job['id']), ignore_errors=True)
+    print(f"[INFO] Batch job {job['id']} finished")
+
+
+def collect_orphaned_dirs(now=None):
+    """
+    Remove job directories under BATCH_DIR that belong to no queued or
+    running job and are older than ORPHAN_MIN_AGE_SECONDS. Returns the
+    number removed.
+    """
+    if not os.path.exists(BATCH_DIR):
+        return 0
+    now = time.time() if now is None else now
+    active = get_active_batch_job_ids()
+    if active is None:
+        return 0
+    removed = 0
+    for entry in os.scandir(BATCH_DIR):
+        if not entry.is_dir() or entry.name in active:
+            continue
+        try:
+            if now - entry.stat().st_mtime < ORPHAN_MIN_AGE_SECONDS:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    if removed:
+        print(f"[INFO] Batch cleanup removed {removed} job directories")
+    return removed
+
+
+def _runner_loop(owner):
+    attempts = {}
+    last_cleanup = 0.0
+    while True:
+        job = None
+        try:
+            if time.time() - last_cleanup >= CLEANUP_INTERVAL_SECONDS:
+                last_cleanup = time.time()
+                collect_orphaned_dirs()
+            job = claim_batch_job(owner, time.time(), LEASE_SECONDS)
+            if job is not None:
+                run_job(job, owner)
+                continue
+        except Exception as e:
+            print(f"[ERROR] Batch runner: {str(e)}")
+            if job is not None:
+                # e.g. an inference worker restarting: the lease expires and the
+                # job is retried from its pending items, up to MAX_JOB_ATTEMPTS
+                attempts[job['id']] = attempts.get(job['id'], 0) + 1
+                if attempts[job['id']] >= MAX_JOB_ATTEMPTS:
+                    finish_batch_job(job['id'], 'failed')
+                    metrics.inc('batch_jobs_total', status='failed')
+                    shutil.rmtree(os.path.join(BATCH_DIR, job['id']), ignore_errors=True)
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+_runner_pid = None
+_runner_lock = threading.Lock()
+
+
+def start_runner():
+    """Start this process's batch runner thread (once per process)."""
+    global _runner_pid
+    if _runner_pid == os.getpid():
+        return
+    # Spawned inference workers re-import the app module; they never run jobs
+    if multiprocessing.parent_process() is not None:
+        return
+    with _runner_lock:
+        if _runner_pid == os.getpid():
+            return
+        _runner_pid = os.getpid()
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        threading.Thread(target=_runner_loop, args=(owner,), name='batch-runner', daemon=True).start()
+
+
+def job_progress(job):
+    """JSON-friendly progress summary of a job row."""
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'total': job['total'],
+        'processed': job['processed'],
+        'failed': job['failed'],
+        'percent': round(job['processed'] / job['total'] * 100, 1) if job['total'] else 100.0,
+    }
+
+
+def _iter_results(job_id):
+    """Yield (item row, predictions with botanical names) in upload order."""
+    botanical = {}
+    for item in iter_batch_job_items(job_id):
+        predictions = json.loads(item['predictions']) if item['predictions'] else []
+        for prediction in predictions:
+            label = prediction['label']
+            if label not in botanical:
+                plant = get_plant_by_name(label)
+                botanical[label] = plant['botanical_name'] if plant else ''
+            prediction['botanical_name'] = botanical[label]
+        yield item, predictions
+
+
+def iter_results_csv(job_id):
+    """Stream a job's results as CSV lines."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header = ['filename', 'status']
+    for rank in range(1, TOP_K + 1):
+        header += [f'top{rank}_label', f'top{rank}_confidence', f'top{rank}_botanical_name']
+    writer.writerow(header + ['error'])
+    for item, predictions in _iter_results(job_id):
+        row = [item['filename'], item['status']]
+        for rank in range(TOP_K):
+            if rank < len(predictions):
+                p = predictions[rank]
+                row += [p['label'], p['confidence'], p['botanical_name']]
+            else:
+                row += ['', '', '']
+        writer.writerow(row + [item['error'] or ''])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def iter_results_jsonl(job_id):
+    """Stream a job's results as JSON lines."""
+    for item, predictions in _iter_results(job_id):
+        yield json.dumps({
+            'filename': item['filename'],
+            'status': item['status'],
+            'predictions': predictions,
+            'error': item['error'],
+        }) + "\n"
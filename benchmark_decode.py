@@ -0,0 +1,80 @@
+"""
+Benchmark image decoding: keras load_img() vs image_io.decode_image().
+
+Usage:
+    python benchmark_decode.py                  # a few images from test/ and each dataset class
+    python benchmark_decode.py photo1.jpg dir/  # specific files or folders
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+from image_io import decode_image
+from plant_dataset import DATASET_PATH, IMAGE_EXTENSIONS
+
+TARGET_SIZE = (224, 224)
+REPEATS = 5
+
+
+def collect_images(args):
+    """Expand files/folders from the command line (or the defaults) into image paths."""
+    sources = args or ['test'] + [os.path.join(DATASET_PATH, d) for d in sorted(os.listdir(DATASET_PATH))
+                                  if os.path.isdir(os.path.join(DATASET_PATH, d))]
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            files = sorted(f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTENSIONS))
+            # Default folders contribute a few images each; explicit folders contribute all
+            paths.extend(os.path.join(source, f) for f in (files if args else files[:5]))
+        elif os.path.isfile(source):
+            paths.append(source)
+    return paths
+
+
+def keras_decode(path):
+    from tensorflow.keras.preprocessing import image as keras_image
+    img = keras_image.load_img(path, target_size=TARGET_SIZE)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def time_decoder(decoder, paths):
+    """Return median milliseconds per image over REPEATS passes."""
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for path in paths:
+            decoder(path)
+        timings.append((time.perf_counter() - start) * 1000 / len(paths))
+    return float(np.median(timings))
+
+
+if __name__ == '__main__':
+    paths = collect_images(sys.argv[1:])
+    if not paths:
+        print("❌ No images found")
+        sys.exit(1)
+
+    megapixels = []
+    for path in paths:
+        with Image.open(path) as img:
+            megapixels.append(img.size[0] * img.size[1] / 1e6)
+
+    print("="*70)
+    print(f"📷 Decoding {len(paths)} images to {TARGET_SIZE[0]}x{TARGET_SIZE[1]} "
+          f"(mean {np.mean(megapixels):.1f} MP, max {np.max(megapixels):.1f} MP)")
+    print("="*70)
+
+    # Warm up imports and file cache
+    keras_decode(paths[0])
+    decode_image(paths[0], TARGET_SIZE)
+
+    keras_ms = time_decoder(keras_decode, paths)
+    fast_ms = time_decoder(lambda p: decode_image(p, TARGET_SIZE), paths)
+
+    print(f"{'keras load_img':<25s} | {keras_ms:8.2f} ms/image")
+    print(f"{'image_io.decode_image':<25s} | {fast_ms:8.2f} ms/image")
+    print(f"{'speedup':<25s} | {keras_ms / fast_ms:8.2f}x")
+    print("="*70)
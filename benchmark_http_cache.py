@@ -0,0 +1,103 @@
+"""
+Benchmark catalog page and image serving with and without HTTP caching.
+
+Runs the Flask app in-process (test client) against a temporary database
+seeded with PLANTS synthetic plants and reports requests/sec for:
+
+    /user/plants   no caches        fragment dropped before every request, no validators
+    /user/plants   warm fragment    full 200 response, plant grid from the fragment cache
+    /user/plants   conditional      If-None-Match with the current ETag -> 304
+    /about         conditional      If-None-Match -> 304
+    upload image   full / 304       a content-addressed upload, sent in full vs revalidated
+
+Usage:
+    python benchmark_http_cache.py             # 200 plants, 2 s per case
+    python benchmark_http_cache.py 1000 5      # plants, seconds per case
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+os.environ.setdefault('PLANT_WARMUP', '0')
+
+import database
+
+PLANTS = 200
+SECONDS = 2.0
+
+
+def seed(count):
+    database.init_db()
+    for i in range(count):
+        database.add_plant(f"Plant {i:04d}", f"Plantus benchmarkii {i}",
+                           "Traditionally used for digestion, immunity and skin care. " * 4)
+
+
+def measure(client, path, headers=None, before=None, seconds=SECONDS, expect=200):
+    """Requests/sec for GET path over `seconds` (after a warm-up request)."""
+    response = client.get(path, headers=headers)
+    assert response.status_code == expect, f"{path}: {response.status_code}, expected {expect}"
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if before:
+            before()
+        client.get(path, headers=headers)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    plants = int(sys.argv[1]) if len(sys.argv) > 1 else PLANTS
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else SECONDS
+
+    workdir = tempfile.mkdtemp(prefix='http_cache_bench_')
+    database.DATABASE = os.path.join(workdir, 'bench.db')
+    seed(plants)
+
+    from app import app
+    from http_cache import fragments
+    from upload_store import store_upload
+
+    client = app.test_client()
+    etag = client.get('/user/plants').headers['ETag']
+    about_etag = client.get('/about').headers['ETag']
+
+    # A stored upload (any image from test/ or the dataset)
+    image_url = None
+    for root in ('test', 'dataset'):
+        for dirpath, _, filenames in os.walk(root):
+            images = [f for f in filenames if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+            if images:
+                with open(os.path.join(dirpath, images[0]), 'rb') as f:
+                    stored = store_upload(f, images[0])
+                image_url = '/static/' + stored.static_path
+                break
+        if image_url:
+            break
+
+    print(f"Catalog: {plants} plants, {seconds:.0f} s per case\n")
+    results = [
+        ('/user/plants  no caches', measure(client, '/user/plants', before=fragments.invalidate, seconds=seconds)),
+        ('/user/plants  warm fragment', measure(client, '/user/plants', seconds=seconds)),
+        ('/user/plants  conditional 304', measure(client, '/user/plants', headers={'If-None-Match': etag},
+                                                  seconds=seconds, expect=304)),
+        ('/about        conditional 304', measure(client, '/about', headers={'If-None-Match': about_etag},
+                                                  seconds=seconds, expect=304)),
+    ]
+    if image_url:
+        image_etag = client.get(image_url).headers['ETag']
+        print(f"Image {image_url}: Cache-Control: {client.get(image_url).headers['Cache-Control']}")
+        results.append(('upload image  full', measure(client, image_url, seconds=seconds)))
+        results.append(('upload image  conditional 304', measure(client, image_url, seconds=seconds, expect=304,
+                                                                 headers={'If-None-Match': image_etag})))
+
+    baseline = results[0][1]
+    print(f"{'Case':<34}{'req/s':>10}{'vs no caches':>15}")
+    for name, rate in results:
+        print(f"{name:<34}{rate:>10.0f}{rate / baseline:>14.1f}x")
+
+    shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,237 @@
+"""
+Per-epoch checkpoints, automatic resume and a wall-clock budget for training.
+
+After every completed epoch TrainingCheckpoint writes
+models/checkpoints/<name>/epoch_NNNN/ containing:
+
+    model.h5     weights and optimizer state (learning rate included)
+    state.json   epoch and its logs, best monitored value, the state of the
+                 EarlyStopping / ReduceLROnPlateau callbacks and the data
+                 iterator position (shuffle seed, batches seen, index order)
+
+The directory is written under a .tmp name and renamed into place, and
+latest.json (also replaced atomically) is only updated afterwards, so a
+crash at any point leaves the previous checkpoint intact. The best epoch
+so far is additionally kept as best.h5.
+
+A checkpoint is only resumed when its fingerprint (dataset manifest and
+model configuration) matches the current run, so adding images or changing
+the architecture starts training afresh.
+
+TimeBudget stops training cleanly when a deadline passes. An epoch cut
+short by the budget is not checkpointed, so resuming repeats it in full.
+"""
+
+import os
+import json
+import time
+import shutil
+import numpy as np
+from tensorflow.keras.callbacks import Callback
+
+CHECKPOINT_DIR = "models/checkpoints"
+
+# Callback attributes that make up their resumable state
+CALLBACK_STATE_ATTRS = ('wait', 'best', 'stopped_epoch', 'best_epoch', 'cooldown_counter')
+
+
+def parse_duration(text):
+    """Parse '5400', '90m', '1.5h' or '45s' into seconds."""
+    text = str(text).strip().lower()
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def _json_value(value):
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    return value
+
+
+class TimeBudget(Callback):
+    """Stop training once time.monotonic() passes `deadline`."""
+
+    def __init__(self, deadline):
+        super().__init__()
+        self.deadline = deadline
+        self.exhausted = False
+        self.interrupted_epoch = False
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.interrupted_epoch = False
+
+    def on_train_batch_end(self, batch, logs=None):
+        if time.monotonic() >= self.deadline:
+            self.exhausted = True
+            self.interrupted_epoch = True
+            self.model.stop_training = True
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self.exhausted and time.monotonic() >= self.deadline:
+            self.exhausted = True
+            self.model.stop_training = True
+
+
+class TrainingCheckpoint(Callback):
+    """
+    Atomic per-epoch checkpoints of one training run, resumable across processes.
+
+    Usage:
+        checkpoint = TrainingCheckpoint('full', fingerprint)
+        seed = checkpoint.seed                        # for flow_from_directory(seed=...)
+        model = checkpoint.resume_model() or build_model(...)
+        checkpoint.attach(train_data, [early_stop, reduce_lr], budget)
+        model.fit(..., initial_epoch=checkpoint.initial_epoch,
+                  callbacks=[early_stop, reduce_lr, ..., checkpoint])
+    The checkpoint must come after the callbacks it restores, since their
+    on_train_begin resets their state.
+    """
+
+    def __init__(self, name, fingerprint, monitor='val_loss', checkpoint_dir=CHECKPOINT_DIR):
+        super().__init__()
+        self.name = name
+        self.fingerprint = fingerprint
+        self.monitor = monitor
+        self.dir = os.path.join(checkpoint_dir, name)
+        self.best_path = os.path.join(self.dir, "best.h5")
+        self.iterator = None
+        self.callbacks = []
+        self.budget = None
+        self.state = self._load_state()
+        self.best = self.state['best'] if self.state else np.inf
+        self.seed = self.state['seed'] if self.state else int(time.time()) % (2 ** 31)
+
+    @property
+    def initial_epoch(self):
+        return self.state['epoch'] + 1 if self.state else 0
+
+    def _load_state(self):
+        latest_path = os.path.join(self.dir, "latest.json")
+        if not os.path.exists(latest_path):
+            return None
+        try:
+            with open(latest_path) as f:
+                latest = json.load(f)
+            with open(os.path.join(self.dir, latest['checkpoint'], "state.json")) as f:
+                state = json.load(f)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] Ignoring unreadable checkpoint in {self.dir}: {str(e)}")
+            return None
+        if state.get('fingerprint') != self.fingerprint:
+            print(f"[INFO] Checkpoint in {self.dir} is for a different dataset/model; starting fresh")
+            return None
+        state['path'] = os.path.join(self.dir, latest['checkpoint'])
+        return state
+
+    def resume_model(self):
+        """The checkpointed model with its optimizer state, or None to start fresh."""
+        if not self.state:
+            return None
+        from tensorflow.keras.models import load_model
+        print(f"[INFO] Resuming '{self.name}' training after epoch {self.state['epoch'] + 1} "
+              f"from {self.state['path']}")
+        return load_model(os.path.join(self.state['path'], "model.h5"))
+
+    def attach(self, iterator=None, callbacks=(), budget=None):
+        """Register the data iterator and callbacks whose state is checkpointed."""
+        self.iterator = iterator
+        self.callbacks = list(callbacks)
+        self.budget = budget
+
+    # -- restore ----------------------------------------------------------
+
+    def on_train_begin(self, logs=None):
+        if not self.state:
+            return
+        for callback, saved in zip(self.callbacks, self.state['callbacks']):
+            for attr, value in saved.items():
+                setattr(callback, attr, value)
+            if getattr(callback, 'restore_best_weights', False) and os.path.exists(self.best_path):
+                # EarlyStopping keeps its best weights in memory; rebuild them from best.h5
+                current = self.model.get_weights()
+                self.model.load_weights(self.best_path)
+                callback.best_weights = self.model.get_weights()
+                self.model.set_weights(current)
+        if self.iterator is not None and self.state.get('iterator'):
+            saved = self.state['iterator']
+            self.iterator.total_batches_seen = saved['total_batches_seen']
+            self.iterator.index_array = np.array(saved['index_array']) if saved['index_array'] else None
+            self.iterator.batch_index = 0
+
+    # -- save -------------------------------------------------------------
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.budget is not None and self.budget.interrupted_epoch:
+            return
+        logs = logs or {}
+        current = logs.get(self.monitor)
+        improved = current is not None and current < self.best
+        if improved:
+            self.best = float(current)
+
+        os.makedirs(self.dir, exist_ok=True)
+        checkpoint = f"epoch_{epoch + 1:04d}"
+        final_dir = os.path.join(self.dir, checkpoint)
+        tmp_dir = final_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        self.model.save(os.path.join(tmp_dir, "model.h5"))
+        state = {
+            'fingerprint': self.fingerprint,
+            'epoch': epoch,
+            'best': self.best,
+            'seed': self.seed,
+            'callbacks': [{attr: _json_value(getattr(cb, attr)) for attr in CALLBACK_STATE_ATTRS
+                           if hasattr(cb, attr)} for cb in self.callbacks],
+            'iterator': None,
+            'logs': {k: float(v) for k, v in logs.items()},
+            'saved_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if self.iterator is not None:
+            index_array = getattr(self.iterator, 'index_array', None)
+            state['iterator'] = {
+                'total_batches_seen': int(self.iterator.total_batches_seen),
+                'index_array': index_array.tolist() if index_array is not None else None,
+            }
+        with open(os.path.join(tmp_dir, "state.json"), 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+        if improved:
+            shutil.copyfile(os.path.join(final_dir, "model.h5"), self.best_path + ".tmp")
+            os.replace(self.best_path + ".tmp", self.best_path)
+
+        latest_tmp = os.path.join(self.dir, "latest.json.tmp")
+        with open(latest_tmp, 'w') as f:
+            json.dump({'checkpoint': checkpoint, 'epoch': epoch}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(latest_tmp, os.path.join(self.dir, "latest.json"))
+
+        # Older epochs are no longer needed once latest.json points past them
+        for entry in os.listdir(self.dir):
+            if entry.startswith("epoch_") and entry != checkpoint:
+                shutil.rmtree(os.path.join(self.dir, entry), ignore_errors=True)
+        state['path'] = final_dir
+        self.state = state
+
+    # -- finish -----------------------------------------------------------
+
+    def load_best_weights(self, model):
+        """Load the best checkpointed weights into model (no-op without one)."""
+        if os.path.exists(self.best_path):
+            model.load_weights(self.best_path)
+            return True
+        return False
+
+    def clear(self):
+        """Remove this run's checkpoints (after it completed, or to start over)."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.state = None
+        self.best = np.inf
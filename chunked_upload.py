@@ -0,0 +1,267 @@
+"""
+Resumable chunked uploads for large dataset archives.
+
+A normal form upload has to fit in MAX_CONTENT_LENGTH and is lost if the
+connection drops. Here the browser sends the file in CHUNK_SIZE pieces:
+
+    POST   /admin/upload_dataset/chunked              {filename, size[, sha256]}
+           -> {upload_id, chunk_size, offset}
+    GET    /admin/upload_dataset/chunked/<id>         -> {offset, size, ...}   (resume point)
+    PUT    /admin/upload_dataset/chunked/<id>?offset=N   raw chunk bytes,
+           X-Chunk-Checksum: sha256=<hex> | crc32=<hex>
+           -> {offset}
+    POST   /admin/upload_dataset/chunked/<id>/complete
+    DELETE /admin/upload_dataset/chunked/<id>
+
+Each upload is a directory under uploads/.chunked/<id>/ holding meta.json
+and data.part. A chunk is streamed from the request into data.part at its
+offset in 1 MB pieces while being hashed, so memory use does not depend on
+the chunk or file size. Only when the checksum matches is the file fsynced
+and the confirmed offset in meta.json advanced (meta.json is replaced
+atomically); a bad or interrupted chunk is truncated away and the client
+resends from the confirmed offset. A per-upload flock keeps two requests
+(possibly in different gunicorn workers) from writing the same upload.
+
+On completion data.part is checked against the optional whole-file
+SHA-256 and renamed into uploads/ (same filesystem, so the archive appears
+atomically) before the caller registers it with save_dataset().
+Unfinished uploads are removed after CHUNKED_UPLOAD_MAX_AGE_HOURS.
+"""
+
+import os
+import json
+import time
+import uuid
+import zlib
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+UPLOAD_FOLDER = 'uploads'
+CHUNKED_DIR = os.path.join(UPLOAD_FOLDER, '.chunked')
+CHUNK_SIZE = 8 * 1024 * 1024  # must stay below the app's MAX_CONTENT_LENGTH
+MAX_UPLOAD_BYTES = int(os.environ.get('DATASET_MAX_UPLOAD_BYTES', 20 * 1024 * 1024 * 1024))
+CHUNKED_UPLOAD_MAX_AGE_HOURS = float(os.environ.get('CHUNKED_UPLOAD_MAX_AGE_HOURS', 24))
+READ_SIZE = 1024 * 1024
+
+
+class ChunkError(ValueError):
+    """A rejected chunked-upload request; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _upload_dir(upload_id):
+    # Ids are generated by us as uuid4 hex; anything else is not an upload
+    if not upload_id.isalnum():
+        raise ChunkError("Unknown upload", 404)
+    path = os.path.join(CHUNKED_DIR, upload_id)
+    if not os.path.isdir(path):
+        raise ChunkError("Unknown upload", 404)
+    return path
+
+
+def _read_meta(upload_dir):
+    with open(os.path.join(upload_dir, 'meta.json')) as f:
+        return json.load(f)
+
+
+def _write_meta(upload_dir, meta):
+    tmp_path = os.path.join(upload_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(upload_dir, 'meta.json'))
+
+
+@contextmanager
+def _locked(upload_dir):
+    with open(os.path.join(upload_dir, 'lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ChunkError("Another request is writing this upload", 409)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _status(upload_id, meta):
+    return {
+        'upload_id': upload_id,
+        'filename': meta['original_filename'],
+        'size': meta['size'],
+        'offset': meta['offset'],
+        'chunk_size': meta['chunk_size'],
+    }
+
+
+def collect_stale_uploads(max_age_hours=CHUNKED_UPLOAD_MAX_AGE_HOURS):
+    """
+    Remove unfinished uploads not written to for max_age_hours. Returns the
+    number removed. A directory without meta.json (e.g. the temp directory
+    of a create_upload() that died) is judged by its own mtime, so an
+    upload that another request is creating right now is never removed.
+    """
+    if not os.path.isdir(CHUNKED_DIR):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for upload_id in os.listdir(CHUNKED_DIR):
+        path = os.path.join(CHUNKED_DIR, upload_id)
+        try:
+            mtime = os.path.getmtime(os.path.join(path, 'meta.json'))
+        except OSError:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+        if mtime < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def create_upload(filename, size, allowed_extensions, sha256=None):
+    """Start a chunked upload. Returns its status dict."""
+    original_filename = secure_filename(filename or '')
+    if '.' not in original_filename or original_filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
+        raise ChunkError(f'File type not allowed. Allowed types: {", ".join(sorted(allowed_extensions))}')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ChunkError("The file size is required")
+    if size <= 0:
+        raise ChunkError("The file is empty")
+    if size > MAX_UPLOAD_BYTES:
+        raise ChunkError(f"File size exceeds {MAX_UPLOAD_BYTES / (1024 ** 3):.0f} GB limit", 413)
+    if sha256 is not None and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256.lower())):
+        raise ChunkError("sha256 must be a hex digest")
+
+    collect_stale_uploads()
+    upload_id = uuid.uuid4().hex
+    # Built in a temp directory and renamed into place, so an upload directory
+    # always has its meta.json (and the temp name is never a valid upload id)
+    tmp_dir = os.path.join(CHUNKED_DIR, f".new-{upload_id}")
+    os.makedirs(tmp_dir)
+    try:
+        open(os.path.join(tmp_dir, 'data.part'), 'wb').close()
+        meta = {
+            'original_filename': original_filename,
+            'size': size,
+            'sha256': sha256.lower() if sha256 else None,
+            'offset': 0,
+            'chunk_size': CHUNK_SIZE,
+            'created_at': time.time(),
+        }
+        _write_meta(tmp_dir, meta)
+        os.rename(tmp_dir, os.path.join(CHUNKED_DIR, upload_id))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return _status(upload_id, meta)
+
+
+def upload_status(upload_id):
+    """The confirmed offset to resume from, with the upload's size and chunk size."""
+    return _status(upload_id, _read_meta(_upload_dir(upload_id)))
+
+
+def _parse_checksum(header):
+    algorithm, _, expected = (header or '').partition('=')
+    algorithm = algorithm.strip().lower()
+    if algorithm not in ('sha256', 'crc32') or not expected:
+        raise ChunkError("X-Chunk-Checksum must be sha256=<hex> or crc32=<hex>")
+    return algorithm, expected.strip().lower()
+
+
+def write_chunk(upload_id, offset, stream, checksum_header):
+    """
+    Append one chunk read from `stream` at `offset`, which must be the
+    confirmed offset. Returns the new status; on a checksum mismatch the
+    partial chunk is discarded and ChunkError is raised.
+    """
+    upload_dir = _upload_dir(upload_id)
+    algorithm, expected = _parse_checksum(checksum_header)
+    with _locked(upload_dir):
+        meta = _read_meta(upload_dir)
+        if offset != meta['offset']:
+            raise ChunkError(f"Expected offset {meta['offset']}", 409, offset=meta['offset'])
+        limit = min(meta['chunk_size'], meta['size'] - offset)
+
+        digest = hashlib.sha256() if algorithm == 'sha256' else None
+        crc = 0
+        written = 0
+        with open(os.path.join(upload_dir, 'data.part'), 'r+b') as part:
+            part.seek(offset)
+            part.truncate()
+            try:
+                while True:
+                    data = stream.read(READ_SIZE)
+                    if not data:
+                        break
+                    written += len(data)
+                    if written > limit:
+                        raise ChunkError(f"Chunk larger than {limit} bytes", 413)
+                    if digest is not None:
+                        digest.update(data)
+                    else:
+                        crc = zlib.crc32(data, crc)
+                    part.write(data)
+                actual = digest.hexdigest() if digest is not None else f"{crc:08x}"
+                if written == 0:
+                    raise ChunkError("Empty chunk")
+                if actual != expected.zfill(len(actual)):
+                    raise ChunkError("Chunk checksum mismatch, resend it", 422, offset=offset)
+                part.flush()
+                os.fsync(part.fileno())
+            except BaseException:
+                # Drop whatever part of the chunk reached the file
+                part.seek(offset)
+                part.truncate()
+                raise
+
+        meta['offset'] = offset + written
+        _write_meta(upload_dir, meta)
+        return _status(upload_id, meta)
+
+
+def complete_upload(upload_id):
+    """
+    Verify a fully uploaded file and move it into uploads/ atomically.
+    Returns (filename, original_filename, file_path, file_size) for save_dataset().
+    """
+    upload_dir = _upload_dir(upload_id)
+    with _locked(upload_dir):
+        meta = _read_meta(upload_dir)
+        if meta['offset'] != meta['size']:
+            raise ChunkError(f"Upload incomplete ({meta['offset']}/{meta['size']} bytes)", 409,
+                             offset=meta['offset'])
+        part_path = os.path.join(upload_dir, 'data.part')
+        if meta['sha256']:
+            digest = hashlib.sha256()
+            with open(part_path, 'rb') as part:
+                for data in iter(lambda: part.read(READ_SIZE), b''):
+                    digest.update(data)
+            if digest.hexdigest() != meta['sha256']:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+                raise ChunkError("File checksum mismatch, the upload was discarded", 422)
+
+        filename = datetime.now().strftime('%Y%m%d_%H%M%S_') + meta['original_filename']
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        os.replace(part_path, file_path)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    return filename, meta['original_filename'], file_path, meta['size']
+
+
+def abort_upload(upload_id):
+    shutil.rmtree(_upload_dir(upload_id), ignore_errors=True)
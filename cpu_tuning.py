@@ -0,0 +1,322 @@
+"""
+CPU execution tuning for training and serving.
+
+`python cpu_tuning.py tune` benchmarks candidate execution settings and
+writes the fastest ones to cpu_profile.json:
+
+- oneDNN optimized kernels on/off (TF_ENABLE_ONEDNN_OPTS)
+- intra-op / inter-op thread pool sizes
+- mixed bfloat16 precision for training, only where the CPU has native
+  bf16 support (avx512_bf16 or amx_bf16)
+
+oneDNN is chosen when TensorFlow is imported, so every candidate runs in a
+fresh subprocess. Each subprocess measures single-image serving latency
+(ServingModel, batch 1) and the time of a short synthetic training run of
+the same MobileNetV2 classifier. The 'serving' and 'training' sections of
+the profile are picked independently.
+
+The app, wsgi.py, the inference workers and train_model.py apply the
+profile at startup:
+
+    apply_environment(role)   before `import tensorflow`
+    apply_threads(role)       before the TensorFlow runtime starts
+    apply_precision()         before building a model to train, inside a
+                              function decorated with @restores_precision
+
+Fallbacks: without a profile, or with one that cannot be read, TensorFlow
+defaults are used (oneDNN on). Thread counts are clamped to this machine's
+cores, and bf16 is switched off on CPUs without native support, so a
+profile copied to a different node is still safe to apply.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import functools
+import subprocess
+
+CPU_PROFILE_PATH = os.environ.get('CPU_PROFILE_PATH', 'cpu_profile.json')
+BENCH_IMG_SIZE = (224, 224)
+BENCH_NUM_CLASSES = 10
+BENCH_LATENCY_RUNS = 30
+BENCH_TRAIN_STEPS = 8
+BENCH_TRAIN_BATCH = 16
+BENCH_TIMEOUT_SECONDS = 900
+
+_environment_role = None
+
+
+def cpu_flags():
+    """CPU feature flags from /proc/cpuinfo (empty where unavailable)."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags') or line.startswith('Features'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def cpu_model():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def supports_bf16(flags=None):
+    """True if the CPU computes bfloat16 natively (otherwise bf16 is emulated and slow)."""
+    flags = cpu_flags() if flags is None else flags
+    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+
+
+def load_profile(path=CPU_PROFILE_PATH):
+    """The saved profile, or None if there is none or it cannot be read."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Ignoring unreadable CPU profile {path}: {str(e)}")
+        return None
+
+
+def profile_settings(role, profile=None):
+    """
+    Effective settings for 'serving' or 'training' on this machine:
+    {'onednn', 'intra_op_threads', 'inter_op_threads', 'mixed_bfloat16'}.
+    Values are None where TensorFlow's default should be kept.
+    """
+    profile = load_profile() if profile is None else profile
+    section = (profile or {}).get(role) or {}
+    cores = os.cpu_count() or 1
+
+    def clamp(value):
+        return max(1, min(int(value), cores)) if value else None
+
+    return {
+        'onednn': section.get('onednn'),
+        'intra_op_threads': clamp(section.get('intra_op_threads')),
+        'inter_op_threads': clamp(section.get('inter_op_threads')),
+        'mixed_bfloat16': bool(section.get('mixed_bfloat16')) and supports_bf16(),
+    }
+
+
+def apply_environment(role):
+    """
+    Set TF_ENABLE_ONEDNN_OPTS for `role`. Must run before TensorFlow is
+    imported; only the first call in a process has an effect, and an
+    explicit TF_ENABLE_ONEDNN_OPTS in the environment always wins.
+    """
+    global _environment_role
+    if _environment_role is not None or 'tensorflow' in sys.modules:
+        return
+    _environment_role = role
+    onednn = profile_settings(role)['onednn']
+    if onednn is not None:
+        os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1' if onednn else '0')
+
+
+def apply_threads(role, num_workers=1, intra=None, inter=None):
+    """
+    Size TensorFlow's thread pools from the profile (intra-op threads are
+    divided among num_workers processes). Explicit intra/inter values take
+    precedence. Returns the (intra, inter) counts applied (None = default).
+    """
+    import tensorflow as tf
+
+    settings = profile_settings(role)
+    if intra is None and settings['intra_op_threads']:
+        intra = max(1, settings['intra_op_threads'] // max(1, num_workers))
+    if inter is None:
+        inter = settings['inter_op_threads']
+    try:
+        if intra:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        # The runtime is already running (e.g. training inside the web app)
+        print(f"[WARN] TF thread pools already initialized: {str(e)}")
+    return intra, inter
+
+
+def apply_precision():
+    """Use mixed bfloat16 for models built from now on if the training profile asks for it. Returns True if enabled."""
+    from tensorflow.keras import mixed_precision
+
+    enabled = profile_settings('training')['mixed_bfloat16']
+    mixed_precision.set_global_policy('mixed_bfloat16' if enabled else 'float32')
+    return enabled
+
+
+def restores_precision(func):
+    """
+    Decorator restoring the global Keras precision policy when func returns
+    or raises. apply_precision() changes the policy process-wide, so a
+    training run inside the web process would otherwise leave every later
+    model build there (serving copies, embeddings, cached backbones) in bf16.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        from tensorflow.keras import mixed_precision
+
+        previous = mixed_precision.global_policy()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            mixed_precision.set_global_policy(previous)
+    return wrapper
+
+
+# ---------------------------------------------------------------------------
+# Tuning
+# ---------------------------------------------------------------------------
+
+def _bench(candidate):
+    """Run in a subprocess with the candidate's oneDNN setting already in the environment."""
+    import numpy as np
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(candidate['intra_op_threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(candidate['inter_op_threads'])
+
+    from tensorflow.keras import mixed_precision
+    from train_model import build_model
+    from serving import ServingModel
+
+    result = dict(candidate)
+
+    # Serving: single-image latency through the traced uint8 path
+    serving = ServingModel(build_model(BENCH_NUM_CLASSES, img_size=BENCH_IMG_SIZE, weights=None),
+                           img_size=BENCH_IMG_SIZE, buckets=(1,))
+    image = np.random.randint(0, 256, (1, BENCH_IMG_SIZE[0], BENCH_IMG_SIZE[1], 3), dtype=np.uint8)
+    timings = []
+    for _ in range(BENCH_LATENCY_RUNS):
+        start = time.perf_counter()
+        serving.predict(image)
+        timings.append((time.perf_counter() - start) * 1000)
+    result['serving_p50_ms'] = round(float(np.median(timings)), 3)
+
+    # Training: a few steps on synthetic data, float32 and (if native) bf16
+    images = np.random.randint(0, 256, (BENCH_TRAIN_BATCH * BENCH_TRAIN_STEPS,) + BENCH_IMG_SIZE + (3,),
+                               dtype=np.uint8)
+    labels = np.random.randint(0, BENCH_NUM_CLASSES, len(images))
+    for policy in (['float32', 'mixed_bfloat16'] if candidate['bf16_supported'] else ['float32']):
+        mixed_precision.set_global_policy(policy)
+        model = build_model(BENCH_NUM_CLASSES, img_size=BENCH_IMG_SIZE, weights=None)
+        model.fit(images[:BENCH_TRAIN_BATCH * 2], labels[:BENCH_TRAIN_BATCH * 2],
+                  batch_size=BENCH_TRAIN_BATCH, epochs=1, verbose=0)   # trace
+        start = time.perf_counter()
+        history = model.fit(images, labels, batch_size=BENCH_TRAIN_BATCH, epochs=1, verbose=0)
+        step_ms = (time.perf_counter() - start) * 1000 / BENCH_TRAIN_STEPS
+        if np.isfinite(history.history['loss'][-1]):
+            result[f'train_step_ms_{policy}'] = round(step_ms, 3)
+    mixed_precision.set_global_policy('float32')
+    return result
+
+
+def _candidates():
+    cores = os.cpu_count() or 1
+    thread_counts = sorted({cores, max(1, cores // 2), max(1, cores // 4)}, reverse=True)
+    bf16 = supports_bf16()
+    return [{'onednn': onednn, 'intra_op_threads': intra, 'inter_op_threads': inter, 'bf16_supported': bf16}
+            for onednn in (True, False)
+            for intra in thread_counts
+            for inter in (1, 2)]
+
+
+def run_candidate(candidate):
+    """Benchmark one candidate in a fresh interpreter. Returns its result or None."""
+    env = dict(os.environ, TF_ENABLE_ONEDNN_OPTS='1' if candidate['onednn'] else '0', TF_CPP_MIN_LOG_LEVEL='2')
+    try:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '_bench', json.dumps(candidate)],
+                                   env=env, capture_output=True, text=True, timeout=BENCH_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        print("  timed out")
+        return None
+    if completed.returncode != 0:
+        print(f"  failed: {completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else completed.returncode}")
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def tune(path=CPU_PROFILE_PATH):
+    """Benchmark all candidates and save the fastest serving and training settings."""
+    candidates = _candidates()
+    print(f"[INFO] CPU: {cpu_model()} ({os.cpu_count()} logical cores, "
+          f"bf16 {'supported' if supports_bf16() else 'not supported'})")
+    results = []
+    for i, candidate in enumerate(candidates, 1):
+        print(f"[{i}/{len(candidates)}] oneDNN={'on' if candidate['onednn'] else 'off'} "
+              f"intra={candidate['intra_op_threads']} inter={candidate['inter_op_threads']}")
+        result = run_candidate(candidate)
+        if result is not None:
+            print(f"  serving p50 {result['serving_p50_ms']} ms, train step "
+                  f"{result.get('train_step_ms_float32')} ms fp32"
+                  + (f", {result['train_step_ms_mixed_bfloat16']} ms bf16"
+                     if 'train_step_ms_mixed_bfloat16' in result else ""))
+            results.append(result)
+
+    if not results:
+        print("❌ Every benchmark failed; keeping TensorFlow defaults (no profile written)")
+        return None
+
+    serving = min(results, key=lambda r: r['serving_p50_ms'])
+    training_options = []
+    for r in results:
+        for policy in ('float32', 'mixed_bfloat16'):
+            if f'train_step_ms_{policy}' in r:
+                training_options.append((r[f'train_step_ms_{policy}'], r, policy))
+    step_ms, training, policy = min(training_options, key=lambda o: o[0])
+
+    profile = {
+        'cpu': {'model': cpu_model(), 'logical_cores': os.cpu_count(), 'bf16': supports_bf16()},
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'serving': {
+            'onednn': serving['onednn'],
+            'intra_op_threads': serving['intra_op_threads'],
+            'inter_op_threads': serving['inter_op_threads'],
+            'mixed_bfloat16': False,
+            'p50_ms': serving['serving_p50_ms'],
+        },
+        'training': {
+            'onednn': training['onednn'],
+            'intra_op_threads': training['intra_op_threads'],
+            'inter_op_threads': training['inter_op_threads'],
+            'mixed_bfloat16': policy == 'mixed_bfloat16',
+            'step_ms': step_ms,
+        },
+        'results': results,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=4)
+    os.replace(tmp_path, path)
+
+    print(f"\n✅ Profile written to {path}")
+    for role in ('serving', 'training'):
+        print(f"  {role}: {profile[role]}")
+    return profile
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '_bench':
+        print(json.dumps(_bench(json.loads(sys.argv[2]))))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'tune':
+        tune()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'show':
+        for role in ('serving', 'training'):
+            print(f"{role}: {profile_settings(role)}")
+    else:
+        print("Usage:")
+        print("  python cpu_tuning.py tune   # Benchmark and write cpu_profile.json")
+        print("  python cpu_tuning.py show   # Settings that would be applied on this machine")
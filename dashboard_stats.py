@@ -0,0 +1,123 @@
+"""
+Admin dashboard statistics, read from incrementally maintained rollups.
+
+Counting users, uploads or predictions per request would mean scanning
+users, datasets and dataset/ on every dashboard view. Instead the
+stats_rollup table (database.py) keeps running totals:
+
+- users and datasets: SQLite triggers add each insert/delete to the
+  totals and to the per-day signup/upload counts.
+- predictions: the prediction routes call record_predictions() and batch
+  jobs pass theirs to save_batch_results(), adding the count and the
+  confidence sum per day and per predicted class.
+- dataset images: register_class() and the gallery's bulk move/delete
+  apply per-class deltas with adjust_dataset_stats(). Files copied into
+  dataset/ by hand are picked up by recount_dataset() (the dashboard's
+  Recount button), which scans the folder once and replaces the rollup.
+- shadow comparisons: triggers on shadow_results keep per-candidate sums,
+  so the dashboard card doesn't aggregate the comparisons either.
+
+snapshot() reads DASHBOARD_DAYS days of per-day rows plus the totals and
+per-class rows, so the dashboard costs the same however large the tables
+and the dataset grow.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+from plant_dataset import DATASET_PATH, IMAGE_EXTENSIONS
+from database import get_rollups, replace_dataset_stats
+
+DASHBOARD_DAYS = 14
+
+
+def scan_dataset():
+    """{class_name: (images, bytes)} for every class folder under dataset/."""
+    counts = {}
+    if not os.path.exists(DATASET_PATH):
+        return counts
+    for class_entry in os.scandir(DATASET_PATH):
+        if not class_entry.is_dir() or class_entry.name.startswith('.'):
+            continue
+        images = size = 0
+        for entry in os.scandir(class_entry.path):
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                images += 1
+                size += entry.stat().st_size
+        counts[class_entry.name] = (images, size)
+    return counts
+
+
+def recount_dataset():
+    """Rebuild the dataset rollups from a scan of dataset/. Returns (bool, message)."""
+    return replace_dataset_stats(scan_dataset())
+
+
+def _average(confidence_sum, count):
+    return round(confidence_sum / count, 2) if count else None
+
+
+def snapshot(days=DASHBOARD_DAYS):
+    """
+    {'totals': {...}, 'days': [{'day', 'users', 'uploads', 'predictions',
+    'avg_confidence'}], 'classes': [{'name', 'images', 'bytes', 'predictions',
+    'avg_confidence'}], 'dataset_counted_at'}
+
+    Counts are ints and confidences percentages; days run oldest first and
+    include days without activity.
+    """
+    today = datetime.now(timezone.utc).date()
+    first_day = today - timedelta(days=days - 1)
+    rows = get_rollups(first_day.isoformat())
+
+    if not any(r['scope'] == 'meta' and r['metric'] == 'dataset_counted_at' for r in rows):
+        # First view since the rollups were added: count the dataset once
+        success, message = recount_dataset()
+        print(f"[{'INFO' if success else 'WARN'}] Dashboard statistics: {message}")
+        rows = get_rollups(first_day.isoformat())
+
+    scopes = {'total': {}, 'day': {}, 'class': {}, 'meta': {}}
+    for r in rows:
+        scopes[r['scope']].setdefault(r['key'], {})[r['metric']] = r['value']
+    totals = scopes['total'].get('', {})
+    meta = scopes['meta'].get('', {})
+
+    day_list = []
+    for offset in range(days):
+        day = (first_day + timedelta(days=offset)).isoformat()
+        values = scopes['day'].get(day, {})
+        day_list.append({
+            'day': day,
+            'users': int(values.get('users', 0)),
+            'uploads': int(values.get('uploads', 0)),
+            'predictions': int(values.get('predictions', 0)),
+            'avg_confidence': _average(values.get('confidence_sum', 0), values.get('predictions', 0)),
+        })
+
+    classes = []
+    for name, values in sorted(scopes['class'].items()):
+        classes.append({
+            'name': name,
+            'images': int(values.get('images', 0)),
+            'bytes': int(values.get('bytes', 0)),
+            'predictions': int(values.get('predictions', 0)),
+            'avg_confidence': _average(values.get('confidence_sum', 0), values.get('predictions', 0)),
+        })
+
+    counted_at = meta.get('dataset_counted_at')
+    return {
+        'totals': {
+            'users': int(totals.get('users', 0)),
+            'uploads': int(totals.get('uploads', 0)),
+            'upload_bytes': int(totals.get('upload_bytes', 0)),
+            'dataset_images': int(totals.get('dataset_images', 0)),
+            'dataset_bytes': int(totals.get('dataset_bytes', 0)),
+            'classes': sum(1 for c in classes if c['images'] > 0),
+            'predictions': int(totals.get('predictions', 0)),
+            'avg_confidence': _average(totals.get('confidence_sum', 0), totals.get('predictions', 0)),
+        },
+        'days': day_list,
+        'classes': classes,
+        'dataset_counted_at': (datetime.fromtimestamp(counted_at, timezone.utc).strftime('%Y-%m-%d %H:%M UTC')
+                               if counted_at else None),
+    }
@@ -1,9 +1,57 @@
 import sqlite3
 import os
 from werkzeug.security import generate_password_hash, check_password_hash
+from metrics import timed_function
 
 DATABASE = 'users.db'
 
+# Called after add_plant/update_plant/delete_plant commit (e.g. to drop cached pages)
+_catalog_listeners = []
+
+# (trigger name, event, table, VALUES rows added to stats_rollup)
+_ROLLUP_TRIGGERS = [
+    ('users_rollup_insert', 'INSERT', 'users',
+     "('total', '', 'users', 1), ('day', date(NEW.created_at), 'users', 1)"),
+    ('users_rollup_delete', 'DELETE', 'users',
+     "('total', '', 'users', -1)"),
+    ('datasets_rollup_insert', 'INSERT', 'datasets',
+     "('total', '', 'uploads', 1), ('total', '', 'upload_bytes', COALESCE(NEW.file_size, 0)), "
+     "('day', date(NEW.uploaded_at), 'uploads', 1)"),
+    ('datasets_rollup_delete', 'DELETE', 'datasets',
+     "('total', '', 'uploads', -1), ('total', '', 'upload_bytes', -COALESCE(OLD.file_size, 0))"),
+    ('shadow_rollup_insert', 'INSERT', 'shadow_results',
+     "('shadow', NEW.candidate_version, 'count', 1), "
+     "('shadow', NEW.candidate_version, 'agree', NEW.candidate_label = NEW.production_label), "
+     "('shadow', NEW.candidate_version, 'confidence_shift', NEW.candidate_confidence - NEW.production_confidence), "
+     "('shadow', NEW.candidate_version, 'latency_diff_ms', NEW.candidate_ms - NEW.production_ms)"),
+    ('shadow_rollup_delete', 'DELETE', 'shadow_results',
+     "('shadow', OLD.candidate_version, 'count', -1), "
+     "('shadow', OLD.candidate_version, 'agree', -(OLD.candidate_label = OLD.production_label)), "
+     "('shadow', OLD.candidate_version, 'confidence_shift', OLD.production_confidence - OLD.candidate_confidence), "
+     "('shadow', OLD.candidate_version, 'latency_diff_ms', OLD.production_ms - OLD.candidate_ms)"),
+]
+
+# SELECTs that build the rollups from rows that existed before the triggers
+_ROLLUP_SEED = [
+    "SELECT 'total', '', 'users', COUNT(*) FROM users",
+    "SELECT 'day', date(created_at), 'users', COUNT(*) FROM users GROUP BY date(created_at)",
+    "SELECT 'total', '', 'uploads', COUNT(*) FROM datasets",
+    "SELECT 'total', '', 'upload_bytes', COALESCE(SUM(file_size), 0) FROM datasets",
+    "SELECT 'day', date(uploaded_at), 'uploads', COUNT(*) FROM datasets GROUP BY date(uploaded_at)",
+    "SELECT 'shadow', candidate_version, 'count', COUNT(*) FROM shadow_results GROUP BY candidate_version",
+    "SELECT 'shadow', candidate_version, 'agree', SUM(candidate_label = production_label) "
+    "FROM shadow_results GROUP BY candidate_version",
+    "SELECT 'shadow', candidate_version, 'confidence_shift', SUM(candidate_confidence - production_confidence) "
+    "FROM shadow_results GROUP BY candidate_version",
+    "SELECT 'shadow', candidate_version, 'latency_diff_ms', SUM(candidate_ms - production_ms) "
+    "FROM shadow_results GROUP BY candidate_version",
+]
+
+_ROLLUP_ADD = '''
+    INSERT INTO stats_rollup (scope, key, metric, value) VALUES (?, ?, ?, ?)
+    ON CONFLICT (scope, key, metric) DO UPDATE SET value = value + excluded.value
+'''
+
 def get_db_connection():
     """Connect to SQLite database."""
     conn = sqlite3.connect(DATABASE)
@@ -52,10 +100,122 @@ def init_db():
         )
     ''')
     
+    # Catalog version, bumped by triggers on every plants change so that
+    # deletions and writes from any process invalidate cached pages (see http_cache.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO catalog_meta (id) VALUES (1)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plants_catalog_{event.lower()} AFTER {event} ON plants
+            BEGIN
+                UPDATE catalog_meta SET version = version + 1, changed_at = CURRENT_TIMESTAMP WHERE id = 1;
+            END
+        ''')
+    
+    # Background batch identification jobs (see batch_jobs.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER NOT NULL,
+            processed INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_job_items (
+            job_id TEXT NOT NULL,
+            item_index INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            predictions TEXT,
+            error TEXT,
+            PRIMARY KEY (job_id, item_index)
+        )
+    ''')
+    
+    # Content hashes of dataset images, keying the gallery thumbnail cache (see dataset_gallery.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dataset_images (
+            path TEXT PRIMARY KEY,
+            class_name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_dataset_images_sha256 ON dataset_images (sha256)')
+    
+    # Production vs candidate model comparisons (see shadow.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shadow_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            candidate_version TEXT NOT NULL,
+            source TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            production_label TEXT NOT NULL,
+            production_confidence REAL NOT NULL,
+            production_ms REAL NOT NULL,
+            candidate_label TEXT NOT NULL,
+            candidate_confidence REAL NOT NULL,
+            candidate_ms REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_shadow_results_version
+        ON shadow_results (candidate_version, production_label)
+    ''')
+    
+    # Dashboard rollups (see dashboard_stats.py): running totals per
+    # (scope, key, metric), where scope is 'total' (key ''), 'day' (key
+    # YYYY-MM-DD, UTC), 'class' (key = plant class) or 'shadow' (key =
+    # candidate version). users, datasets and shadow_results keep theirs
+    # current through triggers; predictions and dataset images are added
+    # by their write paths.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_rollup (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key, metric)
+        )
+    ''')
+    # The marker, triggers and the one-off seed from existing rows commit
+    # together, so no row is counted twice or missed
+    cursor.execute("INSERT OR IGNORE INTO stats_rollup (scope, key, metric) VALUES ('meta', '', 'seeded')")
+    seed_rollups = cursor.rowcount == 1
+    for name, event, table, rows in _ROLLUP_TRIGGERS:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO stats_rollup (scope, key, metric, value) VALUES {rows}
+                ON CONFLICT (scope, key, metric) DO UPDATE SET value = value + excluded.value;
+            END
+        ''')
+    if seed_rollups:
+        for query in _ROLLUP_SEED:
+            cursor.execute(f'INSERT INTO stats_rollup (scope, key, metric, value) {query}')
+    
     conn.commit()
     conn.close()
     print(f"Database {DATABASE} initialized successfully.")
 
+@timed_function('db_query_seconds', query='create_user')
 def create_user(username, email, name, password):
     """Register a new user with hashed password."""
     try:
@@ -79,6 +239,7 @@ def create_user(username, email, name, password):
     except Exception as e:
         return False, f"Error registering user: {str(e)}"
 
+@timed_function('db_query_seconds', query='get_user_by_username')
 def get_user_by_username(username):
     """Fetch user details by username."""
     conn = get_db_connection()
@@ -90,6 +251,7 @@ def get_user_by_username(username):
     conn.close()
     return user
 
+@timed_function('db_query_seconds', query='verify_password')
 def verify_password(username, password):
     """Verify user login credentials."""
     user = get_user_by_username(username)
@@ -102,6 +264,7 @@ def verify_password(username, password):
     else:
         return False, "Invalid password"
     
+@timed_function('db_query_seconds', query='get_all_users')
 def get_all_users():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -112,6 +275,7 @@ def get_all_users():
     conn.close()
     return users
 
+@timed_function('db_query_seconds', query='save_dataset')
 def save_dataset(filename, original_filename, file_path, file_size, uploaded_by):
     """Store uploaded dataset file metadata in database."""
     try:
@@ -130,6 +294,7 @@ def save_dataset(filename, original_filename, file_path, file_size, uploaded_by)
     except Exception as e:
         return False, f"Error saving file: {str(e)}"
 
+@timed_function('db_query_seconds', query='get_all_datasets')
 def get_all_datasets():
     """Fetch all uploaded datasets from database."""
     conn = get_db_connection()
@@ -141,6 +306,7 @@ def get_all_datasets():
     conn.close()
     return datasets
 
+@timed_function('db_query_seconds', query='delete_dataset')
 def delete_dataset(dataset_id):
     """Delete a dataset record from database."""
     try:
@@ -156,6 +322,7 @@ def delete_dataset(dataset_id):
     except Exception as e:
         return False, f"Error deleting dataset: {str(e)}"
 
+@timed_function('db_query_seconds', query='add_plant')
 def add_plant(plant_name, botanical_name, benefits):
     """Add a new medicinal plant to the database."""
     try:
@@ -169,6 +336,7 @@ def add_plant(plant_name, botanical_name, benefits):
         
         conn.commit()
         conn.close()
+        _notify_catalog_change()
         return True, "Plant added successfully!"
     
     except sqlite3.IntegrityError:
@@ -176,6 +344,7 @@ def add_plant(plant_name, botanical_name, benefits):
     except Exception as e:
         return False, f"Error adding plant: {str(e)}"
 
+@timed_function('db_query_seconds', query='get_all_plants')
 def get_all_plants():
     """Fetch all medicinal plants from database."""
     try:
@@ -191,6 +360,7 @@ def get_all_plants():
         print(f"Error fetching plants: {str(e)}")
         return []
 
+@timed_function('db_query_seconds', query='get_plant_by_id')
 def get_plant_by_id(plant_id):
     """Fetch a specific plant by ID."""
     try:
@@ -206,6 +376,7 @@ def get_plant_by_id(plant_id):
         print(f"Error fetching plant: {str(e)}")
         return None
 
+@timed_function('db_query_seconds', query='update_plant')
 def update_plant(plant_id, plant_name, botanical_name, benefits):
     """Update a medicinal plant record."""
     try:
@@ -220,6 +391,7 @@ def update_plant(plant_id, plant_name, botanical_name, benefits):
         
         conn.commit()
         conn.close()
+        _notify_catalog_change()
         return True, "Plant updated successfully!"
     
     except sqlite3.IntegrityError:
@@ -227,6 +399,7 @@ def update_plant(plant_id, plant_name, botanical_name, benefits):
     except Exception as e:
         return False, f"Error updating plant: {str(e)}"
 
+@timed_function('db_query_seconds', query='delete_plant')
 def delete_plant(plant_id):
     """Delete a medicinal plant from database."""
     try:
@@ -237,11 +410,46 @@ def delete_plant(plant_id):
         
         conn.commit()
         conn.close()
+        _notify_catalog_change()
         return True, "Plant deleted successfully!"
     
     except Exception as e:
         return False, f"Error deleting plant: {str(e)}"
 
+def on_catalog_change(callback):
+    """Register callback() to run after the plants catalog is modified in this process."""
+    _catalog_listeners.append(callback)
+    return callback
+
+def _notify_catalog_change():
+    for callback in _catalog_listeners:
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error in catalog change listener: {str(e)}")
+
+@timed_function('db_query_seconds', query='get_catalog_version')
+def get_catalog_version():
+    """
+    The catalog's (version, last_modified) row. last_modified is the later of
+    the last change and the newest plants.updated_at, as 'YYYY-MM-DD HH:MM:SS' UTC.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT version,
+                   MAX(changed_at, COALESCE((SELECT MAX(updated_at) FROM plants), changed_at)) AS last_modified
+            FROM catalog_meta WHERE id = 1
+        ''')
+        row = cursor.fetchone()
+        conn.close()
+        return row
+    except Exception as e:
+        print(f"Error fetching catalog version: {str(e)}")
+        return None
+
+@timed_function('db_query_seconds', query='get_plant_by_name')
 def get_plant_by_name(plant_name):
     """Fetch a plant by name (case-insensitive, partial match)."""
     try:
@@ -265,3 +473,453 @@ def get_plant_by_name(plant_name):
     except Exception as e:
         print(f"Error fetching plant by name: {str(e)}")
         return None
+
+@timed_function('db_query_seconds', query='create_batch_job')
+def create_batch_job(job_id, user_id, items):
+    """Create a queued batch job with its (filename, path) items."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO batch_jobs (id, user_id, total)
+            VALUES (?, ?, ?)
+        ''', (job_id, user_id, len(items)))
+        cursor.executemany('''
+            INSERT INTO batch_job_items (job_id, item_index, filename, path)
+            VALUES (?, ?, ?, ?)
+        ''', [(job_id, i, filename, path) for i, (filename, path) in enumerate(items)])
+        
+        conn.commit()
+        conn.close()
+        return True, "Batch job created successfully!"
+    
+    except Exception as e:
+        return False, f"Error creating batch job: {str(e)}"
+
+@timed_function('db_query_seconds', query='get_batch_job')
+def get_batch_job(job_id):
+    """Fetch a batch job by id."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM batch_jobs WHERE id = ?', (job_id,))
+        job = cursor.fetchone()
+        conn.close()
+        return job
+    except Exception as e:
+        print(f"Error fetching batch job: {str(e)}")
+        return None
+
+@timed_function('db_query_seconds', query='get_user_batch_jobs')
+def get_user_batch_jobs(user_id):
+    """Fetch a user's batch jobs, newest first."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM batch_jobs WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+        jobs = cursor.fetchall()
+        conn.close()
+        return jobs
+    except Exception as e:
+        print(f"Error fetching batch jobs: {str(e)}")
+        return []
+
+@timed_function('db_query_seconds', query='claim_batch_job')
+def claim_batch_job(owner, now, lease_seconds):
+    """
+    Take the lease on the oldest unfinished job that nobody holds (or whose
+    holder stopped renewing it, e.g. a restarted worker). Returns the job or None.
+    """
+    try:
+        conn = get_db_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT id FROM batch_jobs
+            WHERE status IN ('queued', 'running')
+              AND (lease_expires IS NULL OR lease_expires < ?)
+            ORDER BY created_at LIMIT 1
+        ''', (now,))
+        row = cursor.fetchone()
+        job = None
+        if row:
+            cursor.execute('''
+                UPDATE batch_jobs SET status = 'running', lease_owner = ?, lease_expires = ?
+                WHERE id = ?
+            ''', (owner, now + lease_seconds, row['id']))
+            cursor.execute('SELECT * FROM batch_jobs WHERE id = ?', (row['id'],))
+            job = cursor.fetchone()
+        cursor.execute('COMMIT')
+        conn.close()
+        return job
+    except Exception as e:
+        print(f"Error claiming batch job: {str(e)}")
+        return None
+
+@timed_function('db_query_seconds', query='renew_batch_lease')
+def renew_batch_lease(job_id, owner, now, lease_seconds):
+    """Extend a held lease. Returns False if another worker has taken the job over."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE batch_jobs SET lease_expires = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'running'
+        ''', (now + lease_seconds, job_id, owner))
+        renewed = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return renewed
+    except Exception as e:
+        print(f"Error renewing batch lease: {str(e)}")
+        return False
+
+@timed_function('db_query_seconds', query='get_pending_batch_items')
+def get_pending_batch_items(job_id, limit):
+    """Next unprocessed items of a job, in upload order."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM batch_job_items
+            WHERE job_id = ? AND status = 'pending'
+            ORDER BY item_index LIMIT ?
+        ''', (job_id, limit))
+        items = cursor.fetchall()
+        conn.close()
+        return items
+    except Exception as e:
+        print(f"Error fetching batch items: {str(e)}")
+        return []
+
+@timed_function('db_query_seconds', query='save_batch_results')
+def save_batch_results(job_id, owner, results, predicted=()):
+    """
+    Store (item_index, status, predictions_json, error) results and advance the
+    job's counters in one transaction, only while `owner` holds the lease.
+    `predicted` holds the (label, confidence %) of the identified images, added
+    to the dashboard rollups in the same transaction.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT lease_owner FROM batch_jobs WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        if row is None or row['lease_owner'] != owner:
+            conn.close()
+            return False, "Lease lost."
+        
+        cursor.executemany('''
+            UPDATE batch_job_items SET status = ?, predictions = ?, error = ?
+            WHERE job_id = ? AND item_index = ? AND status = 'pending'
+        ''', [(status, predictions, error, job_id, index) for index, status, predictions, error in results])
+        failed = sum(1 for r in results if r[1] == 'error')
+        cursor.execute('''
+            UPDATE batch_jobs SET processed = processed + ?, failed = failed + ?
+            WHERE id = ?
+        ''', (len(results), failed, job_id))
+        _add_prediction_rollups(cursor, predicted)
+        
+        conn.commit()
+        conn.close()
+        return True, "Results saved."
+    
+    except Exception as e:
+        return False, f"Error saving batch results: {str(e)}"
+
+@timed_function('db_query_seconds', query='get_active_batch_job_ids')
+def get_active_batch_job_ids():
+    """Ids of queued or running batch jobs, or None on error."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM batch_jobs WHERE status IN ('queued', 'running')")
+        ids = {row['id'] for row in cursor.fetchall()}
+        conn.close()
+        return ids
+    except Exception as e:
+        print(f"Error fetching active batch jobs: {str(e)}")
+        return None
+
+@timed_function('db_query_seconds', query='finish_batch_job')
+def finish_batch_job(job_id, status):
+    """Mark a job done/failed and release its lease."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE batch_jobs SET status = ?, lease_owner = NULL, lease_expires = NULL,
+                                  finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, job_id))
+        conn.commit()
+        conn.close()
+        return True, "Batch job finished."
+    except Exception as e:
+        return False, f"Error finishing batch job: {str(e)}"
+
+def iter_batch_job_items(job_id, chunk_size=500):
+    """Yield a job's items in upload order, reading chunk_size rows at a time."""
+    last_index = -1
+    while True:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM batch_job_items
+            WHERE job_id = ? AND item_index > ?
+            ORDER BY item_index LIMIT ?
+        ''', (job_id, last_index, chunk_size))
+        rows = cursor.fetchall()
+        conn.close()
+        if not rows:
+            return
+        yield from rows
+        last_index = rows[-1]['item_index']
+
+@timed_function('db_query_seconds', query='save_shadow_results')
+def save_shadow_results(candidate_version, source, results):
+    """
+    Store shadow comparisons: (image_path, production_label, production_confidence,
+    production_ms, candidate_label, candidate_confidence, candidate_ms) tuples.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO shadow_results (candidate_version, source, image_path,
+                                        production_label, production_confidence, production_ms,
+                                        candidate_label, candidate_confidence, candidate_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(candidate_version, source) + tuple(r) for r in results])
+        conn.commit()
+        conn.close()
+        return True, "Shadow results saved."
+    except Exception as e:
+        return False, f"Error saving shadow results: {str(e)}"
+
+@timed_function('db_query_seconds', query='get_shadow_report')
+def get_shadow_report(candidate_version):
+    """
+    Per-class comparison for one candidate, grouped by the production label:
+    count, agreement rate, mean confidence shift and mean latency difference
+    (candidate minus production), with one row per class and source.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT production_label, source,
+                   COUNT(*) AS count,
+                   AVG(candidate_label = production_label) AS agreement,
+                   AVG(candidate_confidence - production_confidence) AS confidence_shift,
+                   AVG(production_ms) AS production_ms,
+                   AVG(candidate_ms) AS candidate_ms,
+                   AVG(candidate_ms - production_ms) AS latency_diff_ms
+            FROM shadow_results
+            WHERE candidate_version = ?
+            GROUP BY production_label, source
+            ORDER BY production_label, source
+        ''', (candidate_version,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except Exception as e:
+        print(f"Error fetching shadow report: {str(e)}")
+        return []
+
+@timed_function('db_query_seconds', query='clear_shadow_results')
+def clear_shadow_results(candidate_version, source=None):
+    """Delete the comparisons of a candidate, optionally only those from one source."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if source is None:
+            cursor.execute('DELETE FROM shadow_results WHERE candidate_version = ?', (candidate_version,))
+        else:
+            cursor.execute('DELETE FROM shadow_results WHERE candidate_version = ? AND source = ?',
+                           (candidate_version, source))
+        conn.commit()
+        conn.close()
+        return True, "Shadow results cleared."
+    except Exception as e:
+        return False, f"Error clearing shadow results: {str(e)}"
+
+@timed_function('db_query_seconds', query='get_dataset_images')
+def get_dataset_images(paths):
+    """Indexed rows for the given dataset image paths, as {path: row}."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        rows = {}
+        paths = list(paths)
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            cursor.execute(f'''
+                SELECT * FROM dataset_images WHERE path IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            rows.update((row['path'], row) for row in cursor.fetchall())
+        conn.close()
+        return rows
+    except Exception as e:
+        print(f"Error fetching dataset images: {str(e)}")
+        return {}
+
+@timed_function('db_query_seconds', query='save_dataset_images')
+def save_dataset_images(rows):
+    """Insert or refresh (path, class_name, size, mtime_ns, sha256) index rows."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO dataset_images (path, class_name, size, mtime_ns, sha256)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        conn.close()
+        return True, "Dataset images indexed."
+    except Exception as e:
+        return False, f"Error indexing dataset images: {str(e)}"
+
+@timed_function('db_query_seconds', query='move_dataset_images')
+def move_dataset_images(moves):
+    """Re-point index rows after files were moved: (old_path, new_path, new_class_name) tuples."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE dataset_images SET path = ?, class_name = ? WHERE path = ?
+        ''', [(new_path, class_name, old_path) for old_path, new_path, class_name in moves])
+        conn.commit()
+        conn.close()
+        return True, "Dataset images moved."
+    except Exception as e:
+        return False, f"Error moving dataset images: {str(e)}"
+
+@timed_function('db_query_seconds', query='delete_dataset_images')
+def delete_dataset_images(paths):
+    """
+    Remove index rows. Returns the content hashes no other image references
+    any more (their thumbnails can be deleted).
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        paths = list(paths)
+        hashes = set()
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'SELECT sha256 FROM dataset_images WHERE path IN ({placeholders})', chunk)
+            hashes.update(row['sha256'] for row in cursor.fetchall())
+            cursor.execute(f'DELETE FROM dataset_images WHERE path IN ({placeholders})', chunk)
+        orphaned = []
+        for sha256 in hashes:
+            cursor.execute('SELECT 1 FROM dataset_images WHERE sha256 = ? LIMIT 1', (sha256,))
+            if cursor.fetchone() is None:
+                orphaned.append(sha256)
+        conn.commit()
+        conn.close()
+        return orphaned
+    except Exception as e:
+        print(f"Error deleting dataset images: {str(e)}")
+        return []
+
+def _add_prediction_rollups(cursor, predicted):
+    day = cursor.execute("SELECT date('now')").fetchone()[0]
+    rows = []
+    for label, confidence in predicted:
+        for scope, key in (('total', ''), ('day', day), ('class', label)):
+            rows.append((scope, key, 'predictions', 1))
+            rows.append((scope, key, 'confidence_sum', confidence))
+    cursor.executemany(_ROLLUP_ADD, rows)
+
+@timed_function('db_query_seconds', query='record_predictions')
+def record_predictions(predicted):
+    """Add (label, confidence %) identifications to the dashboard rollups."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        _add_prediction_rollups(cursor, predicted)
+        conn.commit()
+        conn.close()
+        return True, "Predictions recorded."
+    except Exception as e:
+        return False, f"Error recording predictions: {str(e)}"
+
+@timed_function('db_query_seconds', query='adjust_dataset_stats')
+def adjust_dataset_stats(deltas):
+    """Apply {class_name: (image_delta, byte_delta)} after images were added, moved or deleted."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        rows = []
+        for class_name, (images, size) in deltas.items():
+            rows += [('class', class_name, 'images', images), ('class', class_name, 'bytes', size),
+                     ('total', '', 'dataset_images', images), ('total', '', 'dataset_bytes', size)]
+        cursor.executemany(_ROLLUP_ADD, rows)
+        conn.commit()
+        conn.close()
+        return True, "Dataset statistics updated."
+    except Exception as e:
+        return False, f"Error updating dataset statistics: {str(e)}"
+
+@timed_function('db_query_seconds', query='replace_dataset_stats')
+def replace_dataset_stats(counts):
+    """Replace the dataset rollups with a full recount: {class_name: (images, bytes)}."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM stats_rollup WHERE scope = 'class' AND metric IN ('images', 'bytes')")
+        total_images = sum(images for images, _ in counts.values())
+        rows = [('total', '', 'dataset_images', total_images),
+                ('total', '', 'dataset_bytes', sum(size for _, size in counts.values())),
+                ('meta', '', 'dataset_counted_at', int(cursor.execute("SELECT strftime('%s', 'now')").fetchone()[0]))]
+        for class_name, (images, size) in counts.items():
+            rows += [('class', class_name, 'images', images), ('class', class_name, 'bytes', size)]
+        cursor.executemany('''
+            INSERT OR REPLACE INTO stats_rollup (scope, key, metric, value) VALUES (?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        conn.close()
+        return True, f"Counted {total_images} dataset images."
+    except Exception as e:
+        return False, f"Error recounting dataset: {str(e)}"
+
+@timed_function('db_query_seconds', query='get_rollups')
+def get_rollups(since_day):
+    """
+    Dashboard rollup rows: totals, per-class values and the days from
+    since_day (YYYY-MM-DD). The number of rows read depends on the number of
+    days and classes, not on the size of the underlying tables.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM stats_rollup
+            WHERE scope IN ('total', 'class', 'meta') OR (scope = 'day' AND key >= ?)
+        ''', (since_day,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    except Exception as e:
+        print(f"Error fetching rollups: {str(e)}")
+        return []
+
+@timed_function('db_query_seconds', query='get_shadow_rollup')
+def get_shadow_rollup(candidate_version):
+    """Summed shadow comparisons of one candidate as {metric: value} (count, agree, confidence_shift, latency_diff_ms)."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT metric, value FROM stats_rollup WHERE scope = 'shadow' AND key = ?",
+                       (candidate_version,))
+        rollup = {row['metric']: row['value'] for row in cursor.fetchall()}
+        conn.close()
+        return rollup
+    except Exception as e:
+        print(f"Error fetching shadow rollup: {str(e)}")
+        return {}
@@ -0,0 +1,234 @@
+"""
+Paginated admin gallery of the training images under dataset/<class>/.
+
+Originals are never sent to the browser. Each image is shown through a
+small thumbnail stored under static/dataset_thumbs/<aa>/<bb>/<sha256>.<ext>,
+named by the SHA-256 of the source file, so identical images share one
+thumbnail and a thumbnail URL never changes meaning (http_cache.py serves
+them as immutable).
+
+The dataset_images table maps each image path to (size, mtime, sha256).
+Rendering a page stats only the images on that page: files whose size and
+mtime still match their row reuse the stored hash. Changed or new files
+are re-hashed, and missing thumbnails are generated in parallel on a
+thread pool. A thumbnail is therefore only regenerated when the source
+content changes.
+
+Bulk moves rename files between class folders and re-point their rows
+(the hash and thumbnail are reused). Bulk deletes remove the files and
+rows, and delete a thumbnail once no other image has the same content.
+Both are applied to the embedding index too (moved entries are relabelled,
+deleted ones dropped), and the prototypes of affected registered few-shot
+classes are recomputed, so kNN/prototype votes and the similar reference
+images follow the change.
+"""
+
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import prototypes
+from embedding_index import get_index
+from plant_dataset import DATASET_PATH, IMAGE_EXTENSIONS
+from upload_store import STATIC_DIR, THUMBNAIL_EXT, make_thumbnail
+from database import (get_dataset_images, save_dataset_images, move_dataset_images, delete_dataset_images,
+                      adjust_dataset_stats)
+
+THUMBNAIL_DIR = os.path.join(STATIC_DIR, "dataset_thumbs")
+GALLERY_PAGE_SIZE = 48
+THUMBNAIL_WORKERS = min(8, os.cpu_count() or 1)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+metrics.HELP.update({
+    'dataset_thumbnails_total': 'Dataset gallery thumbnail lookups by result',
+})
+
+_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='dataset-thumb')
+_in_flight = {}   # sha256 -> Future, so concurrent pages don't render one thumbnail twice
+_in_flight_lock = threading.Lock()
+
+
+def thumbnail_path(digest):
+    return os.path.join(THUMBNAIL_DIR, digest[:2], digest[2:4], digest + THUMBNAIL_EXT)
+
+
+def thumbnail_static_path(digest):
+    return os.path.relpath(thumbnail_path(digest), STATIC_DIR).replace(os.sep, '/')
+
+
+def _class_dir(class_name):
+    """Path of an existing class folder, or None for anything that isn't one."""
+    if not class_name or class_name != os.path.basename(class_name) or class_name.startswith('.'):
+        return None
+    path = os.path.join(DATASET_PATH, class_name)
+    return path if os.path.isdir(path) else None
+
+
+def list_classes():
+    """Class folder names, sorted."""
+    if not os.path.exists(DATASET_PATH):
+        return []
+    return sorted(d for d in os.listdir(DATASET_PATH) if _class_dir(d))
+
+
+def _list_images(class_dir):
+    return sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _ensure_thumbnail(digest, source_path):
+    """Return a Future that completes once the thumbnail for digest exists."""
+    with _in_flight_lock:
+        future = _in_flight.get(digest)
+        if future is None:
+            future = _pool.submit(make_thumbnail, source_path, thumbnail_path(digest))
+            _in_flight[digest] = future
+            future.add_done_callback(lambda _: _forget(digest))
+        return future
+
+
+def _forget(digest):
+    with _in_flight_lock:
+        _in_flight.pop(digest, None)
+
+
+def _index(path, class_name, stat, known):
+    """(sha256, row to save or None) for one image, hashing it only if it changed."""
+    row = known.get(path)
+    if row is not None and row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns:
+        return row['sha256'], None
+    digest = _hash_file(path)
+    return digest, (path, class_name, stat.st_size, stat.st_mtime_ns, digest)
+
+
+def gallery_page(class_name, page=1, per_page=GALLERY_PAGE_SIZE):
+    """
+    One page of a class's images with their thumbnails, generating whatever
+    is missing. Returns None for an unknown class, else
+    {'class_name', 'page', 'pages', 'total', 'items': [{'filename', 'thumbnail', 'size'}]}.
+    """
+    class_dir = _class_dir(class_name)
+    if class_dir is None:
+        return None
+    filenames = _list_images(class_dir)
+    pages = max(1, -(-len(filenames) // per_page))
+    page = min(max(1, page), pages)
+    page_files = filenames[(page - 1) * per_page:page * per_page]
+
+    paths = [os.path.join(class_dir, f) for f in page_files]
+    stats = {}
+    for path in paths:
+        try:
+            stats[path] = os.stat(path)
+        except FileNotFoundError:
+            pass   # removed since the listing
+    known = get_dataset_images(stats)
+
+    # Hash changed files in parallel, then render the missing thumbnails in parallel
+    indexed = dict(zip(stats, _pool.map(lambda p: _index(p, class_name, stats[p], known), stats)))
+    new_rows = [row for _, row in indexed.values() if row is not None]
+    if new_rows:
+        save_dataset_images(new_rows)
+
+    pending = []
+    for path, (digest, _) in indexed.items():
+        if os.path.exists(thumbnail_path(digest)):
+            metrics.inc('dataset_thumbnails_total', result='hit')
+        else:
+            metrics.inc('dataset_thumbnails_total', result='generated')
+            pending.append(_ensure_thumbnail(digest, path))
+    for future in pending:
+        future.result()
+
+    items = []
+    for path, (digest, _) in indexed.items():
+        items.append({
+            'filename': os.path.basename(path),
+            'thumbnail': thumbnail_static_path(digest) if os.path.exists(thumbnail_path(digest)) else None,
+            'size': stats[path].st_size,
+        })
+    return {'class_name': class_name, 'page': page, 'pages': pages, 'total': len(filenames), 'items': items}
+
+
+def _selected_paths(class_dir, filenames):
+    paths = []
+    for filename in filenames:
+        if filename != os.path.basename(filename) or not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(class_dir, filename)
+        if os.path.isfile(path):
+            paths.append(path)
+    return paths
+
+
+def _sync_embeddings(class_names, moves=(), removed=()):
+    """Apply a move or delete to the embedding index and the registered prototypes."""
+    try:
+        index = get_index()
+        if index is not None:
+            index.relabel(moves)
+            index.remove(removed)
+        prototypes.refresh_classes(class_names)
+    except Exception as e:
+        print(f"[WARN] Could not update the embedding index after a dataset change: {str(e)}")
+
+
+def bulk_move(class_name, filenames, target_class):
+    """Move images to another class folder. Returns (bool, message)."""
+    source_dir, target_dir = _class_dir(class_name), _class_dir(target_class)
+    if source_dir is None or target_dir is None:
+        return False, "Unknown plant class."
+    if source_dir == target_dir:
+        return False, "Choose a different class to move the images to."
+    paths = _selected_paths(source_dir, filenames)
+    if not paths:
+        return False, "No images selected."
+
+    moves = []
+    moved_bytes = 0
+    for path in paths:
+        moved_bytes += os.path.getsize(path)
+        name, ext = os.path.splitext(os.path.basename(path))
+        new_path = os.path.join(target_dir, name + ext)
+        suffix = 1
+        while os.path.exists(new_path):
+            new_path = os.path.join(target_dir, f"{name}_{suffix}{ext}")
+            suffix += 1
+        os.replace(path, new_path)
+        moves.append((path, new_path, target_class))
+    move_dataset_images(moves)
+    adjust_dataset_stats({class_name: (-len(moves), -moved_bytes), target_class: (len(moves), moved_bytes)})
+    _sync_embeddings([class_name, target_class], moves=moves)
+    return True, f"Moved {len(moves)} image(s) from {class_name} to {target_class}."
+
+
+def bulk_delete(class_name, filenames):
+    """Delete images and the thumbnails nothing else uses. Returns (bool, message)."""
+    class_dir = _class_dir(class_name)
+    if class_dir is None:
+        return False, "Unknown plant class."
+    paths = _selected_paths(class_dir, filenames)
+    if not paths:
+        return False, "No images selected."
+
+    deleted_bytes = 0
+    for path in paths:
+        deleted_bytes += os.path.getsize(path)
+        os.remove(path)
+    adjust_dataset_stats({class_name: (-len(paths), -deleted_bytes)})
+    _sync_embeddings([class_name], removed=paths)
+    for digest in delete_dataset_images(paths):
+        try:
+            os.remove(thumbnail_path(digest))
+        except FileNotFoundError:
+            pass
+    return True, f"Deleted {len(paths)} image(s) from {class_name}."
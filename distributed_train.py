@@ -0,0 +1,326 @@
+"""
+Multi-worker data-parallel training with tf.distribute.MultiWorkerMirroredStrategy.
+
+Every worker process builds the same model (train_model.build_model) inside
+the strategy scope. Gradients are all-reduced after each step, so all
+workers hold identical weights. The training input is sharded by the
+dataset manifest (plant_dataset.build_manifest): input pipeline i of n reads
+manifest entries i, i+n, i+2n, ..., so workers never read the same
+image in an epoch. The manifest also gives the same training/validation
+split and class order as train_model.py. Only the chief (worker 0) writes the model
+and labels; it also removes the fast cascade model trained for the previous
+model (train_model.py trains a new one).
+
+Usage:
+    # N local worker processes on this machine
+    python distributed_train.py launch --workers 4
+
+    # Several hosts: the same cluster spec on every host, one index per host
+    #   cluster.json: {"worker": ["host1:23456", "host2:23456"]}
+    python distributed_train.py launch --cluster cluster.json --index 0   # on host1
+    python distributed_train.py launch --cluster cluster.json --index 1   # on host2
+
+    # Images/sec at 1, 2 and 4 local workers
+    python distributed_train.py benchmark
+
+`worker` mode (used by the launcher) reads the standard TF_CONFIG variable.
+"""
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# oneDNN on/off from the tuned CPU profile; must precede the TF import
+import cpu_tuning
+cpu_tuning.apply_environment('training')
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback, EarlyStopping, ReduceLROnPlateau
+
+from image_io import decode_image
+from train_model import build_model, save_model, install_model, remove_fast_model, EpochTimer
+from plant_dataset import DATASET_PATH, build_manifest, manifest_fingerprint, subset_entries
+
+MODEL_PATH = "models/plant_model.h5"
+LABELS_PATH = "models/labels.json"
+DISTRIBUTED_DIR = "models/distributed"
+IMG_SIZE = (224, 224)
+PER_WORKER_BATCH_SIZE = 16
+EPOCHS = 15
+BASE_PORT = 23456
+BENCHMARK_WORKERS = (1, 2, 4)
+BENCHMARK_STEPS = 30
+BENCHMARK_WARMUP_STEPS = 5
+
+
+def _decode_fn(img_size):
+    def decode(path):
+        return decode_image(path.decode('utf-8'), img_size).astype(np.uint8)
+    return decode
+
+
+def make_dataset(entries, img_size, batch_size, pipeline_id, num_pipelines, training):
+    """
+    tf.data pipeline over this input pipeline's shard of the manifest entries:
+    decode (image_io.decode_image, uint8), augment if training, batch, repeat.
+    """
+    shard = entries[pipeline_id::num_pipelines]
+    paths = [e['path'] for e in shard]
+    labels = [e['label'] for e in shard]
+    decode = _decode_fn(img_size)
+
+    def load(path, label):
+        image = tf.numpy_function(decode, [path], tf.uint8)
+        image.set_shape([img_size[0], img_size[1], 3])
+        return image, label
+
+    def augment(image, label):
+        # In-graph approximation of train_model.py's ImageDataGenerator augmentation
+        image = tf.image.random_flip_left_right(image)
+        scale = tf.random.uniform([], 0.8, 1.0)
+        crop = tf.cast(tf.cast(img_size, tf.float32) * scale, tf.int32)
+        image = tf.image.random_crop(image, [crop[0], crop[1], 3])
+        image = tf.image.resize(image, img_size)
+        return tf.cast(tf.clip_by_value(image, 0, 255), tf.uint8), label
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if training:
+        dataset = dataset.shuffle(len(paths), reshuffle_each_iteration=True)
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+    if training:
+        dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.batch(batch_size).repeat()
+
+    # Sharding is done above by manifest position, not by tf.data
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+
+def _dataset_creator(entries, global_batch_size, training):
+    def dataset_fn(input_context):
+        batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+        return make_dataset(entries, IMG_SIZE, batch_size, input_context.input_pipeline_id,
+                            input_context.num_input_pipelines, training)
+    return tf.keras.utils.experimental.DatasetCreator(dataset_fn)
+
+
+class ThroughputMeter(Callback):
+    """Measure training images/sec after a warm-up period."""
+
+    def __init__(self, global_batch_size, warmup_steps):
+        super().__init__()
+        self.global_batch_size = global_batch_size
+        self.warmup_steps = warmup_steps
+        self.steps = 0
+        self.start = None
+        self.images_per_sec = None
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.steps == self.warmup_steps:
+            self.start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+
+    def on_train_end(self, logs=None):
+        if self.start is not None and self.steps > self.warmup_steps:
+            elapsed = time.perf_counter() - self.start
+            self.images_per_sec = (self.steps - self.warmup_steps) * self.global_batch_size / elapsed
+
+
+def run_worker(epochs=EPOCHS, benchmark_steps=None, report_path=None):
+    """
+    Train as one worker of the cluster described by TF_CONFIG (or alone if
+    it is unset). With benchmark_steps, run that many steps only and write
+    the measured throughput to report_path (chief only).
+    """
+    local_workers = int(os.environ.get('PLANT_LOCAL_WORKERS', '1'))
+    cpu_tuning.apply_threads('training', num_workers=local_workers)
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    tf_config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    task = tf_config.get('task', {'type': 'worker', 'index': 0})
+    is_chief = task.get('index', 0) == 0
+    num_workers = strategy.num_replicas_in_sync
+
+    manifest = build_manifest(DATASET_PATH)
+    train_entries = subset_entries(manifest, 'training')
+    val_entries = subset_entries(manifest, 'validation')
+    num_classes = len(manifest['classes'])
+    global_batch_size = PER_WORKER_BATCH_SIZE * num_workers
+
+    print(f"[INFO] Worker {task.get('index', 0)}/{num_workers}: manifest {manifest_fingerprint(manifest)}, "
+          f"{len(train_entries)} training images, global batch {global_batch_size}")
+
+    with strategy.scope():
+        if cpu_tuning.apply_precision():
+            print("[INFO] Training with mixed bfloat16 precision")
+        model = build_model(num_classes, img_size=IMG_SIZE)
+
+    train_input = _dataset_creator(train_entries, global_batch_size, training=True)
+    steps_per_epoch = max(1, len(train_entries) // global_batch_size)
+
+    if benchmark_steps:
+        meter = ThroughputMeter(global_batch_size, BENCHMARK_WARMUP_STEPS)
+        model.fit(train_input, epochs=1, steps_per_epoch=benchmark_steps, callbacks=[meter], verbose=0)
+        if is_chief and report_path:
+            with open(report_path, 'w') as f:
+                json.dump({'workers': num_workers, 'global_batch_size': global_batch_size,
+                           'steps': benchmark_steps, 'images_per_sec': round(meter.images_per_sec, 2)}, f)
+        return meter.images_per_sec
+
+    val_input = _dataset_creator(val_entries, global_batch_size, training=False)
+    history = model.fit(
+        train_input,
+        validation_data=val_input if val_entries else None,
+        validation_steps=max(1, len(val_entries) // global_batch_size) if val_entries else None,
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
+        callbacks=[
+            EarlyStopping(monitor='val_loss' if val_entries else 'loss', patience=5,
+                          restore_best_weights=True, verbose=1),
+            ReduceLROnPlateau(monitor='val_loss' if val_entries else 'loss', factor=0.2, patience=3,
+                              min_lr=1e-7, verbose=1),
+            EpochTimer('full'),
+        ],
+        verbose=1 if is_chief else 0
+    )
+
+    # Every worker must take part in saving; only the chief writes the real files
+    if is_chief:
+        if remove_fast_model():
+            print("[INFO] Removed the fast cascade model of the previous model; train it again with train_model.py")
+        install_model(model, MODEL_PATH, num_classes, img_size=IMG_SIZE,
+                      labels={i: name for i, name in enumerate(manifest['classes'])}, labels_path=LABELS_PATH)
+        print(f"[INFO] Model saved at {MODEL_PATH}")
+    else:
+        scratch_dir = os.path.join(DISTRIBUTED_DIR, f"worker_{task['index']}")
+        os.makedirs(scratch_dir, exist_ok=True)
+        save_model(model, os.path.join(scratch_dir, "plant_model.h5"), num_classes, img_size=IMG_SIZE)
+
+    accuracy_key = 'val_accuracy' if val_entries else 'accuracy'
+    return history.history[accuracy_key][-1]
+
+
+def _worker_command(args):
+    return [sys.executable, os.path.abspath(__file__), 'worker'] + args
+
+
+def launch_local(num_workers, worker_args=(), base_port=BASE_PORT):
+    """Start num_workers worker processes on this machine and wait for them. Returns True on success."""
+    cluster = {'worker': [f"localhost:{base_port + i}" for i in range(num_workers)]}
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ,
+                   TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}),
+                   PLANT_LOCAL_WORKERS=str(num_workers))
+        processes.append(subprocess.Popen(_worker_command(list(worker_args)), env=env))
+    codes = [p.wait() for p in processes]
+    if any(codes):
+        print(f"❌ Worker exit codes: {codes}")
+    return not any(codes)
+
+
+def launch_from_cluster(cluster_path, index, worker_args=()):
+    """Start this host's worker of a multi-host cluster spec ({"worker": [host:port, ...]})."""
+    with open(cluster_path) as f:
+        cluster = json.load(f)
+    hosts = cluster['worker']
+    local_workers = sum(1 for h in hosts if h.split(':')[0] == hosts[index].split(':')[0])
+    env = dict(os.environ,
+               TF_CONFIG=json.dumps({'cluster': {'worker': hosts}, 'task': {'type': 'worker', 'index': index}}),
+               PLANT_LOCAL_WORKERS=str(local_workers))
+    return subprocess.call(_worker_command(list(worker_args)), env=env) == 0
+
+
+def run_benchmark(worker_counts=BENCHMARK_WORKERS, steps=BENCHMARK_STEPS):
+    """Measure training images/sec at each local worker count and write a report."""
+    os.makedirs(DISTRIBUTED_DIR, exist_ok=True)
+    results = []
+    for count in worker_counts:
+        report_path = os.path.join(DISTRIBUTED_DIR, f"bench_{count}.json")
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        print(f"\n[INFO] Benchmarking {count} worker(s), {steps} steps...")
+        # Ports are offset per run so a slow shutdown cannot collide with the next run
+        ok = launch_local(count, ['--benchmark-steps', str(steps), '--report', report_path],
+                          base_port=BASE_PORT + 10 * count)
+        if ok and os.path.exists(report_path):
+            with open(report_path) as f:
+                results.append(json.load(f))
+            print(f"[INFO] {count} worker(s): {results[-1]['images_per_sec']} images/sec")
+
+    if not results:
+        print("❌ No benchmark run completed")
+        return None
+
+    baseline = results[0]['images_per_sec']
+    for r in results:
+        r['speedup'] = round(r['images_per_sec'] / baseline, 2) if baseline else None
+        r['efficiency'] = round(r['speedup'] / r['workers'], 2) if r['speedup'] else None
+
+    with open(os.path.join(DISTRIBUTED_DIR, "scaling.json"), 'w') as f:
+        json.dump({'cores': os.cpu_count(), 'per_worker_batch_size': PER_WORKER_BATCH_SIZE,
+                   'results': results}, f, indent=4)
+    lines = [
+        "# Multi-worker training scaling (one machine)",
+        "",
+        f"{os.cpu_count()} logical cores, per-worker batch {PER_WORKER_BATCH_SIZE}, "
+        f"{steps} steps ({BENCHMARK_WARMUP_STEPS} warm-up steps excluded). "
+        "Local workers split the cores between them.",
+        "",
+        "| workers | global batch | images/sec | speedup | efficiency |",
+        "|---|---|---|---|---|",
+    ]
+    for r in results:
+        lines.append(f"| {r['workers']} | {r['global_batch_size']} | {r['images_per_sec']} | "
+                     f"{r['speedup']}x | {r['efficiency']} |")
+    with open(os.path.join(DISTRIBUTED_DIR, "scaling.md"), 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    print("\n" + "\n".join(lines[4:]))
+    print(f"\n✅ Report written to {DISTRIBUTED_DIR}/scaling.md")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Multi-worker data-parallel training")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    launch = sub.add_parser('launch', help="Start workers locally or on this host of a cluster")
+    launch.add_argument('--workers', type=int, default=2, help="Number of local worker processes")
+    launch.add_argument('--cluster', help="Cluster spec JSON ({\"worker\": [\"host:port\", ...]})")
+    launch.add_argument('--index', type=int, default=0, help="This host's index in the cluster spec")
+    launch.add_argument('--epochs', type=int, default=EPOCHS)
+
+    worker = sub.add_parser('worker', help="Run one worker (reads TF_CONFIG)")
+    worker.add_argument('--epochs', type=int, default=EPOCHS)
+    worker.add_argument('--benchmark-steps', type=int)
+    worker.add_argument('--report')
+
+    bench = sub.add_parser('benchmark', help="Images/sec at 1, 2 and 4 local workers")
+    bench.add_argument('--workers', type=int, nargs='+', default=list(BENCHMARK_WORKERS))
+    bench.add_argument('--steps', type=int, default=BENCHMARK_STEPS)
+
+    args = parser.parse_args()
+    if args.command != 'worker' and not os.path.exists(DATASET_PATH):
+        print(f"❌ Dataset not found at {DATASET_PATH}")
+        sys.exit(1)
+
+    if args.command == 'worker':
+        run_worker(args.epochs, args.benchmark_steps, args.report)
+    elif args.command == 'launch':
+        worker_args = ['--epochs', str(args.epochs)]
+        if args.cluster:
+            ok = launch_from_cluster(args.cluster, args.index, worker_args)
+        else:
+            ok = launch_local(args.workers, worker_args)
+        sys.exit(0 if ok else 1)
+    else:
+        sys.exit(0 if run_benchmark(args.workers, args.steps) else 1)
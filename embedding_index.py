@@ -0,0 +1,392 @@
+"""
+Embedding similarity index over the reference images in dataset/.
+
+Every dataset image is embedded with the pooled (GlobalAveragePooling)
+MobileNetV2 features, L2-normalized and stored as a float16 row of a
+memory-mapped matrix:
+
+    models/embeddings/vectors.f16     (capacity x dim float16, np.memmap)
+    models/embeddings/manifest.json   ({dim, count, capacity, entries: [{path, label}]})
+
+Cosine similarity is then a single matrix-vector product, so a top-k search
+over thousands of images takes milliseconds. New images are appended in
+place (the file grows by doubling), so adding images never needs a full
+rebuild. The index also offers two alternative classifiers: a
+similarity-weighted kNN vote and a nearest-class-prototype (class mean) vote.
+
+Every gunicorn worker maps the same files: writes hold an exclusive flock on
+the index directory, reads a shared one, and each instance re-reads the
+manifest and remaps the vectors when another process has changed them.
+
+Usage:
+    python embedding_index.py build                    # (re)index all of dataset/
+    python embedding_index.py add                      # index dataset images not yet indexed
+    python embedding_index.py search <image> [k]
+"""
+
+import os
+import sys
+import json
+import fcntl
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+from plant_dataset import DATASET_PATH, build_manifest, load_images
+
+INDEX_DIR = "models/embeddings"
+VECTORS_PATH = os.path.join(INDEX_DIR, "vectors.f16")
+MANIFEST_PATH = os.path.join(INDEX_DIR, "manifest.json")
+MODEL_PATH = "models/plant_model.h5"
+EMBED_IMG_SIZE = (224, 224)
+INITIAL_CAPACITY = 1024
+SEARCH_CHUNK_ROWS = 8192
+EMBED_BATCH_SIZE = 16
+LOCK_FILENAME = ".lock"
+
+_imagenet_model = None
+_imagenet_model_lock = threading.Lock()
+
+
+def load_embedding_model():
+    """
+    ServingModel producing pooled backbone features for uint8 images.
+
+    This is the trained full model as served by inference.load_cached_model()
+    (the pooled features are its second output), so embeddings come from the
+    same weights and pass as the classifier and follow models/plant_model.h5
+    when it is retrained or promoted. Without a trained model it is a plain
+    ImageNet MobileNetV2 with weights from the local backbone store
+    (backbone_store.py).
+    """
+    global _imagenet_model
+    if os.path.exists(MODEL_PATH):
+        from inference import load_cached_model
+        model = load_cached_model(MODEL_PATH, EMBED_IMG_SIZE)
+        if model.has_features:
+            return model
+    with _imagenet_model_lock:
+        if _imagenet_model is None:
+            from tensorflow.keras.applications import MobileNetV2
+            from backbone_store import weights_path
+            from serving import ServingModel
+            keras_model = MobileNetV2(weights=weights_path(1.0, EMBED_IMG_SIZE[0]), include_top=False,
+                                      pooling='avg', input_shape=(EMBED_IMG_SIZE[0], EMBED_IMG_SIZE[1], 3))
+            _imagenet_model = ServingModel(keras_model, img_size=EMBED_IMG_SIZE)
+        return _imagenet_model
+
+
+def embed_local(images):
+    """Pooled (unnormalized) features for a uint8 batch, computed in this process."""
+    model = load_embedding_model()
+    if model.has_features:
+        return model.predict(images, with_features=True)[1]
+    return model.predict(images)
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def embed_images(images):
+    """L2-normalized embeddings for a uint8 (N, H, W, 3) batch."""
+    from inference import predict_batch
+    return _normalize(predict_batch('embed', images))
+
+
+def embed_files(paths):
+    """L2-normalized embeddings for image files, computed in batches."""
+    vectors = []
+    for start in range(0, len(paths), EMBED_BATCH_SIZE):
+        vectors.append(embed_images(load_images(paths[start:start + EMBED_BATCH_SIZE], EMBED_IMG_SIZE)))
+    return np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+@contextmanager
+def _dir_locked(index_dir, operation=fcntl.LOCK_EX):
+    """flock on the index directory, shared by every process using it."""
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, LOCK_FILENAME), 'a') as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class EmbeddingIndex:
+    """Memory-mapped float16 embedding matrix plus a JSON manifest."""
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.vectors_path = os.path.join(index_dir, "vectors.f16")
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._prototypes = None
+        self._manifest_stamp = None
+        self.manifest = {'dim': 0, 'count': 0, 'capacity': 0, 'entries': []}
+        self.vectors = None
+        self._indexed_paths = set()
+        self._reload()
+
+    @property
+    def count(self):
+        return self.manifest['count']
+
+    def _reload(self):
+        """Re-read the manifest and remap the vectors if another process replaced them."""
+        if os.path.exists(self.manifest_path):
+            stat = os.stat(self.manifest_path)
+            # _save_manifest() replaces the file, so a new inode means a new manifest
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+            if stamp == self._manifest_stamp:
+                return
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            if self._manifest_stamp is None and self.vectors is None:
+                return
+            stamp = None
+            self.manifest = {'dim': 0, 'count': 0, 'capacity': 0, 'entries': []}
+        self._manifest_stamp = stamp
+        self.vectors = None
+        if stamp is not None:
+            self._open(self.manifest['capacity'])
+        self._indexed_paths = {e['path'] for e in self.manifest['entries']}
+        self._prototypes = None
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """
+        Hold the thread lock and the directory flock (exclusive for writes),
+        with this instance brought up to date with the files on disk.
+        """
+        with self._lock, _dir_locked(self.index_dir, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH):
+            self._reload()
+            yield
+
+    def _open(self, capacity):
+        mode = 'r+' if os.path.exists(self.vectors_path) else 'w+'
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float16, mode=mode,
+                                 shape=(capacity, self.manifest['dim']))
+
+    def _grow(self, needed):
+        """Make room for `needed` more rows, doubling the file as required."""
+        capacity = self.manifest['capacity']
+        if self.count + needed <= capacity:
+            return
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < self.count + needed:
+            new_capacity *= 2
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(new_capacity * self.manifest['dim'] * 2)
+        self.manifest['capacity'] = new_capacity
+        self._open(new_capacity)
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        stat = os.stat(self.manifest_path)
+        self._manifest_stamp = (stat.st_ino, stat.st_mtime_ns)
+
+    def add(self, vectors, entries):
+        """Append normalized vectors with their {'path', 'label'} entries (already indexed paths are skipped)."""
+        vectors = _normalize(vectors)
+        with self._locked(exclusive=True):
+            # Another process may have indexed some of these since they were embedded
+            keep = [i for i, e in enumerate(entries) if e['path'] not in self._indexed_paths]
+            if not keep:
+                return
+            vectors = vectors[keep]
+            entries = [entries[i] for i in keep]
+            if self.manifest['dim'] == 0:
+                self.manifest['dim'] = int(vectors.shape[1])
+            self._grow(len(vectors))
+            start = self.count
+            self.vectors[start:start + len(vectors)] = vectors.astype(np.float16)
+            self.vectors.flush()
+            self.manifest['entries'].extend(entries)
+            self.manifest['count'] = start + len(vectors)
+            self._save_manifest()
+            self._indexed_paths.update(e['path'] for e in entries)
+            self._prototypes = None
+
+    def add_files(self, paths, labels):
+        """Embed and append image files that are not indexed yet. Returns the number added."""
+        with self._locked():
+            new = [(p, l) for p, l in zip(paths, labels) if p not in self._indexed_paths]
+        if not new:
+            return 0
+        vectors = embed_files([p for p, _ in new])
+        self.add(vectors, [{'path': p, 'label': l} for p, l in new])
+        return len(new)
+
+    def relabel(self, moves):
+        """
+        Follow images moved between class folders: (old path, new path, label)
+        tuples re-point their entries, keeping the vectors. Returns the number
+        of entries changed.
+        """
+        targets = {os.path.normpath(old): (new, label) for old, new, label in moves}
+        changed = 0
+        with self._locked(exclusive=True):
+            for entry in self.manifest['entries']:
+                target = targets.get(os.path.normpath(entry['path']))
+                if target is not None:
+                    entry['path'], entry['label'] = target
+                    changed += 1
+            if changed:
+                self._save_manifest()
+                self._indexed_paths = {e['path'] for e in self.manifest['entries']}
+                self._prototypes = None
+        return changed
+
+    def remove(self, paths):
+        """Drop the entries of deleted images, compacting the vectors. Returns the number removed."""
+        gone = {os.path.normpath(p) for p in paths}
+        with self._locked(exclusive=True):
+            entries = self.manifest['entries']
+            keep = [i for i, e in enumerate(entries) if os.path.normpath(e['path']) not in gone]
+            if len(keep) == len(entries):
+                return 0
+            if keep:
+                self.vectors[:len(keep)] = self.vectors[np.array(keep)]
+                self.vectors.flush()
+            self.manifest['entries'] = [entries[i] for i in keep]
+            self.manifest['count'] = len(keep)
+            self._save_manifest()
+            self._indexed_paths = {e['path'] for e in self.manifest['entries']}
+            self._prototypes = None
+            return len(entries) - len(keep)
+
+    def _similarities(self, query):
+        # Caller holds self._locked(): writers may replace self.vectors
+        query = _normalize(query).reshape(-1)
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SEARCH_CHUNK_ROWS):
+            stop = min(start + SEARCH_CHUNK_ROWS, self.count)
+            scores[start:stop] = self.vectors[start:stop].astype(np.float32) @ query
+        return scores
+
+    def similarities(self, query):
+        """Cosine similarity of one normalized query vector to every indexed row."""
+        with self._locked():
+            return self._similarities(query)
+
+    def search(self, query, k=5):
+        """Top-k most similar entries: [{'path', 'label', 'score'}, ...]."""
+        with self._locked():
+            if self.count == 0:
+                return []
+            scores = self._similarities(query)
+            k = min(k, self.count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            entries = self.manifest['entries']
+            return [dict(entries[i], score=float(scores[i])) for i in top]
+
+    def knn_vote(self, query, k=10):
+        """Class scores from a similarity-weighted vote of the k nearest neighbours."""
+        votes = {}
+        for match in self.search(query, k):
+            votes[match['label']] = votes.get(match['label'], 0.0) + max(match['score'], 0.0)
+        total = sum(votes.values()) or 1.0
+        return {label: score / total for label, score in votes.items()}
+
+    def prototypes(self):
+        """(labels, normalized class-mean matrix), cached until the index changes."""
+        with self._locked():
+            if self._prototypes is None:
+                labels = sorted({e['label'] for e in self.manifest['entries']})
+                label_ids = np.array([labels.index(e['label']) for e in self.manifest['entries']])
+                sums = np.zeros((len(labels), self.manifest['dim']), dtype=np.float32)
+                for start in range(0, self.count, SEARCH_CHUNK_ROWS):
+                    stop = min(start + SEARCH_CHUNK_ROWS, self.count)
+                    np.add.at(sums, label_ids[start:stop], self.vectors[start:stop].astype(np.float32))
+                self._prototypes = (labels, _normalize(sums))
+            return self._prototypes
+
+    def prototype_vote(self, query, temperature=0.05):
+        """Class scores from cosine similarity to each class prototype (softmax)."""
+        labels, matrix = self.prototypes()
+        if not labels:
+            return {}
+        logits = (matrix @ _normalize(query).reshape(-1)) / temperature
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        return dict(zip(labels, probs.tolist()))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Process-wide index instance, or None if no index has been built.
+    The instance follows updates other processes make to the files.
+    """
+    global _index
+    with _index_lock:
+        if not os.path.exists(MANIFEST_PATH):
+            return None
+        if _index is None:
+            _index = EmbeddingIndex()
+        return _index
+
+
+def build_index(rebuild=False):
+    """Index every dataset image (only new ones unless rebuild=True)."""
+    global _index
+    if rebuild:
+        with _dir_locked(INDEX_DIR):
+            for path in (VECTORS_PATH, MANIFEST_PATH):
+                if os.path.exists(path):
+                    os.remove(path)
+        with _index_lock:
+            _index = None
+    manifest = build_manifest(DATASET_PATH)
+    with _index_lock:
+        if _index is None:
+            _index = EmbeddingIndex()
+        index = _index
+    added = index.add_files([e['path'] for e in manifest['entries']],
+                            [manifest['classes'][e['label']] for e in manifest['entries']])
+    print(f"[INFO] Indexed {added} new images ({index.count} total)")
+    return index
+
+
+if __name__ == '__main__':
+    import time
+    from preprocessing import load_batch_uint8
+
+    if len(sys.argv) > 1 and sys.argv[1] in ('build', 'add'):
+        build_index(rebuild=sys.argv[1] == 'build')
+    elif len(sys.argv) > 2 and sys.argv[1] == 'search':
+        index = get_index()
+        if index is None:
+            print("❌ No index found. Run: python embedding_index.py build")
+            sys.exit(1)
+        k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+        query = embed_images(load_batch_uint8(sys.argv[2], EMBED_IMG_SIZE))[0]
+        start = time.perf_counter()
+        matches = index.search(query, k)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for match in matches:
+            print(f"{match['score']:.4f}  {match['label']:15s}  {match['path']}")
+        print(f"\nSearched {index.count} vectors in {elapsed_ms:.2f} ms")
+        print(f"kNN vote:       {index.knn_vote(query)}")
+        print(f"Prototype vote: {index.prototype_vote(query)}")
+    else:
+        print("Usage:")
+        print("  python embedding_index.py build              # Rebuild the index from dataset/")
+        print("  python embedding_index.py add                # Index new dataset images only")
+        print("  python embedding_index.py search <image> [k] # Nearest reference images")
@@ -0,0 +1,24 @@
+"""Gunicorn configuration: gunicorn -c gunicorn.conf.py wsgi:app"""
+
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Import the app's modules once in the master, then fork; models load per worker
+preload_app = True
+
+os.environ.setdefault('METRICS_DIR', 'metrics_data')
+
+
+def on_starting(server):
+    # Drop per-process metric files left over from a previous run
+    import metrics
+    metrics.reset_dir()
+
+
+def post_fork(server, worker):
+    from wsgi import configure_worker
+    configure_worker(server.cfg.workers)
@@ -0,0 +1,186 @@
+"""
+HTTP conditional caching and fragment caching for catalog pages and images.
+
+- Catalog pages (/user/plants) get an ETag built from the catalog version
+  (catalog_meta.version, bumped by SQLite triggers on every plants change)
+  and a Last-Modified from the newest plants.updated_at. They are sent with
+  Cache-Control: no-cache, so browsers revalidate every view and get a 304
+  without the page being rendered while the catalog is unchanged.
+- Static pages (/, /about) are validated by their template's content hash
+  and modification time, and may be reused for STATIC_PAGE_MAX_AGE seconds.
+- Content-addressed uploads and their thumbnails (static/uploads/cas,
+  static/uploads/thumbs and static/dataset_thumbs, named by the SHA-256 of
+  the image) never change under the same URL and are served with a
+  one-year immutable max-age.
+- The rendered plant grid is kept in a FragmentCache keyed by the catalog
+  version. add_plant/update_plant/delete_plant drop it in this process
+  through database.on_catalog_change(); other processes see the version
+  change and re-render on their next request.
+
+`python benchmark_http_cache.py` measures requests/sec with and without the
+caches.
+"""
+
+import os
+import hashlib
+import functools
+import threading
+from datetime import datetime, timezone
+
+from flask import request, make_response, render_template, current_app, g
+
+import metrics
+from database import get_catalog_version, on_catalog_change, get_all_plants
+
+CATALOG_CACHE_CONTROL = 'no-cache'
+STATIC_PAGE_MAX_AGE = 300
+STATIC_PAGE_CACHE_CONTROL = f'public, max-age={STATIC_PAGE_MAX_AGE}'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+IMMUTABLE_STATIC_PREFIXES = ('uploads/cas/', 'uploads/thumbs/', 'dataset_thumbs/')
+
+metrics.HELP.update({
+    'http_conditional_requests_total': 'Cacheable page requests by page and result (not_modified = 304)',
+    'fragment_cache_requests_total': 'Rendered fragment cache lookups by fragment and result',
+})
+
+
+class FragmentCache:
+    """Thread-safe cache of rendered HTML fragments, each valid for one version."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # name -> (version, html)
+
+    def get_or_render(self, name, version, render):
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None and entry[0] == version:
+            metrics.inc('fragment_cache_requests_total', fragment=name, result='hit')
+            return entry[1]
+        metrics.inc('fragment_cache_requests_total', fragment=name, result='miss')
+        html = render()
+        with self._lock:
+            self._entries[name] = (version, html)
+        return html
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+
+fragments = FragmentCache()
+on_catalog_change(fragments.invalidate)
+
+
+# ---------------------------------------------------------------------------
+# Validators
+# ---------------------------------------------------------------------------
+
+_template_hashes = {}   # template name -> (mtime, short hash)
+
+
+def _template_validator(name):
+    """(short content hash, mtime) of a template file, recomputed when it changes."""
+    path = os.path.join(current_app.root_path, current_app.template_folder, name)
+    mtime = os.path.getmtime(path)
+    cached = _template_hashes.get(name)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+        _template_hashes[name] = cached
+    return cached[1], datetime.fromtimestamp(mtime, timezone.utc)
+
+
+def _catalog_row():
+    """The catalog version row, read at most once per request."""
+    if 'catalog_row' not in g:
+        g.catalog_row = get_catalog_version()
+    return g.catalog_row
+
+
+def catalog_validators(*template_names):
+    """ETag and Last-Modified of a page rendered from the plants catalog and these templates."""
+    row = _catalog_row()
+    template_hashes = [_template_validator(name) for name in template_names]
+    if row is None:
+        return None, None
+    etag = f"catalog-{row['version']}-" + '-'.join(h for h, _ in template_hashes)
+    last_modified = datetime.strptime(row['last_modified'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return etag, max([last_modified] + [m for _, m in template_hashes])
+
+
+def template_validators(template_name):
+    """ETag and Last-Modified of a page that only depends on its template."""
+    content_hash, mtime = _template_validator(template_name)
+    return f"page-{content_hash}", mtime
+
+
+def _not_modified(etag, last_modified):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+    if request.if_none_match:
+        return etag is not None and request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def conditional_page(page, validators, cache_control):
+    """
+    Route decorator: answer GETs with 304 Not Modified (without running the
+    view) when the client's validators match, otherwise run the view and
+    attach ETag, Last-Modified and Cache-Control.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = validators()
+            if _not_modified(etag, last_modified):
+                metrics.inc('http_conditional_requests_total', page=page, result='not_modified')
+                response = current_app.response_class(status=304)
+            else:
+                metrics.inc('http_conditional_requests_total', page=page, result='full')
+                response = make_response(view(*args, **kwargs))
+            if etag is not None:
+                response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# Fragments
+# ---------------------------------------------------------------------------
+
+PLANT_LIST_FRAGMENT = 'plant_list_fragment.html'
+
+
+def render_plant_list():
+    """The rendered plant grid, from the fragment cache while the catalog is unchanged."""
+    row = _catalog_row()
+    version = row['version'] if row is not None else None
+    render = lambda: render_template(PLANT_LIST_FRAGMENT, plants=get_all_plants())
+    if version is None:
+        return render()
+    return fragments.get_or_render('plant_list', version, render)
+
+
+# ---------------------------------------------------------------------------
+# Static files
+# ---------------------------------------------------------------------------
+
+def _immutable_static(response):
+    if (request.endpoint == 'static' and response.status_code in (200, 206, 304)
+            and (request.view_args or {}).get('filename', '').startswith(IMMUTABLE_STATIC_PREFIXES)):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def init_http_cache(app):
+    """Serve content-addressed uploads with long-lived immutable cache headers."""
+    app.after_request(_immutable_static)
@@ -0,0 +1,67 @@
+"""
+Fast image decoding for model input.
+
+Phone uploads are often 12 MP JPEGs. keras load_img() decodes them at full
+resolution and only then downsizes to 224x224. decode_image() instead asks
+libjpeg for a DCT-domain downscale (PIL draft mode, 1/2, 1/4 or 1/8) to the
+smallest size that is still at least the target, so most of the decode work
+is skipped. It also applies EXIF orientation and refuses images above a pixel
+cap before decoding anything (decompression-bomb protection).
+
+Training (plant_dataset.flow_from_dataset), evaluation and serving all decode
+through this function, so a sideways phone photo is rotated, and JPEGs are
+draft-decoded, the same way everywhere.
+"""
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Refuse anything larger than this many pixels (about 8000 x 5000)
+MAX_IMAGE_PIXELS = 40_000_000
+
+# Same interpolation keras' load_img() uses by default, so models trained
+# before training decoded through this module see the same resize.
+RESAMPLE = Image.NEAREST
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds MAX_IMAGE_PIXELS."""
+
+
+def decode_image(source, target_size=(224, 224), max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Decode an image file to a uint8 (H, W, 3) RGB array of target_size.
+
+    Args:
+        source: File path or binary file-like object
+        target_size: (height, width) of the returned array
+        max_pixels: Pixel cap checked from the header before decoding
+    """
+    target_h, target_w = target_size
+
+    with Image.open(source) as img:
+        width, height = img.size
+        if width * height > max_pixels:
+            raise ImageTooLargeError(
+                f"Image is {width}x{height} pixels; the limit is {max_pixels:,} pixels."
+            )
+
+        # Ask for a reduced-resolution JPEG decode. draft() works in stored
+        # (pre-EXIF-rotation) coordinates, so swap the request for rotated images.
+        if img.format == 'JPEG':
+            orientation = img.getexif().get(0x0112, 1)
+            if orientation in _TRANSPOSED_ORIENTATIONS:
+                img.draft('RGB', (target_h, target_w))
+            else:
+                img.draft('RGB', (target_w, target_h))
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != (target_w, target_h):
+            img = img.resize((target_w, target_h), RESAMPLE)
+
+        return np.asarray(img, dtype=np.uint8)
@@ -0,0 +1,396 @@
+"""
+Model loading and prediction for the Flask routes.
+
+Models are loaded once per process, wrapped in a ServingModel (pre-traced
+uint8 batch buckets, see serving.py) and reloaded only when the file on disk
+changes (e.g. after /admin/train_model). When the small fast model exists,
+predictions run as a confidence-gated cascade: every image goes through the
+fast model first and only low-confidence results are escalated to the full
+MobileNetV2-224 model. Optionally, answers of the full model that are still
+below a confidence threshold get batched test-time augmentation within a
+per-request latency budget (ServingModel.predict_tta).
+"""
+
+import os
+import json
+import time
+import threading
+import numpy as np
+
+import metrics
+import prototypes
+import worker_pool
+from preprocessing import load_batch_uint8
+
+MODEL_PATH = "models/plant_model.h5"
+FAST_MODEL_PATH = "models/plant_model_fast.h5"
+LABELS_PATH = "models/labels.json"
+# Retrained model under shadow evaluation (shadow.py)
+CANDIDATE_MODEL_PATH = "models/candidate/plant_model.h5"
+
+FULL_IMG_SIZE = (224, 224)
+FAST_IMG_SIZE = (128, 128)
+
+# Classifier used for the final answer: 'softmax' (trained head), or
+# 'knn' / 'prototype' votes over the embedding index (embedding_index.py)
+CLASSIFIER = os.environ.get('PLANT_CLASSIFIER', 'softmax')
+SIMILAR_IMAGES_K = 5
+
+# Cascade configuration
+CASCADE_ENABLED = os.environ.get('PLANT_CASCADE', '1') == '1'
+CASCADE_THRESHOLD = float(os.environ.get('PLANT_CASCADE_THRESHOLD', '0.85'))
+
+# Adaptive test-time augmentation configuration
+TTA_ENABLED = os.environ.get('PLANT_TTA', '0') == '1'
+TTA_THRESHOLD = float(os.environ.get('PLANT_TTA_THRESHOLD', '0.6'))
+TTA_LATENCY_BUDGET_MS = float(os.environ.get('PLANT_TTA_BUDGET_MS', '250'))
+
+metrics.HELP.update({
+    'tta_requests_total': 'Low-confidence predictions by test-time augmentation outcome',
+})
+
+_model_cache = {}
+_model_lock = threading.Lock()
+
+
+def model_is_trained():
+    """Check whether the full model and its labels exist on disk."""
+    return os.path.exists(MODEL_PATH) and os.path.exists(LABELS_PATH)
+
+
+def load_cached_model(path, img_size=FULL_IMG_SIZE):
+    """
+    Load a model once per process as a warmed ServingModel, reloading it if
+    the file changed.
+    """
+    from tensorflow.keras.models import load_model
+    from serving import ServingModel, TTA_VIEW_COUNTS
+
+    tta_view_counts = TTA_VIEW_COUNTS if (TTA_ENABLED and path == MODEL_PATH) else ()
+    # The full model also returns its pooled features, which are the embeddings of the similarity index
+    features = path == MODEL_PATH
+    mtime = os.path.getmtime(path)
+    with _model_lock:
+        cached = _model_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            metrics.inc('model_cache_requests_total', result='miss')
+            print(f"[INFO] Loading model from {path}...")
+            keras_model = load_model(path)
+            _model_cache[path] = (mtime, ServingModel(keras_model, img_size=img_size,
+                                                           tta_view_counts=tta_view_counts,
+                                                           features=features))
+        else:
+            metrics.inc('model_cache_requests_total', result='hit')
+        return _model_cache[path][1]
+
+
+@metrics.register_collector
+def _export_model_metrics():
+    """Publish loaded model versions and cascade counters at scrape time."""
+    with _model_lock:
+        loaded = dict(_model_cache)
+    for path, (mtime, _) in loaded.items():
+        metrics.set_gauge('plant_model_info', 1, path=path,
+                          version=time.strftime('%Y%m%d%H%M%S', time.localtime(mtime)))
+    snapshot = cascade_stats.snapshot()
+    metrics.set_gauge('cascade_requests', snapshot['requests'])
+    metrics.set_gauge('cascade_escalations', snapshot['escalations'])
+
+
+def warm_up():
+    """Load and warm every available model so the first request is fast."""
+    if worker_pool.pool_enabled():
+        # Models live in the worker processes, which warm themselves
+        worker_pool.get_pool()
+        return
+    if not model_is_trained():
+        return
+    load_cached_model(MODEL_PATH, FULL_IMG_SIZE)
+    if CASCADE_ENABLED and os.path.exists(FAST_MODEL_PATH):
+        load_cached_model(FAST_MODEL_PATH, FAST_IMG_SIZE)
+
+
+def load_labels():
+    """Load the class index -> label mapping."""
+    with open(LABELS_PATH, 'r') as f:
+        return json.load(f)
+
+
+_MODELS = {
+    'full': (MODEL_PATH, FULL_IMG_SIZE),
+    'fast': (FAST_MODEL_PATH, FAST_IMG_SIZE),
+    'candidate': (CANDIDATE_MODEL_PATH, FULL_IMG_SIZE),
+}
+
+
+def predict_local(model_name, images, tta_budget_ms=None):
+    """
+    Run the 'full', 'fast', 'candidate' or 'embed' model in this process on a uint8 batch.
+    'full_features' runs the full model and returns (probabilities, pooled
+    features), with None features for a model without a pooling layer.
+
+    With tta_budget_ms, run test-time augmentation on a single image instead
+    and return (mean probabilities, views), or None if no view count fits
+    the budget.
+    """
+    if model_name == 'embed':
+        from embedding_index import embed_local
+        with metrics.timed('prediction_stage_seconds', stage='inference', model=model_name):
+            return embed_local(images)
+    if model_name == 'full_features':
+        with metrics.timed('prediction_stage_seconds', stage='model_load', model='full'):
+            model = load_cached_model(MODEL_PATH, FULL_IMG_SIZE)
+        with metrics.timed('prediction_stage_seconds', stage='inference', model='full'):
+            if not model.has_features:
+                return model.predict(images), None
+            return model.predict(images, with_features=True)
+    model_path, img_size = _MODELS[model_name]
+    with metrics.timed('prediction_stage_seconds', stage='model_load', model=model_name):
+        model = load_cached_model(model_path, img_size)
+    if tta_budget_ms is not None:
+        views = model.tta_views_within(tta_budget_ms)
+        if not views:
+            return None
+        with metrics.timed('prediction_stage_seconds', stage='tta', model=model_name):
+            return model.predict_tta(images, views), views
+    with metrics.timed('prediction_stage_seconds', stage='inference', model=model_name):
+        return model.predict(images)
+
+
+def predict_batch(model_name, images, tta_budget_ms=None):
+    """Run a model on a uint8 batch, in the worker pool when it is enabled."""
+    pool = worker_pool.get_pool()
+    if pool is None:
+        return predict_local(model_name, images, tta_budget_ms)
+    with metrics.timed('prediction_stage_seconds', stage='worker_inference', model=model_name):
+        return pool.predict(model_name, images, tta_budget_ms)
+
+
+def _run_stage(img_size, filepath, model_name):
+    """
+    Decode an image and run one model on it, timing each stage.
+    Returns (probabilities, features, batch); features are the pooled
+    features for 'full_features' and None otherwise.
+    """
+    with metrics.timed('prediction_stage_seconds', stage='decode', model=model_name):
+        batch = load_batch_uint8(filepath, img_size)
+    if model_name == 'full_features':
+        probabilities, features = predict_batch(model_name, batch)
+        return probabilities[0], None if features is None else features[0], batch
+    return predict_batch(model_name, batch)[0], None, batch
+
+
+def _normalize(vector):
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def _apply_tta(probabilities, batch, budget_ms):
+    """
+    Average single-pass probabilities with as many TTA views as fit the
+    remaining budget. Returns (probabilities, views used).
+    """
+    if budget_ms <= 0:
+        metrics.inc('tta_requests_total', result='over_budget')
+        return probabilities, 0
+    result = predict_batch('full', batch, tta_budget_ms=budget_ms)
+    if result is None:
+        metrics.inc('tta_requests_total', result='over_budget')
+        return probabilities, 0
+    view_probabilities, views = result
+    metrics.inc('tta_requests_total', result='applied', views=views)
+    return (probabilities + views * view_probabilities) / (views + 1), views
+
+
+class CascadeStats:
+    """Thread-safe counters for the serving cascade."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.escalations = 0
+        self.total_ms = 0.0
+        self.fast_ms = 0.0
+        self.full_ms = 0.0
+
+    def record(self, fast_ms, full_ms, escalated):
+        with self._lock:
+            self.requests += 1
+            self.escalations += int(escalated)
+            self.fast_ms += fast_ms
+            self.full_ms += full_ms
+            self.total_ms += fast_ms + full_ms
+
+    def snapshot(self):
+        """Return escalation rate and per-stage/blended mean latency in ms."""
+        with self._lock:
+            requests = self.requests
+            return {
+                'enabled': CASCADE_ENABLED and os.path.exists(FAST_MODEL_PATH),
+                'threshold': CASCADE_THRESHOLD,
+                'requests': requests,
+                'escalations': self.escalations,
+                'escalation_rate': (self.escalations / requests) if requests else 0.0,
+                'mean_fast_ms': (self.fast_ms / requests) if requests else 0.0,
+                'mean_full_ms': (self.full_ms / self.escalations) if self.escalations else 0.0,
+                'blended_latency_ms': (self.total_ms / requests) if requests else 0.0,
+            }
+
+
+cascade_stats = CascadeStats()
+
+
+def classify_image(filepath, embed=False, embed_if_escalated=False):
+    """
+    Classify an image file.
+
+    With embed=True the full model answers directly (no cascade) and also
+    returns the image's pooled features as an L2-normalized embedding, so a
+    caller that needs the embedding pays for a single backbone pass.
+    With embed_if_escalated=True the cascade runs as usual and the embedding
+    comes for free from the full model pass, when there is one.
+
+    Returns:
+        (probabilities, info) where probabilities is a 1-D numpy array indexed
+        like labels.json and info describes which cascade stage answered, how
+        many TTA views were averaged in and the embedding (None unless the
+        full model ran with embed or embed_if_escalated).
+    """
+    use_cascade = CASCADE_ENABLED and os.path.exists(FAST_MODEL_PATH) and not embed
+    fast_ms = 0.0
+    full_ms = 0.0
+    tta_ms = 0.0
+    tta_views = 0
+    escalated = False
+    features = None
+
+    metrics.add_gauge('inference_in_flight', 1)
+    try:
+        if use_cascade:
+            start = time.perf_counter()
+            probabilities, _, _ = _run_stage(FAST_IMG_SIZE, filepath, 'fast')
+            fast_ms = (time.perf_counter() - start) * 1000
+            escalated = float(np.max(probabilities)) < CASCADE_THRESHOLD
+
+        if not use_cascade or escalated:
+            start = time.perf_counter()
+            probabilities, features, batch = _run_stage(FULL_IMG_SIZE, filepath,
+                                                        'full_features' if embed or embed_if_escalated else 'full')
+            full_ms = (time.perf_counter() - start) * 1000
+
+            # Hard images: spend what is left of the budget on augmented views
+            if TTA_ENABLED and float(np.max(probabilities)) < TTA_THRESHOLD:
+                start = time.perf_counter()
+                probabilities, tta_views = _apply_tta(
+                    probabilities, batch, TTA_LATENCY_BUDGET_MS - (fast_ms + full_ms))
+                tta_ms = (time.perf_counter() - start) * 1000
+    finally:
+        metrics.add_gauge('inference_in_flight', -1)
+
+    if not embed:
+        cascade_stats.record(fast_ms, full_ms, escalated)
+
+    info = {
+        'stage': 'full' if (escalated or not use_cascade) else 'fast',
+        'escalated': escalated,
+        'tta_views': tta_views,
+        'latency_ms': round(fast_ms + full_ms + tta_ms, 2),
+        'embedding': None if features is None else _normalize(np.asarray(features, dtype=np.float32)),
+    }
+    return probabilities, info
+
+
+def find_similar(embedding, k=SIMILAR_IMAGES_K):
+    """Nearest reference images to an embedding; empty when no index has been built."""
+    from embedding_index import get_index
+
+    index = get_index()
+    if embedding is None or index is None or index.count == 0:
+        return []
+    with metrics.timed('prediction_stage_seconds', stage='similarity_search'):
+        return index.search(embedding, k)
+
+
+def index_vote_probabilities(embedding, labels, mode=CLASSIFIER):
+    """
+    kNN or prototype vote from the embedding index as a probability array
+    aligned with labels.json. Returns None if the vote is unavailable.
+    """
+    from embedding_index import get_index
+
+    index = get_index()
+    if embedding is None or index is None:
+        return None
+    scores = index.knn_vote(embedding) if mode == 'knn' else index.prototype_vote(embedding)
+    probabilities = np.zeros(len(labels), dtype=np.float32)
+    for idx, label in labels.items():
+        probabilities[int(idx)] = scores.get(label, 0.0)
+    return probabilities
+
+
+def has_index():
+    """True if an embedding index has been built."""
+    from embedding_index import get_index
+    return get_index() is not None
+
+
+def needs_embedding(trained_labels, labels):
+    """
+    True if the answer for an image depends on its embedding: registered
+    few-shot classes exist, or an embedding index exists and the
+    kNN/prototype classifier is selected.
+    """
+    if len(labels) > len(trained_labels):
+        return True
+    return CLASSIFIER != 'softmax' and has_index()
+
+
+def apply_heads(probabilities, embedding, labels, trained_class_count):
+    """
+    The heads identify() applies on top of the softmax for an embedded
+    image: the optional kNN/prototype classifier (CLASSIFIER), then the
+    few-shot prototype head. Returns (probabilities aligned with labels,
+    True if a registered class answered).
+    """
+    if CLASSIFIER != 'softmax':
+        vote = index_vote_probabilities(embedding, labels)
+        if vote is not None:
+            probabilities = vote
+    return prototypes.apply_prototype_head(probabilities, embedding, labels, trained_class_count)
+
+
+def identify(filepath, k=0):
+    """
+    Full identification of an image file: the softmax cascade and, when
+    registered few-shot classes or an embedding index exist, the few-shot
+    prototype head (prototypes.py), the optional kNN/prototype classifier
+    and the k nearest reference images (only if k > 0).
+
+    The embedding all of these need is the full model's pooled features
+    from the classification pass itself (classify_image(embed=True)), so an
+    image costs at most one MobileNetV2-224 pass. Similar images alone do
+    not bypass the cascade: they are found only for images the fast model
+    escalated, whose full pass yields the embedding anyway.
+
+    Returns:
+        (probabilities, labels, info, matches) where probabilities is aligned
+        with labels (labels.json plus registered classes) and matches are the
+        nearest reference images.
+    """
+    trained_labels = load_labels()
+    labels = prototypes.extend_labels(trained_labels)
+    probabilities, info = classify_image(filepath, embed=needs_embedding(trained_labels, labels),
+                                         embed_if_escalated=k > 0 and has_index())
+    embedding = info.pop('embedding')
+    probabilities = np.pad(probabilities, (0, len(labels) - len(probabilities)))
+    info['prototype'] = False
+
+    matches = []
+    if embedding is None:
+        return probabilities, labels, info, matches
+    try:
+        if k > 0:
+            matches = find_similar(embedding, k)
+        probabilities, info['prototype'] = apply_heads(probabilities, embedding, labels, len(trained_labels))
+    except Exception as e:
+        print(f"Similar image search failed: {str(e)}")
+    return probabilities, labels, info, matches
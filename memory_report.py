@@ -0,0 +1,90 @@
+"""
+Per-process memory report for the gunicorn master and its workers (Linux).
+
+For each process it shows:
+- RSS:  resident pages, including pages shared with other processes
+- PSS:  RSS with shared pages divided among the processes sharing them
+- USS:  unique (private) pages, i.e. what killing the process would free
+
+Worker RSS minus USS is what a worker shares with the master and its
+siblings: the modules imported before fork (preload_app). The model weights
+are loaded after fork and count towards each worker's USS.
+
+Usage:
+    python memory_report.py <master_pid>
+    python memory_report.py            # finds the gunicorn master by name
+"""
+
+import os
+import sys
+
+
+def read_memory(pid):
+    """Return RSS/PSS/USS in kB from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':'):
+                values[parts[0][:-1]] = int(parts[1])
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+def children_of(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the ppid follows the closing paren
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def find_gunicorn_master():
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+        except OSError:
+            continue
+        if 'gunicorn' in cmdline and 'wsgi:app' in cmdline:
+            pid = int(entry)
+            if children_of(pid):
+                return pid
+    return None
+
+
+def report(master_pid):
+    rows = [('master', master_pid)] + [('worker', pid) for pid in children_of(master_pid)]
+
+    print("="*70)
+    print(f"{'Role':<8s} | {'PID':>8s} | {'RSS MB':>10s} | {'PSS MB':>10s} | {'USS MB':>10s}")
+    print("-"*70)
+    total_uss = 0
+    for role, pid in rows:
+        mem = read_memory(pid)
+        total_uss += mem['uss']
+        print(f"{role:<8s} | {pid:>8d} | {mem['rss']/1024:10.1f} | {mem['pss']/1024:10.1f} | {mem['uss']/1024:10.1f}")
+    print("-"*70)
+    print(f"Total unique memory: {total_uss/1024:.1f} MB")
+    print("="*70)
+
+
+if __name__ == '__main__':
+    pid = int(sys.argv[1]) if len(sys.argv) > 1 else find_gunicorn_master()
+    if pid is None:
+        print("❌ Gunicorn master not found. Pass its PID: python memory_report.py <pid>")
+        sys.exit(1)
+    report(pid)
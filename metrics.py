@@ -0,0 +1,265 @@
+"""
+In-process metrics with Prometheus text-format export.
+
+Counters, gauges and histograms are kept in memory per process. When
+METRICS_DIR is set (e.g. under gunicorn, see wsgi.py), every process also
+flushes its state to METRICS_DIR/<pid>.json at most once per
+FLUSH_INTERVAL_SECONDS and at exit. The /metrics endpoint merges all
+files, so histogram buckets, sums and counts add up correctly across
+workers:
+
+- counters and histograms are summed over every file, including files from
+  workers that have exited (their observations still happened);
+- gauges are summed over live processes only.
+
+Usage:
+    with metrics.timed('prediction_stage_seconds', stage='decode'):
+        ...
+    metrics.inc('upload_store_requests_total', result='dedup')
+    metrics.set_gauge('inference_in_flight', 3)
+"""
+
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+FLUSH_INTERVAL_SECONDS = 1.0
+
+# Latency buckets in seconds (1 ms .. 60 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    'prediction_stage_seconds': 'Time spent in each stage of the prediction path',
+    'training_epoch_seconds': 'Wall-clock time per training epoch',
+    'db_query_seconds': 'Time spent in database calls',
+    'model_cache_requests_total': 'Model cache lookups by result',
+    'upload_store_requests_total': 'Upload store writes by result (new or dedup)',
+    'inference_in_flight': 'Inference calls currently running or queued in this process',
+    'plant_model_info': 'Currently loaded model file and version',
+    'cascade_requests': 'Requests answered through the model cascade',
+    'cascade_escalations': 'Cascade requests escalated to the full model',
+}
+
+_lock = threading.Lock()
+_counters = {}     # (name, labels) -> float
+_gauges = {}       # (name, labels) -> float
+_histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+_collectors = []
+_last_flush = 0.0
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1.0, **labels):
+    """Increment a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + amount
+    _maybe_flush()
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to an absolute value."""
+    with _lock:
+        _gauges[_key(name, labels)] = float(value)
+    _maybe_flush()
+
+
+def add_gauge(name, amount, **labels):
+    """Add to (or subtract from) a gauge."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0.0) + amount
+    _maybe_flush()
+
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram (DEFAULT_BUCKETS, seconds)."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * len(DEFAULT_BUCKETS) + [0.0, 0]
+        for i, upper in enumerate(DEFAULT_BUCKETS):
+            if value <= upper:
+                hist[i] += 1
+        hist[-2] += value
+        hist[-1] += 1
+    _maybe_flush()
+
+
+@contextmanager
+def timed(name, **labels):
+    """Context manager that observes the elapsed wall-clock seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed_function(name, **labels):
+    """Decorator form of timed()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_collector(func):
+    """
+    Register a callback run before each export. Collectors update gauges
+    from other modules' state (cascade stats, loaded model version, ...).
+    """
+    _collectors.append(func)
+    return func
+
+
+def _snapshot():
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'counters': [[k[0], list(k[1]), v] for k, v in _counters.items()],
+            'gauges': [[k[0], list(k[1]), v] for k, v in _gauges.items()],
+            'histograms': [[k[0], list(k[1]), v] for k, v in _histograms.items()],
+        }
+
+
+def flush():
+    """Write this process's metrics to METRICS_DIR (multi-process mode only)."""
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp_path, path)
+    _last_flush = time.time()
+
+
+def _maybe_flush():
+    if METRICS_DIR and time.time() - _last_flush >= FLUSH_INTERVAL_SECONDS:
+        try:
+            flush()
+        except OSError as e:
+            print(f"Error flushing metrics: {str(e)}")
+
+
+def reset_dir():
+    """Remove per-process files from a previous run (call once in the master)."""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        if filename.endswith('.json'):
+            os.remove(os.path.join(METRICS_DIR, filename))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _load_snapshots():
+    if not METRICS_DIR:
+        return [_snapshot()]
+    flush()
+    snapshots = []
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _merge(snapshots):
+    counters, gauges, histograms = {}, {}, {}
+    for snap in snapshots:
+        alive = snap['pid'] == os.getpid() or _pid_alive(snap['pid'])
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(tuple(l) for l in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        if alive:
+            for name, labels, value in snap['gauges']:
+                key = (name, tuple(tuple(l) for l in labels))
+                gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, values in snap['histograms']:
+            key = (name, tuple(tuple(l) for l in labels))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+    return counters, gauges, histograms
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + (list(extra) if extra else [])
+    if not pairs:
+        return ''
+    escaped = []
+    for k, v in pairs:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{k}="{v}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus():
+    """Return all metrics, merged across processes, in Prometheus text format."""
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            print(f"Error in metrics collector: {str(e)}")
+
+    counters, gauges, histograms = _merge(_load_snapshots())
+    lines = []
+    seen = set()
+
+    def header(name, metric_type):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, 'gauge')
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), values in sorted(histograms.items()):
+        header(name, 'histogram')
+        for upper, count in zip(DEFAULT_BUCKETS, values[:-2]):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', upper)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+if METRICS_DIR:
+    atexit.register(flush)
@@ -0,0 +1,106 @@
+"""
+Dataset manifest helpers.
+
+The manifest is a deterministic list of every image under dataset/<class>/
+with its class index and training/validation subset. The split mirrors
+ImageDataGenerator(validation_split=0.2): for each class, the first 20% of
+the sorted file names are validation and the rest are training, so tools
+built on the manifest see the same split as train_model.py.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from preprocessing import load_image_uint8
+
+DATASET_PATH = "dataset/"
+# flow_from_directory's whitelist (it skips .gif), so the manifest lists the files it trains on
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+
+
+def build_manifest(dataset_path=DATASET_PATH, validation_split=0.2):
+    """
+    Scan the dataset folder and return a manifest dict:
+
+    {
+        'classes': ['aloevera', 'amla', ...],
+        'entries': [{'path': ..., 'label': 0, 'subset': 'training'}, ...]
+    }
+    """
+    classes = sorted(d for d in os.listdir(dataset_path)
+                     if os.path.isdir(os.path.join(dataset_path, d)))
+    entries = []
+
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(dataset_path, class_name)
+        files = sorted(f for f in os.listdir(class_dir)
+                       if f.lower().endswith(IMAGE_EXTENSIONS))
+        num_validation = int(validation_split * len(files))
+
+        for i, filename in enumerate(files):
+            entries.append({
+                'path': os.path.join(class_dir, filename),
+                'label': label,
+                'subset': 'validation' if i < num_validation else 'training'
+            })
+
+    return {'classes': classes, 'entries': entries}
+
+
+def manifest_fingerprint(manifest):
+    """Short hash identifying the manifest contents (paths, labels, sizes)."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(manifest['classes']).encode('utf-8'))
+    for entry in manifest['entries']:
+        size = os.path.getsize(entry['path']) if os.path.exists(entry['path']) else -1
+        digest.update(f"{entry['path']}|{entry['label']}|{entry['subset']}|{size}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def subset_entries(manifest, subset):
+    """Return the manifest entries belonging to 'training' or 'validation'."""
+    return [e for e in manifest['entries'] if e['subset'] == subset]
+
+
+def load_images(paths, target_size):
+    """Load image files into a uint8 (N, H, W, 3) array."""
+    batch = np.empty((len(paths), target_size[0], target_size[1], 3), dtype=np.uint8)
+    for i, path in enumerate(paths):
+        load_image_uint8(path, target_size, out=batch[i])
+    return batch
+
+
+def flow_from_dataset(datagen, target_size, batch_size, subset, shuffle, seed=None, dataset_path=DATASET_PATH):
+    """
+    datagen.flow_from_directory(class_mode='sparse') that decodes every image
+    with load_image_uint8(), the same decoder serving uses (EXIF orientation,
+    reduced-resolution JPEG decode), instead of keras' load_img().
+
+    The result is a regular keras DirectoryIterator, so augmentation, the
+    validation split and checkpointing of its shuffle order work unchanged.
+    """
+    from tensorflow.keras.preprocessing.image import DirectoryIterator
+
+    class DecodedDirectoryIterator(DirectoryIterator):
+        def _get_batches_of_transformed_samples(self, index_array):
+            batch_x = np.empty((len(index_array),) + self.image_shape, dtype=self.dtype)
+            pixels = np.empty(self.image_shape, dtype=np.uint8)
+            for i, j in enumerate(index_array):
+                x = load_image_uint8(self.filepaths[j], self.target_size, out=pixels).astype(self.dtype)
+                params = self.image_data_generator.get_random_transform(x.shape)
+                x = self.image_data_generator.apply_transform(x, params)
+                batch_x[i] = self.image_data_generator.standardize(x)
+            return batch_x, self.classes[index_array].astype(self.dtype)
+
+    return DecodedDirectoryIterator(
+        dataset_path, datagen,
+        target_size=target_size,
+        batch_size=batch_size,
+        class_mode='sparse',
+        subset=subset,
+        shuffle=shuffle,
+        seed=seed,
+        dtype=datagen.dtype,
+    )
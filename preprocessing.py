@@ -0,0 +1,83 @@
+"""
+Single source of truth for image preprocessing.
+
+Training, serving and test_model.py all read images as uint8 HWC arrays with
+load_image_uint8() (directly, or through plant_dataset.flow_from_dataset())
+and leave normalization to the model graph:
+
+- Models built by train_model.build_model() start with a Rescaling layer
+  named 'input_rescaling', so they take raw 0-255 pixels directly.
+- Older models without that layer get the same 1/255 scale applied by
+  normalize_images() inside the serving graph (see serving.py), or by
+  ImageDataGenerator(rescale=input_scale_for(model)) in evaluation code.
+
+Either way no NumPy float copy of the image is made per request.
+"""
+
+import numpy as np
+
+IMG_SIZE = (224, 224)
+INPUT_SCALE = 1.0 / 255
+RESCALING_LAYER_NAME = 'input_rescaling'
+
+
+def rescaling_layer():
+    """Keras layer that maps raw 0-255 pixels to the [0, 1] range the backbone was trained on."""
+    from tensorflow.keras.layers import Rescaling
+    return Rescaling(INPUT_SCALE, name=RESCALING_LAYER_NAME)
+
+
+def model_has_rescaling(model):
+    """True if the model normalizes its own input (built with rescaling_layer())."""
+    return any(layer.name == RESCALING_LAYER_NAME for layer in model.layers)
+
+
+def input_scale_for(model):
+    """Scale to apply to raw pixels before feeding this model (1.0 if it rescales itself)."""
+    return 1.0 if model_has_rescaling(model) else INPUT_SCALE
+
+
+def normalize_images(images, img_size, scale):
+    """
+    In-graph preprocessing: uint8 (N, H, W, 3) -> float32 model input.
+
+    Resizes only when the spatial size differs from img_size, so the common
+    fixed-size serving path is a single cast and multiply.
+    """
+    import tensorflow as tf
+
+    x = tf.cast(images, tf.float32)
+    if tuple(images.shape[1:3]) != tuple(img_size):
+        x = tf.image.resize(x, img_size)
+    if scale != 1.0:
+        x = x * scale
+    return x
+
+
+def load_image_uint8(path, target_size=IMG_SIZE, out=None):
+    """
+    Load an image file as a uint8 (H, W, 3) array.
+
+    Decoding goes through image_io.decode_image() (reduced-resolution JPEG
+    decode, EXIF orientation, pixel cap).
+
+    Args:
+        path: Image file path or file-like object
+        target_size: (height, width) to resize to
+        out: Optional preallocated uint8 array to write into (e.g. one row of
+             a batch buffer), avoiding a per-image allocation
+    """
+    from image_io import decode_image
+
+    pixels = decode_image(path, target_size)
+    if out is None:
+        return pixels
+    out[...] = pixels
+    return out
+
+
+def load_batch_uint8(path, target_size=IMG_SIZE):
+    """Load a single image as a uint8 (1, H, W, 3) batch."""
+    batch = np.empty((1, target_size[0], target_size[1], 3), dtype=np.uint8)
+    load_image_uint8(path, target_size, out=batch[0])
+    return batch
@@ -0,0 +1,201 @@
+"""
+Opt-in per-request profiling for any Flask route.
+
+A request is profiled when either
+- it carries the header `X-Profile: <PLANT_PROFILE_TOKEN>` (ignored while the
+  token is not configured, so anonymous clients cannot turn profiling on), or
+- a random draw falls below PROFILE_SAMPLE_RATE (0.0 - 1.0, default off).
+
+Each profiled request produces, under PROFILE_DIR/<endpoint>/:
+- <id>.pstats      cProfile output (open with `python -m pstats` or snakeviz)
+- <id>.collapsed   stack samples in collapsed format, ready for
+                   flamegraph.pl / speedscope / inferno
+- <id>.json        request metadata (path, method, status, duration)
+
+PROFILE_DIR is a bounded ring buffer: once it holds more than
+PROFILE_MAX_ENTRIES profiles the oldest are deleted. Profile ids start with
+their creation time, so trimming only lists file names.
+"""
+
+import os
+import sys
+import json
+import hmac
+import time
+import random
+import cProfile
+import threading
+from collections import Counter
+
+from flask import g, request
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.environ.get('PLANT_PROFILE_TOKEN', '')
+PROFILE_MAX_ENTRIES = int(os.environ.get('PROFILE_MAX_ENTRIES', '200'))
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+_ring_lock = threading.Lock()
+
+
+class StackSampler(threading.Thread):
+    """Periodically sample one thread's Python stack into collapsed-stack counts."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_SECONDS):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _should_profile():
+    header = request.headers.get(PROFILE_HEADER)
+    if PROFILE_TOKEN and header and hmac.compare_digest(header, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _start_profile():
+    if not _should_profile():
+        return
+    g._profiler = cProfile.Profile()
+    g._sampler = StackSampler(threading.get_ident())
+    g._profile_start = time.perf_counter()
+    g._sampler.start()
+    g._profiler.enable()
+
+
+def _finish_profile(response):
+    profiler = g.pop('_profiler', None)
+    if profiler is None:
+        return response
+
+    profiler.disable()
+    sampler = g.pop('_sampler')
+    sampler.stop()
+    duration_ms = (time.perf_counter() - g.pop('_profile_start')) * 1000
+
+    endpoint = request.endpoint or 'unknown'
+    profile_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{random.randint(0, 0xffff):04x}"
+    endpoint_dir = os.path.join(PROFILE_DIR, endpoint)
+
+    try:
+        os.makedirs(endpoint_dir, exist_ok=True)
+        base = os.path.join(endpoint_dir, profile_id)
+        profiler.dump_stats(base + '.pstats')
+        with open(base + '.collapsed', 'w') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(base + '.json', 'w') as f:
+            json.dump({
+                'id': profile_id,
+                'endpoint': endpoint,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 2),
+                'samples': sum(sampler.stacks.values()),
+                'timestamp': time.time(),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }, f)
+        _enforce_ring_buffer()
+    except OSError as e:
+        print(f"Error writing profile: {str(e)}")
+
+    response.headers['X-Profile-Id'] = f"{endpoint}/{profile_id}"
+    return response
+
+
+def _abort_profile(exc):
+    """Stop profiling if the request failed before after_request ran."""
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        g.pop('_sampler').stop()
+
+
+def _enforce_ring_buffer():
+    """Delete the oldest profiles beyond PROFILE_MAX_ENTRIES."""
+    with _ring_lock:
+        profiles = []
+        for endpoint in os.listdir(PROFILE_DIR):
+            endpoint_dir = os.path.join(PROFILE_DIR, endpoint)
+            if not os.path.isdir(endpoint_dir):
+                continue
+            profiles.extend((filename[:-len('.json')], endpoint)
+                            for filename in os.listdir(endpoint_dir) if filename.endswith('.json'))
+        excess = len(profiles) - PROFILE_MAX_ENTRIES
+        if excess <= 0:
+            return
+        # Ids sort by creation time (see _finish_profile), oldest first
+        profiles.sort()
+        for profile_id, endpoint in profiles[:excess]:
+            base = os.path.join(PROFILE_DIR, endpoint, profile_id)
+            for ext in ('.json', '.pstats', '.collapsed'):
+                try:
+                    os.remove(base + ext)
+                except FileNotFoundError:
+                    pass
+
+
+def list_profiles(limit=50, order='slowest'):
+    """Return profile metadata, sorted by 'slowest', 'newest' or 'oldest'."""
+    entries = []
+    if not os.path.isdir(PROFILE_DIR):
+        return entries
+    for endpoint in os.listdir(PROFILE_DIR):
+        endpoint_dir = os.path.join(PROFILE_DIR, endpoint)
+        if not os.path.isdir(endpoint_dir):
+            continue
+        for filename in os.listdir(endpoint_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(endpoint_dir, filename)) as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    if order == 'slowest':
+        entries.sort(key=lambda e: e['duration_ms'], reverse=True)
+    elif order == 'newest':
+        entries.sort(key=lambda e: e['timestamp'], reverse=True)
+    else:
+        entries.sort(key=lambda e: e['timestamp'])
+    return entries if limit is None else entries[:limit]
+
+
+def profile_file_path(endpoint, profile_id, kind):
+    """Path of a stored profile artifact ('pstats' or 'collapsed'), or None."""
+    if kind not in ('pstats', 'collapsed'):
+        return None
+    # Endpoint and id come from the URL; only accept names we generated
+    if os.sep in endpoint or os.sep in profile_id or '..' in endpoint or '..' in profile_id:
+        return None
+    path = os.path.join(PROFILE_DIR, endpoint, f"{profile_id}.{kind}")
+    return path if os.path.exists(path) else None
+
+
+def init_profiling(app):
+    """Install the profiling hooks on a Flask app."""
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_abort_profile)
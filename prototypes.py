@@ -0,0 +1,292 @@
+"""
+Few-shot plant classes via embedding prototypes.
+
+A new species can be registered from a handful of images without retraining:
+the images are embedded with the frozen backbone (embedding_index), their
+normalized mean becomes the class prototype, and the prototype head is used
+alongside the trained softmax at prediction time.
+
+Storage:
+    models/prototypes.json   {"classes": [{"name", "count", "created_at"}, ...]}
+    models/prototypes.npy    (num_classes x dim) float32, row i = classes[i]
+
+At prediction time the query embedding is compared with the prototypes of
+the registered classes and with the class prototypes of the trained classes
+(from the embedding index). If the closest prototype belongs to a
+registered class (and is similar enough), the prototype head answers;
+otherwise the trained softmax answer stands. Without an embedding index a
+registered class only answers when the softmax is not confident.
+
+Registered classes get label indices after the trained ones, so probability
+arrays stay aligned with inference.identify()'s labels.
+
+When the model is retrained with the class's images (register_class() also
+copies them into dataset/<name>/), the class becomes a softmax class and its
+prototype is ignored. A name that already is a trained class is rejected.
+
+Registrations may run concurrently in different gunicorn workers, so the
+read-modify-write of the store is done under an flock on PROTOTYPES_LOCK.
+"""
+
+import os
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+PROTOTYPES_JSON = "models/prototypes.json"
+PROTOTYPES_NPY = "models/prototypes.npy"
+PROTOTYPES_LOCK = "models/prototypes.lock"
+DATASET_PATH = "dataset/"
+MIN_PROTOTYPE_SIMILARITY = float(os.environ.get('MIN_PROTOTYPE_SIMILARITY', '0.5'))
+PROTOTYPE_TEMPERATURE = 0.05
+# Without an embedding index there are no trained-class prototypes to compare
+# against; a confident softmax answer is then kept
+KEEP_SOFTMAX_CONFIDENCE = 0.9
+
+_lock = threading.Lock()
+_cache = {'mtime': None, 'classes': [], 'vectors': None}
+
+
+def _load():
+    """Return (classes, vectors), reloading if another process updated the files."""
+    with _lock:
+        if not os.path.exists(PROTOTYPES_JSON):
+            return [], None
+        mtime = os.path.getmtime(PROTOTYPES_JSON)
+        if _cache['mtime'] != mtime:
+            with open(PROTOTYPES_JSON) as f:
+                classes = json.load(f)['classes']
+            vectors = np.load(PROTOTYPES_NPY) if classes else None
+            _cache.update(mtime=mtime, classes=classes, vectors=vectors)
+        return _cache['classes'], _cache['vectors']
+
+
+def _save(classes, vectors):
+    os.makedirs(os.path.dirname(PROTOTYPES_JSON), exist_ok=True)
+    tmp_npy = PROTOTYPES_NPY + '.tmp.npy'
+    np.save(tmp_npy, vectors.astype(np.float32))
+    os.replace(tmp_npy, PROTOTYPES_NPY)
+    # The JSON is written last; readers reload when its mtime changes
+    tmp_json = PROTOTYPES_JSON + '.tmp'
+    with open(tmp_json, 'w') as f:
+        json.dump({'classes': classes}, f, indent=4)
+    os.replace(tmp_json, PROTOTYPES_JSON)
+
+
+@contextmanager
+def _store_locked():
+    """Exclusive cross-process lock on the prototype store (blocks until free)."""
+    os.makedirs(os.path.dirname(PROTOTYPES_LOCK), exist_ok=True)
+    with open(PROTOTYPES_LOCK, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def registered_classes():
+    """Registered few-shot classes: [{'name', 'count', 'created_at'}, ...]."""
+    classes, _ = _load()
+    return [dict(c) for c in classes]
+
+
+def prototype_class_names(trained_labels):
+    """Registered class names that are not (yet) softmax classes, in label order."""
+    trained = {name.lower() for name in trained_labels.values()}
+    classes, _ = _load()
+    return [c['name'] for c in classes if c['name'].lower() not in trained]
+
+
+def extend_labels(trained_labels):
+    """labels.json mapping extended with registered classes at the following indices."""
+    labels = dict(trained_labels)
+    for name in prototype_class_names(trained_labels):
+        labels[str(len(labels))] = name
+    return labels
+
+
+def apply_prototype_head(probabilities, embedding, labels, trained_class_count):
+    """
+    Combine trained softmax probabilities with the prototype head.
+
+    Args:
+        probabilities: Softmax output over the trained classes
+        embedding: L2-normalized query embedding (or None)
+        labels: Extended labels from extend_labels()
+        trained_class_count: Number of softmax classes
+
+    Returns:
+        (probabilities over all labels, True if a registered class answered)
+    """
+    extended = np.zeros(len(labels), dtype=np.float32)
+    extended[:trained_class_count] = probabilities[:trained_class_count]
+    classes, vectors = _load()
+    if embedding is None or vectors is None or len(labels) == trained_class_count:
+        return extended, False
+
+    from embedding_index import get_index
+
+    names = []
+    matrices = []
+    index = get_index()
+    if index is None or index.count == 0:
+        if float(np.max(extended)) >= KEEP_SOFTMAX_CONFIDENCE:
+            return extended, False
+    else:
+        trained_names = set(list(labels.values())[:trained_class_count])
+        known_names, known_matrix = index.prototypes()
+        keep = [i for i, name in enumerate(known_names) if name in trained_names]
+        names += [known_names[i] for i in keep]
+        matrices.append(known_matrix[keep])
+
+    registered = {name for name in list(labels.values())[trained_class_count:]}
+    rows = [i for i, c in enumerate(classes) if c['name'] in registered]
+    names += [classes[i]['name'] for i in rows]
+    matrices.append(vectors[rows])
+
+    similarities = np.concatenate(matrices) @ np.asarray(embedding, dtype=np.float32).reshape(-1)
+    best = int(np.argmax(similarities))
+    if names[best] not in registered or similarities[best] < MIN_PROTOTYPE_SIMILARITY:
+        return extended, False
+
+    logits = similarities / PROTOTYPE_TEMPERATURE
+    scores = np.exp(logits - logits.max())
+    scores /= scores.sum()
+    index_of = {name: int(idx) for idx, name in labels.items()}
+    extended[:] = 0.0
+    for name, score in zip(names, scores):
+        extended[index_of[name]] = score
+    return extended, True
+
+
+def refresh_classes(names):
+    """
+    Recompute the prototypes of the registered classes among `names` from
+    the images now in dataset/<name>/, after the dataset gallery moved or
+    deleted some of them. A class left without images is unregistered.
+    Returns the names that were refreshed.
+    """
+    from embedding_index import embed_files
+    from plant_dataset import IMAGE_EXTENSIONS
+
+    classes, _ = _load()
+    affected = [c['name'] for c in classes if c['name'] in set(names)]
+    if not affected:
+        return []
+
+    refreshed = {}
+    for name in affected:
+        class_dir = os.path.join(DATASET_PATH, name)
+        paths = sorted(os.path.join(class_dir, f) for f in os.listdir(class_dir)
+                       if f.lower().endswith(IMAGE_EXTENSIONS)) if os.path.isdir(class_dir) else []
+        if not paths:
+            refreshed[name] = None
+            continue
+        prototype = embed_files(paths).mean(axis=0)
+        refreshed[name] = (prototype / max(np.linalg.norm(prototype), 1e-12), len(paths))
+
+    with _store_locked():
+        with _lock:
+            _cache['mtime'] = None
+        classes, existing = _load()
+        classes_out = []
+        vectors_out = []
+        for i, c in enumerate(classes):
+            if c['name'] not in refreshed:
+                classes_out.append(dict(c))
+                vectors_out.append(existing[i])
+            elif refreshed[c['name']] is not None:
+                prototype, count = refreshed[c['name']]
+                classes_out.append(dict(c, count=count))
+                vectors_out.append(prototype)
+        dim = existing.shape[1] if existing is not None else 0
+        _save(classes_out, np.array(vectors_out, dtype=np.float32).reshape(len(vectors_out), -1)
+              if vectors_out else np.zeros((0, dim), dtype=np.float32))
+    return affected
+
+
+def register_class(name, image_files, botanical_name, benefits):
+    """
+    Register a new class from a few images.
+
+    Args:
+        name: Class / plant name (used as dataset folder name)
+        image_files: werkzeug FileStorage objects or paths
+        botanical_name, benefits: Used to create the linked `plants` row
+
+    Returns:
+        (success, message)
+    """
+    from werkzeug.utils import secure_filename
+    from database import add_plant, adjust_dataset_stats
+    from embedding_index import embed_files, get_index
+    from inference import model_is_trained, load_labels
+
+    folder_name = secure_filename(name).lower()
+    if not folder_name:
+        return False, "Invalid class name."
+    if model_is_trained() and folder_name in {label.lower() for label in load_labels().values()}:
+        return False, (f"'{folder_name}' is already a trained class. Add its images to the dataset "
+                       f"and retrain instead.")
+
+    class_dir = os.path.join(DATASET_PATH, folder_name)
+    os.makedirs(class_dir, exist_ok=True)
+
+    # Keep the images in dataset/ so the next full retrain learns the class
+    paths = []
+    for i, image_file in enumerate(image_files):
+        if isinstance(image_file, str):
+            source_name = os.path.basename(image_file)
+        else:
+            source_name = secure_filename(image_file.filename) or f"image_{i}.jpg"
+        path = os.path.join(class_dir, f"fewshot_{int(time.time())}_{i}_{source_name}")
+        if isinstance(image_file, str):
+            with open(image_file, 'rb') as src, open(path, 'wb') as dst:
+                dst.write(src.read())
+        else:
+            image_file.save(path)
+        paths.append(path)
+
+    if not paths:
+        return False, "Please provide at least one image."
+    adjust_dataset_stats({folder_name: (len(paths), sum(os.path.getsize(p) for p in paths))})
+
+    vectors = embed_files(paths)
+    prototype = vectors.mean(axis=0)
+    prototype /= max(np.linalg.norm(prototype), 1e-12)
+
+    with _store_locked():
+        # Re-read under the lock: another worker may have registered a class meanwhile
+        with _lock:
+            _cache['mtime'] = None
+        classes, existing = _load()
+        classes = [dict(c) for c in classes]
+        names = [c['name'] for c in classes]
+        if folder_name in names:
+            # Merge with the existing prototype, weighted by image count
+            i = names.index(folder_name)
+            count = classes[i]['count']
+            merged = existing[i] * count + prototype * len(paths)
+            existing = existing.copy()
+            existing[i] = merged / max(np.linalg.norm(merged), 1e-12)
+            classes[i]['count'] = count + len(paths)
+            vectors_out = existing
+        else:
+            classes.append({'name': folder_name, 'count': len(paths),
+                            'created_at': time.strftime('%Y-%m-%d %H:%M:%S')})
+            vectors_out = prototype[np.newaxis] if existing is None else np.vstack([existing, prototype])
+        _save(classes, vectors_out)
+
+    # Show the new images as similar references too
+    index = get_index()
+    if index is not None:
+        index.add(vectors, [{'path': p, 'label': folder_name} for p in paths])
+
+    # Link the plants row under the label name (an existing row is kept)
+    add_plant(folder_name, botanical_name, benefits)
+
+    return True, f"Class '{folder_name}' registered from {len(paths)} images and is now being served."
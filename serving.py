@@ -0,0 +1,200 @@
+"""
+Compiled serving wrapper for a trained Keras classifier.
+
+model.predict() builds a data adapter and may retrace on every call, which
+costs more than the actual compute for a single image. ServingModel instead
+traces one concrete tf.function per fixed batch bucket (1/4/8/16) with uint8
+input and in-graph rescaling (preprocessing.normalize_images). Inputs are
+zero-padded up to the nearest bucket, so no call can ever trigger a retrace,
+and every bucket is warmed when the model is loaded.
+
+With features=True the traced functions also return the pooled
+(GlobalAveragePooling) features the classifier head is computed from, so a
+caller that needs both the class probabilities and an embedding for the
+similarity index (embedding_index.py) gets them from one backbone pass.
+
+Optionally (tta_view_counts) it also traces test-time augmentation
+functions: the flips, crops and scales of TTA_VIEWS are cut from one uint8
+image inside the graph (tf.image.crop_and_resize) and classified as a
+single batched forward pass, returning the mean probabilities. The time of
+each view count is measured at warm-up and tracked afterwards, so callers
+can choose the most views that fit a latency budget.
+"""
+
+import time
+import threading
+import numpy as np
+import tensorflow as tf
+
+from preprocessing import normalize_images, input_scale_for
+
+BATCH_BUCKETS = (1, 4, 8, 16)
+
+# Test-time augmentation views as (y1, x1, y2, x2, horizontal flip) in
+# relative coordinates. The unaugmented image is not included: callers
+# average these with the single-pass result they already have. Ordered by
+# usefulness, since a tighter budget keeps only the first n views.
+TTA_VIEWS = (
+    (0.0, 0.0, 1.0, 1.0, True),         # mirror
+    (0.1, 0.1, 0.9, 0.9, False),        # 1.25x zoom
+    (0.1, 0.1, 0.9, 0.9, True),         # 1.25x zoom, mirrored
+    (0.0, 0.0, 0.875, 0.875, False),    # corner crops
+    (0.0, 0.125, 0.875, 1.0, False),
+    (0.125, 0.0, 1.0, 0.875, False),
+    (0.125, 0.125, 1.0, 1.0, False),
+)
+TTA_VIEW_COUNTS = (1, 3, 7)
+TTA_LATENCY_SMOOTHING = 0.2
+
+
+class ServingModel:
+    """Bucketed, pre-traced uint8 inference for a Keras image classifier."""
+
+    def __init__(self, keras_model, img_size=(224, 224), buckets=BATCH_BUCKETS, tta_view_counts=(),
+                 features=False):
+        self.model = keras_model
+        self.img_size = tuple(img_size)
+        self.buckets = tuple(sorted(buckets))
+        self.input_scale = input_scale_for(keras_model)
+        self._features_model = None
+        if features:
+            pooled = [l for l in keras_model.layers if isinstance(l, tf.keras.layers.GlobalAveragePooling2D)]
+            if pooled:
+                self._features_model = tf.keras.Model(keras_model.input, [keras_model.output, pooled[-1].output])
+        self._serve = tf.function(self._serve_fn)
+        self._concrete = {}
+        self._tta_concrete = {}
+        self.tta_ms = {}
+        self._tta_lock = threading.Lock()   # tta_ms is updated from concurrent request threads
+
+        for bucket in self.buckets:
+            spec = tf.TensorSpec([bucket, self.img_size[0], self.img_size[1], 3], tf.uint8, name='images')
+            self._concrete[bucket] = self._serve.get_concrete_function(spec)
+
+        image_spec = tf.TensorSpec([1, self.img_size[0], self.img_size[1], 3], tf.uint8, name='image')
+        for count in sorted(tta_view_counts):
+            views = TTA_VIEWS[:count]
+            fn = tf.function(lambda image, views=views: self._tta_fn(image, views))
+            self._tta_concrete[count] = fn.get_concrete_function(image_spec)
+
+        self.warm_up()
+
+    def _classify_fn(self, images):
+        # Normalize inside the graph so callers never allocate a float copy
+        x = normalize_images(images, self.img_size, self.input_scale)
+        return self.model(x, training=False)
+
+    def _serve_fn(self, images):
+        if self._features_model is None:
+            return self._classify_fn(images)
+        x = normalize_images(images, self.img_size, self.input_scale)
+        return self._features_model(x, training=False)
+
+    def _tta_fn(self, image, views):
+        # Every view is cut and resized from the one decoded image in-graph
+        boxes = tf.constant([v[:4] for v in views], tf.float32)
+        flips = tf.constant([v[4] for v in views], tf.bool)
+        crops = tf.image.crop_and_resize(tf.cast(image, tf.float32), boxes,
+                                         tf.zeros([len(views)], tf.int32), self.img_size)
+        x = tf.where(flips[:, None, None, None], tf.reverse(crops, axis=[2]), crops)
+        if self.input_scale != 1.0:
+            x = x * self.input_scale
+        return tf.reduce_mean(self.model(x, training=False), axis=0)
+
+    @property
+    def max_batch(self):
+        return self.buckets[-1]
+
+    @property
+    def has_features(self):
+        """True if predict(images, with_features=True) is available."""
+        return self._features_model is not None
+
+    def warm_up(self):
+        """Run every bucket once so the first real request pays no setup cost."""
+        for bucket, fn in self._concrete.items():
+            fn(tf.zeros([bucket, self.img_size[0], self.img_size[1], 3], tf.uint8))
+        image = tf.zeros([1, self.img_size[0], self.img_size[1], 3], tf.uint8)
+        for count, fn in self._tta_concrete.items():
+            fn(image)
+            start = time.perf_counter()
+            fn(image)
+            with self._tta_lock:
+                self.tta_ms[count] = (time.perf_counter() - start) * 1000
+
+    def _bucket_for(self, n):
+        for bucket in self.buckets:
+            if n <= bucket:
+                return bucket
+        return self.buckets[-1]
+
+    def predict(self, images, with_features=False):
+        """
+        Predict class probabilities for a uint8 (N, H, W, 3) batch, or
+        (probabilities, pooled features) with with_features=True (requires
+        has_features).
+
+        Batches larger than the biggest bucket are split into chunks.
+        """
+        if with_features and not self.has_features:
+            raise ValueError("Model was loaded without pooled features")
+        images = np.asarray(images, dtype=np.uint8)
+        if images.ndim == 3:
+            images = images[np.newaxis]
+
+        outputs = []
+        features = []
+        for start in range(0, len(images), self.max_batch):
+            chunk = images[start:start + self.max_batch]
+            n = len(chunk)
+            bucket = self._bucket_for(n)
+            if n < bucket:
+                padded = np.zeros((bucket,) + chunk.shape[1:], dtype=np.uint8)
+                padded[:n] = chunk
+                chunk = padded
+            result = self._concrete[bucket](tf.constant(chunk))
+            if self.has_features:
+                result, pooled = result
+                features.append(pooled.numpy()[:n])
+            outputs.append(result.numpy()[:n])
+
+        if with_features:
+            return np.concatenate(outputs, axis=0), np.concatenate(features, axis=0)
+        return np.concatenate(outputs, axis=0)
+
+    def tta_views_within(self, budget_ms):
+        """Largest traced TTA view count whose expected time fits budget_ms (0 if none)."""
+        with self._tta_lock:
+            fitting = [count for count, ms in self.tta_ms.items() if ms <= budget_ms]
+        return max(fitting) if fitting else 0
+
+    def predict_tta(self, image, views):
+        """
+        Mean probabilities over the first `views` TTA_VIEWS of a uint8
+        (1, H, W, 3) image, as one batched forward pass. `views` must be one
+        of the traced tta_view_counts.
+        """
+        image = np.asarray(image, dtype=np.uint8).reshape((1, self.img_size[0], self.img_size[1], 3))
+        start = time.perf_counter()
+        probabilities = self._tta_concrete[views](tf.constant(image)).numpy()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._tta_lock:
+            self.tta_ms[views] += TTA_LATENCY_SMOOTHING * (elapsed_ms - self.tta_ms[views])
+        return probabilities
+
+    def export(self, export_dir):
+        """Export a SavedModel with one uint8 signature per batch bucket."""
+        module = tf.Module()
+        module.model = self.model
+        signatures = {}
+        for bucket, fn in self._concrete.items():
+            module_fn = tf.function(
+                lambda images: {'probabilities': self._classify_fn(images)},
+                input_signature=[tf.TensorSpec([bucket, self.img_size[0], self.img_size[1], 3],
+                                               tf.uint8, name='images')]
+            )
+            setattr(module, f'serve_{bucket}', module_fn)
+            signatures[f'serving_b{bucket}'] = module_fn.get_concrete_function()
+        signatures['serving_default'] = signatures[f'serving_b{self.buckets[0]}']
+        tf.saved_model.save(module, export_dir, signatures=signatures)
+        return export_dir
@@ -0,0 +1,327 @@
+"""
+Shadow evaluation of a candidate model against production traffic.
+
+A retrained model can be saved as a candidate (models/candidate/, see
+`python train_model.py --candidate`) instead of replacing the production
+model. While a candidate exists:
+
+- The prediction routes call mirror() after answering. A random
+  SHADOW_SAMPLE_RATE share of requests is put on a bounded queue (dropped
+  when the queue is full), so the request path only pays for a queue put.
+  Answers from a registered few-shot class (prototypes.py) are skipped:
+  the candidate cannot predict them.
+- One background thread per process takes queued images, waits for
+  interactive requests with yield_to_serving(), runs the candidate on the
+  same file and stores the comparison in SQLite (shadow_results).
+- start_backfill() re-scores every stored upload under static/uploads in
+  batches with both the production full model and the candidate.
+
+Results are kept per candidate version (the candidate file's mtime), and
+report() aggregates them per production label: agreement rate, confidence
+shift and latency difference (candidate minus production). Live latency is
+the production request's model time (cascade and TTA included) against a
+single candidate pass; backfill latency compares the two full models on the
+same batches. Both are measured only after the candidate has been loaded
+and traced (_warm_up()), so the first comparison does not count the load.
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import shutil
+import threading
+import multiprocessing
+import numpy as np
+
+import metrics
+from admission import inference_admission
+from inference import (CANDIDATE_MODEL_PATH, MODEL_PATH, LABELS_PATH, FAST_MODEL_PATH, FULL_IMG_SIZE,
+                       predict_batch, load_labels)
+from preprocessing import load_image_uint8
+from upload_store import iter_uploads
+from database import save_shadow_results, get_shadow_report, clear_shadow_results, get_shadow_rollup
+
+CANDIDATE_DIR = os.path.dirname(CANDIDATE_MODEL_PATH)
+CANDIDATE_LABELS_PATH = os.path.join(CANDIDATE_DIR, "labels.json")
+
+SHADOW_SAMPLE_RATE = float(os.environ.get('PLANT_SHADOW_SAMPLE_RATE', '0.1'))
+SHADOW_QUEUE_SIZE = 64
+BACKFILL_BATCH_SIZE = 16
+
+metrics.HELP.update({
+    'shadow_requests_total': 'Prediction requests mirrored to the candidate model by result',
+})
+
+_queue = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+_backfill_lock = threading.Lock()
+_backfill = {'running': False, 'version': None, 'done': 0, 'total': 0, 'error': None}
+
+_warmed = set()   # (model name, version) already loaded and traced in this process
+
+
+def candidate_version():
+    """Version string of the candidate model, or None if there is no candidate."""
+    if not (os.path.exists(CANDIDATE_MODEL_PATH) and os.path.exists(CANDIDATE_LABELS_PATH)):
+        return None
+    return time.strftime('%Y%m%d%H%M%S', time.localtime(os.path.getmtime(CANDIDATE_MODEL_PATH)))
+
+
+def load_candidate_labels():
+    with open(CANDIDATE_LABELS_PATH, 'r') as f:
+        return json.load(f)
+
+
+def _top(probabilities, labels):
+    idx = int(np.argmax(probabilities))
+    return labels[str(idx)], float(probabilities[idx])
+
+
+def _warm_up(model_name, version):
+    """Load and trace a model once per version, outside any timed comparison."""
+    if (model_name, version) in _warmed:
+        return
+    predict_batch(model_name, np.zeros((1, FULL_IMG_SIZE[0], FULL_IMG_SIZE[1], 3), dtype=np.uint8))
+    _warmed.add((model_name, version))
+
+
+def _run_candidate(paths):
+    """
+    Decode paths and run the candidate on them in one batch. Returns
+    (decoded paths, per-image ms, [(label, confidence), ...], uint8 batch).
+    """
+    batch = np.empty((len(paths), FULL_IMG_SIZE[0], FULL_IMG_SIZE[1], 3), dtype=np.uint8)
+    decoded = []
+    for path in paths:
+        try:
+            load_image_uint8(path, FULL_IMG_SIZE, out=batch[len(decoded)])
+            decoded.append(path)
+        except Exception as e:
+            print(f"[WARN] Shadow: could not read {path}: {str(e)}")
+    if not decoded:
+        return [], 0.0, [], batch[:0]
+    batch = batch[:len(decoded)]
+    labels = load_candidate_labels()
+    start = time.perf_counter()
+    probabilities = predict_batch('candidate', batch)
+    per_image_ms = (time.perf_counter() - start) * 1000 / len(decoded)
+    return decoded, per_image_ms, [_top(row, labels) for row in probabilities], batch
+
+
+# ---------------------------------------------------------------------------
+# Live mirroring
+# ---------------------------------------------------------------------------
+
+def mirror(filepath, probabilities, labels, latency_ms):
+    """
+    Offer one answered prediction to the shadow worker. Cheap and
+    non-blocking; does nothing without a candidate or when not sampled.
+    """
+    if SHADOW_SAMPLE_RATE <= 0 or random.random() >= SHADOW_SAMPLE_RATE:
+        return
+    version = candidate_version()
+    if version is None:
+        return
+    label, confidence = _top(probabilities, labels)
+    if label not in load_labels().values():
+        # A registered few-shot class answered; the candidate cannot predict it
+        metrics.inc('shadow_requests_total', result='skipped')
+        return
+    _start_worker()
+    try:
+        _queue.put_nowait((version, filepath, label, confidence, latency_ms))
+        metrics.inc('shadow_requests_total', result='queued')
+    except queue.Full:
+        metrics.inc('shadow_requests_total', result='dropped')
+
+
+def _compare_live(version, filepath, production_label, production_confidence, production_ms):
+    if candidate_version() != version:
+        metrics.inc('shadow_requests_total', result='stale')
+        return
+    _warm_up('candidate', version)
+    decoded, candidate_ms, answers, _ = _run_candidate([filepath])
+    if not decoded:
+        metrics.inc('shadow_requests_total', result='error')
+        return
+    candidate_label, candidate_confidence = answers[0]
+    save_shadow_results(version, 'live', [(filepath, production_label, production_confidence, production_ms,
+                                           candidate_label, candidate_confidence, candidate_ms)])
+    metrics.inc('shadow_requests_total', result='agree' if candidate_label == production_label else 'disagree')
+
+
+def _worker_loop():
+    while True:
+        item = _queue.get()
+        try:
+            inference_admission.yield_to_serving()
+            _compare_live(*item)
+        except Exception as e:
+            metrics.inc('shadow_requests_total', result='error')
+            print(f"[ERROR] Shadow worker: {str(e)}")
+
+
+def _start_worker():
+    """Start this process's shadow thread (once per process)."""
+    global _worker_pid
+    if multiprocessing.parent_process() is not None:
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        threading.Thread(target=_worker_loop, name='shadow-worker', daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Historical backfill
+# ---------------------------------------------------------------------------
+
+def _run_backfill(version):
+    try:
+        paths = list(iter_uploads())
+        production_labels = load_labels()
+        with _backfill_lock:
+            _backfill['total'] = len(paths)
+        _warm_up('candidate', version)
+        _warm_up('full', str(os.path.getmtime(MODEL_PATH)))
+        for start in range(0, len(paths), BACKFILL_BATCH_SIZE):
+            if candidate_version() != version:
+                raise RuntimeError("the candidate model changed during the re-score")
+            inference_admission.yield_to_serving()
+            decoded, candidate_ms, answers, batch = _run_candidate(
+                paths[start:start + BACKFILL_BATCH_SIZE])
+            if decoded:
+                timer = time.perf_counter()
+                production = predict_batch('full', batch)
+                production_ms = (time.perf_counter() - timer) * 1000 / len(decoded)
+                rows = []
+                for path, row, (candidate_label, candidate_confidence) in zip(decoded, production, answers):
+                    production_label, production_confidence = _top(row, production_labels)
+                    rows.append((path, production_label, production_confidence, production_ms,
+                                 candidate_label, candidate_confidence, candidate_ms))
+                save_shadow_results(version, 'backfill', rows)
+            with _backfill_lock:
+                _backfill['done'] = min(start + BACKFILL_BATCH_SIZE, len(paths))
+        print(f"[INFO] Shadow re-score of {len(paths)} uploads finished")
+    except Exception as e:
+        print(f"[ERROR] Shadow re-score: {str(e)}")
+        with _backfill_lock:
+            _backfill['error'] = str(e)
+    finally:
+        with _backfill_lock:
+            _backfill['running'] = False
+
+
+def start_backfill():
+    """Re-score all stored uploads with the candidate in the background. Returns (bool, message)."""
+    version = candidate_version()
+    if version is None:
+        return False, "There is no candidate model to evaluate."
+    with _backfill_lock:
+        if _backfill['running']:
+            return False, "A re-score is already running."
+        # Replace earlier backfill rows of this candidate rather than counting them twice
+        clear_shadow_results(version, source='backfill')
+        _backfill.update({'running': True, 'version': version, 'done': 0, 'total': 0, 'error': None})
+    threading.Thread(target=_run_backfill, args=(version,), name='shadow-backfill', daemon=True).start()
+    return True, "Re-scoring stored uploads with the candidate model in the background."
+
+
+def backfill_status():
+    with _backfill_lock:
+        return dict(_backfill)
+
+
+# ---------------------------------------------------------------------------
+# Report and promotion
+# ---------------------------------------------------------------------------
+
+def report(version=None):
+    """
+    Comparison of the candidate with production, per production label:
+
+    {'version', 'classes': [{'label', 'count', 'agreement', 'confidence_shift',
+     'production_ms', 'candidate_ms', 'latency_diff_ms', 'live', 'backfill'}],
+     'overall': {...}}
+
+    Rates and shifts are percentages; 'live'/'backfill' are the counts per source.
+    """
+    version = version or candidate_version()
+    if version is None:
+        return None
+    rows = get_shadow_report(version)
+
+    def combine(group):
+        count = sum(r['count'] for r in group)
+        if not count:
+            return None
+
+        def mean(key):
+            return sum(r[key] * r['count'] for r in group) / count
+
+        return {
+            'count': count,
+            'agreement': round(mean('agreement') * 100, 1),
+            'confidence_shift': round(mean('confidence_shift') * 100, 2),
+            'production_ms': round(mean('production_ms'), 2),
+            'candidate_ms': round(mean('candidate_ms'), 2),
+            'latency_diff_ms': round(mean('latency_diff_ms'), 2),
+            'live': sum(r['count'] for r in group if r['source'] == 'live'),
+            'backfill': sum(r['count'] for r in group if r['source'] == 'backfill'),
+        }
+
+    by_label = {}
+    for row in rows:
+        by_label.setdefault(row['production_label'], []).append(row)
+    classes = [dict(label=label, **combine(group)) for label, group in sorted(by_label.items())]
+    return {'version': version, 'classes': classes, 'overall': combine(rows)}
+
+
+def summary(version=None):
+    """
+    The candidate's overall comparison, {'version', 'overall': {'count',
+    'agreement', 'confidence_shift', 'latency_diff_ms'} or None}, from the
+    trigger-maintained rollup instead of aggregating shadow_results (for the
+    admin dashboard). None if there is no candidate.
+    """
+    version = version or candidate_version()
+    if version is None:
+        return None
+    rollup = get_shadow_rollup(version)
+    count = int(rollup.get('count', 0))
+    if not count:
+        return {'version': version, 'overall': None}
+    return {'version': version, 'overall': {
+        'count': count,
+        'agreement': round(rollup['agree'] / count * 100, 1),
+        'confidence_shift': round(rollup['confidence_shift'] / count * 100, 2),
+        'latency_diff_ms': round(rollup['latency_diff_ms'] / count, 2),
+    }}
+
+
+def promote_candidate():
+    """
+    Make the candidate the production full model. The fast cascade model
+    was trained alongside the old production model and answers every
+    request above CASCADE_THRESHOLD, so it is removed until the next full
+    training; otherwise most traffic would still get the old model's
+    answers. Returns (bool, message).
+    """
+    version = candidate_version()
+    if version is None:
+        return False, "There is no candidate model to promote."
+    message = "Candidate model promoted to production."
+    if os.path.exists(FAST_MODEL_PATH):
+        os.remove(FAST_MODEL_PATH)
+        message += (" The fast cascade model belonged to the previous model and was removed; "
+                    "every request uses the full model until the next training.")
+    os.replace(CANDIDATE_LABELS_PATH, LABELS_PATH)
+    os.replace(CANDIDATE_MODEL_PATH, MODEL_PATH)
+    shutil.rmtree(CANDIDATE_DIR, ignore_errors=True)
+    clear_shadow_results(version)
+    return True, message
@@ -0,0 +1,271 @@
+"""
+Latency/accuracy sweep over MobileNetV2 width (alpha) and input resolution.
+
+For every (alpha, resolution) pair this script:
+1. Extracts pooled backbone features for the dataset once and caches them
+   under models/sweep/features/ (keyed by the dataset manifest), so re-runs
+   and head-only changes skip the expensive backbone pass.
+2. Trains the classification head on the cached features. Configurations
+   are trained in parallel worker processes, one per core group.
+3. Rebuilds the full model (backbone + head) and measures single-image and
+   batched CPU latency plus saved model size, one configuration at a time so
+   timings don't compete for cores.
+
+Results are written to models/sweep/report.json and models/sweep/report.md
+with the Pareto frontier (no other configuration is both more accurate and
+faster) marked.
+
+Usage:
+    python sweep_models.py
+    python sweep_models.py --alphas 0.35 0.5 1.0 --sizes 128 160 224 --workers 3
+"""
+
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from plant_dataset import DATASET_PATH, build_manifest, manifest_fingerprint, load_images
+
+SWEEP_DIR = "models/sweep"
+FEATURE_CACHE_DIR = os.path.join(SWEEP_DIR, "features")
+DEFAULT_ALPHAS = [0.35, 0.5, 0.75, 1.0]
+DEFAULT_SIZES = [96, 128, 160, 192, 224]
+LATENCY_BATCH_SIZE = 16
+LATENCY_REPEATS = 20
+
+
+def _limit_threads(num_threads):
+    """Restrict TensorFlow to a share of the cores inside a worker process."""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _build_backbone(alpha, size):
+    from tensorflow.keras.applications import MobileNetV2
+    from backbone_store import weights_path
+    return MobileNetV2(weights=weights_path(alpha, size), include_top=False, alpha=alpha,
+                       input_shape=(size, size, 3), pooling='avg')
+
+
+def _build_head(num_features, num_classes):
+    """Same head as train_model.build_model(), on pooled features."""
+    import tensorflow as tf
+    from tensorflow.keras.layers import Dense, Dropout, Input
+    from tensorflow.keras.models import Model
+
+    inputs = Input(shape=(num_features,))
+    x = Dense(256, activation='relu')(inputs)
+    x = Dropout(0.5)(x)
+    x = Dense(128, activation='relu')(x)
+    x = Dropout(0.3)(x)
+    outputs = Dense(num_classes, activation='softmax')(x)
+    head = Model(inputs, outputs)
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+                 loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return head
+
+
+def _feature_cache_path(alpha, size, fingerprint):
+    return os.path.join(FEATURE_CACHE_DIR, f"a{alpha}_r{size}_{fingerprint}.npz")
+
+
+def extract_features(manifest, fingerprint, alpha, size):
+    """Return cached (or freshly computed) pooled features for every manifest entry."""
+    cache_path = _feature_cache_path(alpha, size, fingerprint)
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        return cached['features'], cached['labels'], cached['is_validation']
+
+    backbone = _build_backbone(alpha, size)
+    entries = manifest['entries']
+    features = []
+    for start in range(0, len(entries), 64):
+        chunk = entries[start:start + 64]
+        images = load_images([e['path'] for e in chunk], (size, size))
+        features.append(backbone.predict(images.astype(np.float32) / 255.0, verbose=0))
+
+    features = np.concatenate(features).astype(np.float32)
+    labels = np.array([e['label'] for e in entries], dtype=np.int32)
+    is_validation = np.array([e['subset'] == 'validation' for e in entries])
+
+    os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, features=features, labels=labels, is_validation=is_validation)
+    os.replace(tmp_path, cache_path)
+    return features, labels, is_validation
+
+
+def train_config(manifest, fingerprint, alpha, size, threads):
+    """Worker entry point: train a head for one (alpha, size) and save its weights."""
+    _limit_threads(threads)
+    from tensorflow.keras.callbacks import EarlyStopping
+
+    features, labels, is_validation = extract_features(manifest, fingerprint, alpha, size)
+    train_x, train_y = features[~is_validation], labels[~is_validation]
+    val_x, val_y = features[is_validation], labels[is_validation]
+
+    head = _build_head(features.shape[1], len(manifest['classes']))
+    start = time.perf_counter()
+    head.fit(train_x, train_y, validation_data=(val_x, val_y), epochs=40, batch_size=32,
+             callbacks=[EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)],
+             verbose=0)
+    train_seconds = time.perf_counter() - start
+
+    _, val_accuracy = head.evaluate(val_x, val_y, verbose=0)
+
+    head_path = os.path.join(SWEEP_DIR, f"head_a{alpha}_r{size}.h5")
+    head.save_weights(head_path)
+    return {
+        'alpha': alpha,
+        'size': size,
+        'val_accuracy': float(val_accuracy),
+        'head_train_seconds': round(train_seconds, 2),
+        'head_weights': head_path,
+        'num_features': int(features.shape[1]),
+    }
+
+
+def measure_latency(result, num_classes):
+    """Build backbone + trained head and measure CPU latency and saved size."""
+    from tensorflow.keras.models import Model
+
+    size = result['size']
+    backbone = _build_backbone(result['alpha'], size)
+    head = _build_head(result['num_features'], num_classes)
+    head.load_weights(result['head_weights'])
+    model = Model(backbone.input, head(backbone.output))
+
+    single = np.random.rand(1, size, size, 3).astype(np.float32)
+    batch = np.random.rand(LATENCY_BATCH_SIZE, size, size, 3).astype(np.float32)
+
+    # Warm up both shapes before timing
+    model(single, training=False)
+    model(batch, training=False)
+
+    timings = []
+    for _ in range(LATENCY_REPEATS):
+        start = time.perf_counter()
+        model(single, training=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    result['single_ms_p50'] = round(float(np.percentile(timings, 50)), 2)
+    result['single_ms_p90'] = round(float(np.percentile(timings, 90)), 2)
+
+    timings = []
+    for _ in range(max(LATENCY_REPEATS // 4, 3)):
+        start = time.perf_counter()
+        model(batch, training=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    batch_ms = float(np.median(timings))
+    result['batch_ms_per_image'] = round(batch_ms / LATENCY_BATCH_SIZE, 2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.h5")
+        model.save(path)
+        result['model_size_mb'] = round(os.path.getsize(path) / (1024 * 1024), 2)
+
+    result['params'] = int(model.count_params())
+    return result
+
+
+def pareto_frontier(results):
+    """Mark results not dominated on (higher accuracy, lower single-image latency)."""
+    for r in results:
+        r['pareto'] = not any(
+            o is not r
+            and o['val_accuracy'] >= r['val_accuracy']
+            and o['single_ms_p50'] <= r['single_ms_p50']
+            and (o['val_accuracy'] > r['val_accuracy'] or o['single_ms_p50'] < r['single_ms_p50'])
+            for o in results
+        )
+    return [r for r in results if r['pareto']]
+
+
+def write_report(results, manifest, fingerprint):
+    frontier = pareto_frontier(results)
+    results = sorted(results, key=lambda r: r['single_ms_p50'])
+
+    with open(os.path.join(SWEEP_DIR, "report.json"), 'w') as f:
+        json.dump({'manifest': fingerprint, 'classes': manifest['classes'],
+                   'results': results}, f, indent=4)
+
+    lines = [
+        "# MobileNetV2 width/resolution sweep",
+        "",
+        f"Dataset manifest `{fingerprint}`, {len(manifest['entries'])} images, "
+        f"{len(manifest['classes'])} classes. Heads trained on cached features without augmentation, "
+        "so absolute accuracy is a lower bound; compare configurations relative to each other.",
+        "",
+        "| alpha | size | val acc | single p50 ms | single p90 ms | batched ms/img | size MB | params | Pareto |",
+        "|---|---|---|---|---|---|---|---|---|",
+    ]
+    for r in results:
+        lines.append(
+            f"| {r['alpha']} | {r['size']} | {r['val_accuracy']*100:.2f}% | {r['single_ms_p50']} | "
+            f"{r['single_ms_p90']} | {r['batch_ms_per_image']} | {r['model_size_mb']} | "
+            f"{r['params']:,} | {'*' if r['pareto'] else ''} |"
+        )
+    lines += ["", "## Pareto frontier", ""]
+    for r in sorted(frontier, key=lambda r: r['single_ms_p50']):
+        lines.append(f"- alpha={r['alpha']}, {r['size']}px: {r['val_accuracy']*100:.2f}% "
+                     f"at {r['single_ms_p50']} ms/image")
+
+    with open(os.path.join(SWEEP_DIR, "report.md"), 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def run_sweep(alphas, sizes, workers):
+    if not os.path.exists(DATASET_PATH):
+        print(f"❌ Dataset not found at {DATASET_PATH}")
+        return None
+
+    os.makedirs(SWEEP_DIR, exist_ok=True)
+    manifest = build_manifest()
+    fingerprint = manifest_fingerprint(manifest)
+    configs = [(a, s) for a in alphas for s in sizes]
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    print(f"[INFO] Sweeping {len(configs)} configurations with {workers} workers "
+          f"({threads} threads each), manifest {fingerprint}")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(train_config, manifest, fingerprint, a, s, threads): (a, s)
+                   for a, s in configs}
+        for future in as_completed(futures):
+            alpha, size = futures[future]
+            try:
+                result = future.result()
+                print(f"[INFO] alpha={alpha} size={size}: val acc {result['val_accuracy']*100:.2f}%")
+                results.append(result)
+            except Exception as e:
+                print(f"❌ alpha={alpha} size={size} failed: {str(e)}")
+
+    # Latency is measured serially in this process with all cores available
+    print("\n[INFO] Measuring latency...")
+    for result in results:
+        measure_latency(result, len(manifest['classes']))
+        print(f"[INFO] alpha={result['alpha']} size={result['size']}: "
+              f"{result['single_ms_p50']} ms single, {result['batch_ms_per_image']} ms/img batched")
+
+    write_report(results, manifest, fingerprint)
+    print(f"\n✅ Report written to {SWEEP_DIR}/report.md")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="MobileNetV2 width/resolution sweep")
+    parser.add_argument('--alphas', type=float, nargs='+', default=DEFAULT_ALPHAS)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--workers', type=int, default=max(1, min(4, (os.cpu_count() or 1) // 2)))
+    args = parser.parse_args()
+
+    if run_sweep(args.alphas, args.sizes, args.workers) is None:
+        sys.exit(1)
@@ -5,15 +5,19 @@ This script allows you to:
 2. Test multiple images from a folder
 3. Evaluate model performance on validation data
 4. Generate confusion matrix and accuracy report
+5. Measure the accuracy gain and extra compute of test-time augmentation
 """
 
 import os
 import json
+import time
 import numpy as np
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 import tensorflow as tf
+from preprocessing import load_batch_uint8, input_scale_for
+from serving import ServingModel, TTA_VIEW_COUNTS
+from plant_dataset import build_manifest, subset_entries, flow_from_dataset
 
 # Suppress warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
@@ -23,10 +27,11 @@ logging.getLogger('tensorflow').setLevel(logging.ERROR)
 MODEL_PATH = "models/plant_model.h5"
 LABELS_PATH = "models/labels.json"
 DATASET_PATH = "dataset/"
+TTA_REPORT_PATH = "models/tta_report"
 
 
-def load_trained_model():
-    """Load the trained model and labels."""
+def load_trained_model(tta=False):
+    """Load the trained model (with traced TTA views if requested) and labels."""
     if not os.path.exists(MODEL_PATH):
         print(f"❌ Model not found at {MODEL_PATH}")
         print("Please train the model first using: python train_model.py")
@@ -37,7 +42,7 @@ def load_trained_model():
         return None, None
     
     print("📂 Loading model...")
-    model = load_model(MODEL_PATH)
+    model = ServingModel(load_model(MODEL_PATH), tta_view_counts=TTA_VIEW_COUNTS if tta else ())
     print("✅ Model loaded successfully!")
     
     with open(LABELS_PATH, 'r') as f:
@@ -48,12 +53,8 @@ def load_trained_model():
 
 
 def preprocess_single_image(img_path, target_size=(224, 224)):
-    """Preprocess a single image for prediction."""
-    img = image.load_img(img_path, target_size=target_size)
-    img_array = image.img_to_array(img)
-    img_array = img_array / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+    """Load a single image as a uint8 batch; normalization happens in the serving graph."""
+    return load_batch_uint8(img_path, target_size)
 
 
 def predict_single_image(model, labels, img_path, show_all=True):
@@ -61,7 +62,7 @@ def predict_single_image(model, labels, img_path, show_all=True):
     Test the model on a single image.
     
     Args:
-        model: Trained Keras model
+        model: ServingModel wrapping the trained Keras model
         labels: Dictionary mapping class indices to names
         img_path: Path to the image file
         show_all: If True, show all class probabilities
@@ -78,7 +79,7 @@ def predict_single_image(model, labels, img_path, show_all=True):
     img_array = preprocess_single_image(img_path)
     
     # Predict
-    predictions = model.predict(img_array, verbose=0)
+    predictions = model.predict(img_array)
     
     # Get results
     predicted_class = np.argmax(predictions[0])
@@ -114,7 +115,7 @@ def test_multiple_images(model, labels, folder_path):
     Test the model on multiple images from a folder.
     
     Args:
-        model: Trained Keras model
+        model: ServingModel wrapping the trained Keras model
         labels: Dictionary mapping class indices to names
         folder_path: Path to folder containing test images
     """
@@ -170,26 +171,27 @@ def evaluate_on_validation_set(model, labels):
         print(f"❌ Dataset not found at {DATASET_PATH}")
         return
     
-    # Create validation data generator
+    # Create validation data generator (same scaling as the serving path)
+    keras_model = model.model
     val_datagen = ImageDataGenerator(
-        rescale=1.0/255,
+        rescale=input_scale_for(keras_model),
         validation_split=0.2
     )
     
-    val_data = val_datagen.flow_from_directory(
-        DATASET_PATH,
+    val_data = flow_from_dataset(
+        val_datagen,
         target_size=(224, 224),
         batch_size=16,
-        class_mode='sparse',
         subset='validation',
-        shuffle=False
+        shuffle=False,
+        dataset_path=DATASET_PATH
     )
     
     print(f"Validation samples: {val_data.samples}\n")
     
     # Evaluate
     print("⏳ Evaluating model...")
-    loss, accuracy = model.evaluate(val_data, verbose=1)
+    loss, accuracy = keras_model.evaluate(val_data, verbose=1)
     
     print("\n" + "="*70)
     print(f"✅ Validation Accuracy: {accuracy*100:.2f}%")
@@ -198,7 +200,7 @@ def evaluate_on_validation_set(model, labels):
     
     # Get predictions for confusion matrix
     print("📊 Generating detailed metrics...")
-    predictions = model.predict(val_data, verbose=1)
+    predictions = keras_model.predict(val_data, verbose=1)
     predicted_classes = np.argmax(predictions, axis=1)
     true_classes = val_data.classes
     
@@ -256,6 +258,102 @@ def evaluate_on_validation_set(model, labels):
     print("="*70 + "\n")
 
 
+def evaluate_tta(model, labels, threshold=0.6, budget_ms=250.0):
+    """
+    Compare single-pass accuracy with test-time augmentation on the
+    validation split: every traced view count applied to all images, and the
+    adaptive mode used in serving (only below `threshold`, within
+    `budget_ms`). Writes models/tta_report.json and .md.
+    """
+    print("="*70)
+    print("🔁 TEST-TIME AUGMENTATION EVALUATION")
+    print("="*70 + "\n")
+
+    if not os.path.exists(DATASET_PATH):
+        print(f"❌ Dataset not found at {DATASET_PATH}")
+        return
+
+    manifest = build_manifest(DATASET_PATH)
+    entries = subset_entries(manifest, 'validation')
+    label_index = {name: int(idx) for idx, name in labels.items()}
+    modes = ['single'] + [f'tta_{n}' for n in TTA_VIEW_COUNTS] + ['adaptive']
+    correct = {mode: 0 for mode in modes}
+    elapsed_ms = {mode: 0.0 for mode in modes}
+    passes = {mode: 0 for mode in modes}
+    fixed = {mode: 0 for mode in modes}
+    broken = {mode: 0 for mode in modes}
+    adaptive_applied = 0
+
+    print(f"Validation samples: {len(entries)}\n⏳ Evaluating...")
+    for entry in entries:
+        true_idx = label_index.get(manifest['classes'][entry['label']])
+        batch = load_batch_uint8(entry['path'], model.img_size)
+
+        start = time.perf_counter()
+        single = model.predict(batch)[0]
+        single_ms = (time.perf_counter() - start) * 1000
+        results = {'single': (single, single_ms, 1)}
+
+        for views in TTA_VIEW_COUNTS:
+            start = time.perf_counter()
+            averaged = (single + views * model.predict_tta(batch, views)) / (views + 1)
+            results[f'tta_{views}'] = (averaged, single_ms + (time.perf_counter() - start) * 1000, 1 + views)
+
+        adaptive = results['single']
+        if float(np.max(single)) < threshold:
+            views = model.tta_views_within(budget_ms - single_ms)
+            if views:
+                adaptive = results[f'tta_{views}']
+                adaptive_applied += 1
+        results['adaptive'] = adaptive
+
+        single_correct = int(np.argmax(single)) == true_idx
+        for mode, (probabilities, ms, forward_views) in results.items():
+            is_correct = int(np.argmax(probabilities)) == true_idx
+            correct[mode] += int(is_correct)
+            elapsed_ms[mode] += ms
+            passes[mode] += forward_views
+            fixed[mode] += int(is_correct and not single_correct)
+            broken[mode] += int(single_correct and not is_correct)
+
+    total = max(len(entries), 1)
+    rows = []
+    for mode in modes:
+        rows.append({
+            'mode': mode,
+            'accuracy': round(correct[mode] / total, 4),
+            'accuracy_gain': round((correct[mode] - correct['single']) / total, 4),
+            'mean_ms': round(elapsed_ms[mode] / total, 2),
+            'images_per_prediction': round(passes[mode] / total, 2),
+            'fixed': fixed[mode],
+            'broken': broken[mode],
+        })
+
+    os.makedirs(os.path.dirname(TTA_REPORT_PATH), exist_ok=True)
+    with open(TTA_REPORT_PATH + ".json", 'w') as f:
+        json.dump({'samples': len(entries), 'threshold': threshold, 'budget_ms': budget_ms,
+                   'adaptive_applied': adaptive_applied, 'results': rows}, f, indent=4)
+
+    lines = [
+        "# Test-time augmentation evaluation",
+        "",
+        f"{len(entries)} validation images. Adaptive mode: TTA below {threshold:.0%} confidence "
+        f"within {budget_ms:.0f} ms, applied to {adaptive_applied} images.",
+        "",
+        "| mode | accuracy | gain | mean ms | images/prediction | fixed | broken |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for r in rows:
+        lines.append(f"| {r['mode']} | {r['accuracy']*100:.2f}% | {r['accuracy_gain']*100:+.2f}% | "
+                     f"{r['mean_ms']} | {r['images_per_prediction']} | {r['fixed']} | {r['broken']} |")
+    with open(TTA_REPORT_PATH + ".md", 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+    print("\n" + "\n".join(lines[4:]))
+    print(f"\n✅ Report written to {TTA_REPORT_PATH}.md")
+    print("="*70 + "\n")
+
+
 def main_menu():
     """Interactive menu for testing the model."""
     model, labels = load_trained_model()
@@ -328,6 +426,12 @@ if __name__ == "__main__":
             model, labels = load_trained_model()
             if model:
                 evaluate_on_validation_set(model, labels)
+        elif sys.argv[1] == 'tta':
+            model, labels = load_trained_model(tta=True)
+            if model:
+                threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.6
+                budget_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 250.0
+                evaluate_tta(model, labels, threshold, budget_ms)
         elif sys.argv[1] == 'test' and len(sys.argv) > 2:
             model, labels = load_trained_model()
             if model:
@@ -336,6 +440,7 @@ if __name__ == "__main__":
             print("Usage:")
             print("  python test_model.py              # Interactive menu")
             print("  python test_model.py eval         # Evaluate on validation set")
+            print("  python test_model.py tta [threshold] [budget_ms]  # TTA accuracy/compute report")
             print("  python test_model.py test <path>  # Test single image")
     else:
         # Interactive mode
@@ -1,8 +1,14 @@
 import os
 import json
+import time
+import argparse
+import threading
 import numpy as np
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
+
+# oneDNN on/off from the tuned CPU profile (cpu_tuning.py); must precede the TF import
+import cpu_tuning
+cpu_tuning.apply_environment('training')
 
 import logging
 logging.getLogger('tensorflow').setLevel(logging.ERROR)
@@ -10,16 +16,218 @@ logging.getLogger('tensorflow').setLevel(logging.ERROR)
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Input
 from tensorflow.keras.models import Model
-from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, Callback
 from datetime import datetime
+from preprocessing import rescaling_layer
+from plant_dataset import build_manifest, manifest_fingerprint, flow_from_dataset
+from checkpointing import TrainingCheckpoint, TimeBudget, parse_duration
+import backbone_store
+import metrics
 
 DATASET_PATH = "dataset/"
 MODEL_PATH = "models/plant_model.h5"
 LABELS_PATH = "models/labels.json"
+EPOCHS = 15
+
+# A candidate is trained next to production and evaluated in shadow mode (shadow.py)
+CANDIDATE_MODEL_PATH = "models/candidate/plant_model.h5"
+CANDIDATE_LABELS_PATH = "models/candidate/labels.json"
+
+# Cheap first-stage model for the serving cascade (see inference.py)
+FAST_MODEL_PATH = "models/plant_model_fast.h5"
+FAST_MODEL_ALPHA = 0.35
+FAST_IMG_SIZE = (128, 128)
+TRAIN_FAST_MODEL = True
+
+metrics.HELP.update({
+    'model_build_seconds': 'Time to build a classifier by model and backbone source (cache = reused in-process)',
+})
+
+# Frozen ImageNet backbones already built in this process, shared by every
+# model built afterwards: (alpha, img_size, dtype policy) -> keras Model
+_backbones = {}
+_backbones_lock = threading.Lock()
+
+
+class EpochTimer(Callback):
+    """Record per-epoch wall-clock time in the training_epoch_seconds histogram."""
+
+    def __init__(self, model_name):
+        super().__init__()
+        self.model_name = model_name
+        self._start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        metrics.observe('training_epoch_seconds', time.perf_counter() - self._start, model=self.model_name)
+
+
+class YieldCallback(Callback):
+    """Call a hook before every training batch (used to yield the CPU to serving)."""
+
+    def __init__(self, hook):
+        super().__init__()
+        self.hook = hook
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.hook()
+
+
+def imagenet_backbone(alpha=1.0, img_size=(224, 224)):
+    """
+    Frozen MobileNetV2 feature extractor with ImageNet weights from the local
+    backbone store (backbone_store.py), so no download is ever needed.
+
+    The backbone is never trained (build_model() freezes it), so its weights
+    stay the ImageNet ones and one instance can serve every model built in
+    this process: repeated retrains in the same worker skip constructing the
+    graph and loading the weights. Inside a tf.distribute strategy a new
+    backbone is built, since its variables must be created under the scope.
+    """
+    key = (float(alpha), tuple(img_size), tf.keras.mixed_precision.global_policy().name)
+    shared = not tf.distribute.has_strategy()
+    with _backbones_lock:
+        if shared and key in _backbones:
+            return _backbones[key], 'cache'
+        backbone = MobileNetV2(
+            weights=backbone_store.weights_path(alpha, img_size[0]),
+            include_top=False,
+            alpha=alpha,
+            input_shape=(img_size[0], img_size[1], 3)
+        )
+        backbone.trainable = False
+        if shared:
+            _backbones[key] = backbone
+        return backbone, 'store'
+
+
+def build_model(num_classes, alpha=1.0, img_size=(224, 224), weights="imagenet"):
+    """
+    Build a MobileNetV2 classifier with a frozen backbone and a trainable head.
+    The model takes raw 0-255 pixels; normalization is its first layer.
+    Under a mixed precision policy the softmax output stays float32.
+    With weights="imagenet" the backbone comes from imagenet_backbone().
+    """
+    start = time.perf_counter()
+    inputs = Input(shape=(img_size[0], img_size[1], 3), name='image')
+    if weights == "imagenet":
+        base_model, source = imagenet_backbone(alpha, img_size)
+    else:
+        base_model, source = MobileNetV2(
+            weights=weights,
+            include_top=False,
+            alpha=alpha,
+            input_shape=(img_size[0], img_size[1], 3)
+        ), 'none'
+    
+    # Freeze base model initially
+    base_model.trainable = False
+    
+    # Add custom classification head
+    x = base_model(rescaling_layer()(inputs), training=False)
+    x = GlobalAveragePooling2D()(x)
+    x = Dense(256, activation='relu')(x)
+    x = Dropout(0.5)(x)
+    x = Dense(128, activation='relu')(x)
+    x = Dropout(0.3)(x)
+    predictions = Dense(num_classes, activation='softmax', dtype='float32')(x)
+    
+    model = Model(inputs=inputs, outputs=predictions)
+    
+    # Compile model
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    metrics.observe('model_build_seconds', time.perf_counter() - start,
+                    model=f"{alpha}_{img_size[0]}", source=source)
+    return model
+
+
+def save_model(model, path, num_classes, alpha=1.0, img_size=(224, 224)):
+    """
+    Save a trained model. A model trained in mixed bfloat16 is saved as a
+    float32 copy, so serving never depends on the CPU supporting bf16.
+    """
+    if tf.keras.mixed_precision.global_policy().name != 'float32':
+        tf.keras.mixed_precision.set_global_policy('float32')
+        float32_model = build_model(num_classes, alpha=alpha, img_size=img_size, weights=None)
+        float32_model.set_weights(model.get_weights())
+        model = float32_model
+    model.save(path)
+
+
+def install_model(model, model_path, num_classes, alpha=1.0, img_size=(224, 224), labels=None, labels_path=None):
+    """
+    Save a model, and its labels if given. Both are written to temporary
+    files first and moved into place with os.replace(), so the app never
+    loads a half-written model or a model next to another model's labels.
+    """
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    root, ext = os.path.splitext(model_path)
+    tmp_model_path = f"{root}.tmp{ext}"
+    save_model(model, tmp_model_path, num_classes, alpha=alpha, img_size=img_size)
+    if labels is not None:
+        tmp_labels_path = labels_path + '.tmp'
+        with open(tmp_labels_path, 'w') as f:
+            json.dump(labels, f, indent=4)
+        os.replace(tmp_labels_path, labels_path)
+    os.replace(tmp_model_path, model_path)
+
+
+def remove_fast_model():
+    """
+    Delete the fast cascade model, which belongs to the full model it was
+    trained with. Returns True if there was one.
+    """
+    if not os.path.exists(FAST_MODEL_PATH):
+        return False
+    os.remove(FAST_MODEL_PATH)
+    return True
+
+
+def open_checkpoint(name, fingerprint, resume=True):
+    """The TrainingCheckpoint for `name`, emptied first unless resuming."""
+    checkpoint = TrainingCheckpoint(name, fingerprint)
+    if not resume and checkpoint.state:
+        print(f"[INFO] Discarding '{name}' checkpoint, training from scratch")
+        checkpoint.clear()
+    return checkpoint
+
 
-def train_medicinal_plant_model():
+def fit_with_checkpoint(model, checkpoint, train_data, val_data, callbacks, model_name,
+                        batch_hook=None, deadline=None):
+    """
+    model.fit() from the checkpoint's next epoch, checkpointing every
+    completed epoch. `callbacks` are the stateful callbacks (EarlyStopping,
+    ReduceLROnPlateau) whose state is saved and restored. Training stops
+    cleanly at `deadline` (time.monotonic()). Returns True if it did.
+    """
+    budget = TimeBudget(deadline) if deadline else None
+    checkpoint.attach(train_data, callbacks, budget)
+    if checkpoint.initial_epoch >= EPOCHS:
+        return False
+    model.fit(
+        train_data,
+        validation_data=val_data,
+        epochs=EPOCHS,
+        initial_epoch=checkpoint.initial_epoch,
+        shuffle=False,  # the iterator shuffles itself from its checkpointed seed
+        callbacks=list(callbacks) + [EpochTimer(model_name)]
+                  + ([YieldCallback(batch_hook)] if batch_hook else [])
+                  + ([budget] if budget else []) + [checkpoint],
+        verbose=1
+    )
+    return budget is not None and budget.exhausted
+
+
+@cpu_tuning.restores_precision
+def train_medicinal_plant_model(batch_hook=None, time_budget=None, resume=True, candidate=False):
     """
     Train a CNN model using MobileNetV2 for medicinal plant classification.
     Expected dataset structure:
@@ -33,7 +241,23 @@ def train_medicinal_plant_model():
             img1.jpg
         Tulsi/
             img1.jpg
+
+    batch_hook, if given, is called before every training batch; the web app
+    passes admission.inference_admission.yield_to_serving so training runs
+    at lower priority than predictions.
+
+    Every completed epoch is checkpointed under models/checkpoints/, and an
+    interrupted run continues from its last checkpoint unless resume is
+    False. time_budget (seconds) stops training cleanly when it runs out
+    and exports the best checkpoint so far; training again resumes it.
+
+    With candidate=True the full model and its labels are written to
+    models/candidate/ for shadow evaluation instead of replacing the
+    production model, and the fast cascade model is not retrained.
     """
+    model_path = CANDIDATE_MODEL_PATH if candidate else MODEL_PATH
+    labels_path = CANDIDATE_LABELS_PATH if candidate else LABELS_PATH
+    deadline = time.monotonic() + time_budget if time_budget else None
     
     # Check if dataset exists
     if not os.path.exists(DATASET_PATH):
@@ -49,11 +273,25 @@ def train_medicinal_plant_model():
     print(f"Found {len(subdirs)} plant categories: {subdirs}")
     
     # Create models directory if it doesn't exist
-    os.makedirs("models", exist_ok=True)
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    
+    img_size = (224, 224)
+    batch_size = 16
+    
+    # Fail before writing anything if the backbone weights can't be loaded offline
+    try:
+        backbone_store.weights_path(1.0, img_size[0])
+        if TRAIN_FAST_MODEL and not candidate:
+            backbone_store.weights_path(FAST_MODEL_ALPHA, FAST_IMG_SIZE[0])
+    except backbone_store.BackboneWeightsError as e:
+        return f"Error: {str(e)}"
+    
+    # Checkpoints only resume on the same images and model configuration
+    dataset_fingerprint = manifest_fingerprint(build_manifest(DATASET_PATH))
+    checkpoint = open_checkpoint('candidate' if candidate else 'full', f"{dataset_fingerprint}:{img_size[0]}:{batch_size}", resume)
     
     # Data augmentation for training
     train_datagen = ImageDataGenerator(
-        rescale=1.0/255,
         rotation_range=30,
         width_shift_range=0.2,
         height_shift_range=0.2,
@@ -64,33 +302,28 @@ def train_medicinal_plant_model():
         validation_split=0.2  # 80% train, 20% validation
     )
     
-    # Validation data (only rescaling)
+    # Validation data (no augmentation; the model rescales its own input)
     val_datagen = ImageDataGenerator(
-        rescale=1.0/255,
         validation_split=0.2
     )
     
-    img_size = (224, 224)
-    batch_size = 16
-    
     # Load training data
     print("\n[INFO] Loading training data...")
-    train_data = train_datagen.flow_from_directory(
-        DATASET_PATH,
+    train_data = flow_from_dataset(
+        train_datagen,
         target_size=img_size,
         batch_size=batch_size,
-        class_mode='sparse',  # Use sparse for sparse_categorical_crossentropy
         subset='training',
-        shuffle=True
+        shuffle=True,
+        seed=checkpoint.seed
     )
     
     # Load validation data
     print("[INFO] Loading validation data...")
-    val_data = val_datagen.flow_from_directory(
-        DATASET_PATH,
+    val_data = flow_from_dataset(
+        val_datagen,
         target_size=img_size,
         batch_size=batch_size,
-        class_mode='sparse',
         subset='validation',
         shuffle=False
     )
@@ -98,10 +331,8 @@ def train_medicinal_plant_model():
     num_classes = train_data.num_classes
     class_indices = train_data.class_indices
     
-    # Save class labels
+    # Class labels, saved together with the model
     labels = {v: k for k, v in class_indices.items()}
-    with open(LABELS_PATH, 'w') as f:
-        json.dump(labels, f, indent=4)
     
     print(f"\n[INFO] Number of classes: {num_classes}")
     print(f"[INFO] Class labels: {labels}")
@@ -110,32 +341,9 @@ def train_medicinal_plant_model():
     
     # Build MobileNetV2 model
     print("\n[INFO] Building MobileNetV2 model...")
-    base_model = MobileNetV2(
-        weights="imagenet",
-        include_top=False,
-        input_shape=(224, 224, 3)
-    )
-    
-    # Freeze base model initially
-    base_model.trainable = False
-    
-    # Add custom classification head
-    x = base_model.output
-    x = GlobalAveragePooling2D()(x)
-    x = Dense(256, activation='relu')(x)
-    x = Dropout(0.5)(x)
-    x = Dense(128, activation='relu')(x)
-    x = Dropout(0.3)(x)
-    predictions = Dense(num_classes, activation='softmax')(x)
-    
-    model = Model(inputs=base_model.input, outputs=predictions)
-    
-    # Compile model
-    model.compile(
-        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-        loss='sparse_categorical_crossentropy',
-        metrics=['accuracy']
-    )
+    if cpu_tuning.apply_precision():
+        print("[INFO] Training with mixed bfloat16 precision")
+    model = checkpoint.resume_model() or build_model(num_classes, img_size=img_size)
     
     print("\n[INFO] Model Summary:")
     model.summary()
@@ -163,42 +371,152 @@ def train_medicinal_plant_model():
     
     start_time = datetime.now()
     
-    history = model.fit(
-        train_data,
-        validation_data=val_data,
-        epochs=15,
-        callbacks=[early_stop, reduce_lr],
-        verbose=1
-    )
+    out_of_time = fit_with_checkpoint(model, checkpoint, train_data, val_data, [early_stop, reduce_lr],
+                                      'full', batch_hook, deadline)
     
     end_time = datetime.now()
     training_time = (end_time - start_time).total_seconds()
     
-    # Save model
-    print(f"\n[INFO] Saving model to {MODEL_PATH}...")
-    model.save(MODEL_PATH)
+    if not checkpoint.state:
+        return "Error: The time budget ran out before the first epoch finished. Nothing was saved."
     
-    # Print training results
-    final_train_acc = history.history['accuracy'][-1]
-    final_val_acc = history.history['val_accuracy'][-1]
-    final_train_loss = history.history['loss'][-1]
-    final_val_loss = history.history['val_loss'][-1]
+    # Save the best checkpointed epoch. The fast cascade model was trained with
+    # the model being replaced, so it goes until train_fast_model() makes a new one.
+    if not candidate and remove_fast_model():
+        print(f"[INFO] Removed {FAST_MODEL_PATH}, it belonged to the previous model")
+    print(f"\n[INFO] Saving model to {model_path}...")
+    checkpoint.load_best_weights(model)
+    install_model(model, model_path, num_classes, img_size=img_size, labels=labels, labels_path=labels_path)
+    
+    # Print training results (last completed epoch)
+    epochs_done = checkpoint.state['epoch'] + 1
+    final_logs = checkpoint.state['logs']
+    final_train_acc = final_logs['accuracy']
+    final_val_acc = final_logs['val_accuracy']
+    final_train_loss = final_logs['loss']
+    final_val_loss = final_logs['val_loss']
+    if not out_of_time:
+        checkpoint.clear()
     
     print("\n" + "="*60)
-    print("TRAINING COMPLETED SUCCESSFULLY")
+    print("TRAINING STOPPED BY TIME BUDGET" if out_of_time else "TRAINING COMPLETED SUCCESSFULLY")
     print("="*60)
     print(f"Training Time: {training_time:.2f} seconds ({training_time/60:.2f} minutes)")
+    print(f"Epochs Completed: {epochs_done}/{EPOCHS}")
     print(f"Final Training Accuracy: {final_train_acc*100:.2f}%")
     print(f"Final Validation Accuracy: {final_val_acc*100:.2f}%")
     print(f"Final Training Loss: {final_train_loss:.4f}")
     print(f"Final Validation Loss: {final_val_loss:.4f}")
-    print(f"Model saved at: {MODEL_PATH}")
-    print(f"Labels saved at: {LABELS_PATH}")
+    print(f"Model saved at: {model_path}")
+    print(f"Labels saved at: {labels_path}")
     print("="*60 + "\n")
     
-    return f"Training completed! Validation Accuracy: {final_val_acc*100:.2f}%"
+    if out_of_time:
+        message = (f"Training stopped by the time budget after {epochs_done}/{EPOCHS} epochs. "
+                   f"Best checkpoint saved (Validation Accuracy: {final_val_acc*100:.2f}%); "
+                   f"train again to resume.")
+        if not candidate and TRAIN_FAST_MODEL:
+            message += " The fast cascade model is trained once the full model finishes."
+        return message
+    
+    message = f"Training completed! Validation Accuracy: {final_val_acc*100:.2f}%"
+    if candidate:
+        return message + " Saved as the candidate model for shadow evaluation."
+    
+    if TRAIN_FAST_MODEL:
+        fast_val_acc = train_fast_model(num_classes, batch_hook, deadline, resume, dataset_fingerprint)
+        if fast_val_acc is None:
+            message += " (fast cascade model: stopped by the time budget, train again to finish it)"
+        else:
+            message += f" (fast cascade model: {fast_val_acc*100:.2f}%)"
+    
+    return message
+
+
+@cpu_tuning.restores_precision
+def train_fast_model(num_classes, batch_hook=None, deadline=None, resume=True, dataset_fingerprint=None):
+    """
+    Train the small first-stage cascade model (MobileNetV2 alpha 0.35 at 128 px).
+    Uses the same dataset split and class order as the full model so both
+    models share models/labels.json. Checkpointed like the full model;
+    returns None if the deadline stopped it first (its best checkpoint, if
+    any, is still exported).
+    """
+    print("\n" + "="*60)
+    print(f"TRAINING FAST CASCADE MODEL (alpha={FAST_MODEL_ALPHA}, {FAST_IMG_SIZE[0]}px)")
+    print("="*60)
+    
+    if dataset_fingerprint is None:
+        dataset_fingerprint = manifest_fingerprint(build_manifest(DATASET_PATH))
+    checkpoint = open_checkpoint(
+        'fast', f"{dataset_fingerprint}:{FAST_MODEL_ALPHA}:{FAST_IMG_SIZE[0]}:32", resume)
+    
+    train_datagen = ImageDataGenerator(
+        rotation_range=30,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True,
+        fill_mode='nearest',
+        validation_split=0.2
+    )
+    val_datagen = ImageDataGenerator(
+        validation_split=0.2
+    )
+    
+    train_data = flow_from_dataset(
+        train_datagen,
+        target_size=FAST_IMG_SIZE,
+        batch_size=32,
+        subset='training',
+        shuffle=True,
+        seed=checkpoint.seed
+    )
+    val_data = flow_from_dataset(
+        val_datagen,
+        target_size=FAST_IMG_SIZE,
+        batch_size=32,
+        subset='validation',
+        shuffle=False
+    )
+    
+    cpu_tuning.apply_precision()
+    model = checkpoint.resume_model() or build_model(num_classes, alpha=FAST_MODEL_ALPHA, img_size=FAST_IMG_SIZE)
+    
+    out_of_time = fit_with_checkpoint(
+        model, checkpoint, train_data, val_data,
+        [EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True, verbose=1),
+         ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=3, min_lr=1e-7, verbose=1)],
+        'fast', batch_hook, deadline)
+    
+    if not checkpoint.state:
+        print("[WARN] Time budget ran out before the first fast model epoch finished")
+        return None
+    
+    print(f"\n[INFO] Saving fast model to {FAST_MODEL_PATH}...")
+    checkpoint.load_best_weights(model)
+    install_model(model, FAST_MODEL_PATH, num_classes, alpha=FAST_MODEL_ALPHA, img_size=FAST_IMG_SIZE)
+    
+    if out_of_time:
+        return None
+    fast_val_acc = checkpoint.state['logs']['val_accuracy']
+    checkpoint.clear()
+    print(f"[INFO] Fast model validation accuracy: {fast_val_acc*100:.2f}%")
+    return fast_val_acc
 
 
 if __name__ == '__main__':
-    result = train_medicinal_plant_model()
+    parser = argparse.ArgumentParser(description="Train the medicinal plant classifier")
+    parser.add_argument('--time-budget', type=parse_duration, default=None,
+                        help="Wall-clock limit, e.g. 5400, 90m or 1.5h; stops cleanly and saves the best checkpoint")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Ignore existing checkpoints and train from scratch")
+    parser.add_argument('--candidate', action='store_true',
+                        help="Save to models/candidate/ for shadow evaluation instead of replacing production")
+    args = parser.parse_args()
+    
+    cpu_tuning.apply_threads('training')
+    result = train_medicinal_plant_model(time_budget=args.time_budget, resume=not args.no_resume,
+                                         candidate=args.candidate)
     print(result)
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+Content-addressed store for uploaded prediction images.
+
+Uploads are stored once per distinct content under
+static/uploads/cas/<aa>/<bb>/<sha256>.<ext>, so re-uploading the same photo
+costs no extra disk. A small thumbnail (WebP, or JPEG if Pillow lacks WebP)
+is generated under static/uploads/thumbs/ before the upload is returned, so
+the result page never falls back to the full original. Thumbnails are keyed
+by digest only and shared by every extension of the same content.
+
+Disk use is bounded by a retention policy: files older than
+UPLOAD_MAX_AGE_DAYS (by last upload time) are removed, then the oldest files
+are removed until the store is below UPLOAD_MAX_BYTES. The collector runs in
+the background at most every GC_INTERVAL_SECONDS, or on demand with
+`python upload_store.py gc`.
+"""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+import metrics
+
+STATIC_DIR = "static"
+STORE_DIR = os.path.join(STATIC_DIR, "uploads", "cas")
+THUMBNAIL_DIR = os.path.join(STATIC_DIR, "uploads", "thumbs")
+
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+THUMBNAIL_EXT = '.webp' if THUMBNAIL_FORMAT == 'WEBP' else '.jpg'
+
+# Retention policy
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GB
+UPLOAD_MAX_AGE_DAYS = float(os.environ.get('UPLOAD_MAX_AGE_DAYS', 90))
+GC_INTERVAL_SECONDS = 600
+
+CHUNK_SIZE = 1024 * 1024
+
+StoredUpload = namedtuple('StoredUpload', ['digest', 'path', 'static_path', 'thumbnail_static_path',
+                                           'size', 'is_new'])
+
+_gc_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload_gc')
+_gc_lock = threading.Lock()
+_last_gc = 0.0
+
+
+def _shard_dir(root, digest):
+    return os.path.join(root, digest[:2], digest[2:4])
+
+
+def _relative_to_static(path):
+    return os.path.relpath(path, STATIC_DIR).replace(os.sep, '/')
+
+
+def thumbnail_path(digest):
+    return os.path.join(_shard_dir(THUMBNAIL_DIR, digest), digest + THUMBNAIL_EXT)
+
+
+def store_upload(file_storage, original_filename):
+    """
+    Save an uploaded file (werkzeug FileStorage or binary file object) into the store.
+
+    The body is streamed to a temp file while hashing, then atomically moved
+    into place. If the content already exists the temp file is discarded and
+    the existing copy is marked as recently used.
+    """
+    ext = os.path.splitext(original_filename)[1].lower() or '.bin'
+    os.makedirs(STORE_DIR, exist_ok=True)
+
+    stream = getattr(file_storage, 'stream', file_storage)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=STORE_DIR, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+
+        hexdigest = digest.hexdigest()
+        shard = _shard_dir(STORE_DIR, hexdigest)
+        final_path = os.path.join(shard, hexdigest + ext)
+        os.makedirs(shard, exist_ok=True)
+
+        is_new = not os.path.exists(final_path)
+        if not is_new:
+            try:
+                os.utime(final_path)
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                # Collected between the exists() check and now: keep our copy
+                is_new = True
+        if is_new:
+            os.replace(tmp_path, final_path)
+        metrics.inc('upload_store_requests_total', result='new' if is_new else 'dedup')
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    thumb = thumbnail_path(hexdigest)
+    if not os.path.exists(thumb):
+        make_thumbnail(final_path, thumb)
+    _maybe_schedule_gc()
+
+    return StoredUpload(hexdigest, final_path, _relative_to_static(final_path),
+                        _relative_to_static(thumb), size, is_new)
+
+
+def make_thumbnail(source_path, thumb_path):
+    """Write a small display thumbnail for source_path (atomic, idempotent)."""
+    try:
+        with Image.open(source_path) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+            img = ImageOps.exif_transpose(img)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail(THUMBNAIL_SIZE)
+
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            tmp_path = thumb_path + '.part'
+            img.save(tmp_path, THUMBNAIL_FORMAT, quality=80)
+            os.replace(tmp_path, thumb_path)
+    except Exception as e:
+        print(f"Error creating thumbnail for {source_path}: {str(e)}")
+
+
+def _iter_store_files():
+    for dirpath, _, filenames in os.walk(STORE_DIR):
+        for filename in filenames:
+            if filename.endswith('.part'):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+
+def iter_uploads():
+    """Paths of every stored upload (thumbnails excluded)."""
+    for path, _, _ in _iter_store_files():
+        yield path
+
+
+def _remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    # The thumbnail is shared with any <digest>.<other ext> of the same content
+    digest = os.path.splitext(os.path.basename(path))[0]
+    try:
+        siblings = [f for f in os.listdir(os.path.dirname(path))
+                    if f.startswith(digest + '.') and not f.endswith('.part')]
+    except FileNotFoundError:
+        siblings = []
+    if not siblings:
+        try:
+            os.remove(thumbnail_path(digest))
+        except FileNotFoundError:
+            pass
+
+
+def collect_garbage(max_bytes=UPLOAD_MAX_BYTES, max_age_days=UPLOAD_MAX_AGE_DAYS):
+    """
+    Enforce the retention policy. Returns (files_removed, bytes_removed).
+    """
+    now = time.time()
+    max_age_seconds = max_age_days * 86400
+    files = sorted(_iter_store_files(), key=lambda f: f[2])  # oldest first
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    removed_bytes = 0
+
+    for path, size, mtime in files:
+        if now - mtime <= max_age_seconds and total <= max_bytes:
+            break
+        _remove_upload(path)
+        total -= size
+        removed += 1
+        removed_bytes += size
+
+    if removed:
+        print(f"[INFO] Upload GC removed {removed} files ({removed_bytes / (1024*1024):.1f} MB)")
+    return removed, removed_bytes
+
+
+def _maybe_schedule_gc():
+    global _last_gc
+    with _gc_lock:
+        if time.time() - _last_gc < GC_INTERVAL_SECONDS:
+            return
+        _last_gc = time.time()
+    _gc_pool.submit(collect_garbage)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'gc':
+        removed, removed_bytes = collect_garbage()
+        print(f"Removed {removed} files, {removed_bytes / (1024*1024):.1f} MB")
+    else:
+        print("Usage:")
+        print("  python upload_store.py gc   # Apply the upload retention policy now")
@@ -0,0 +1,274 @@
+"""
+Out-of-process inference worker pool.
+
+With INFERENCE_WORKERS > 0, TensorFlow runs in that many separate worker
+processes instead of inside the Flask process:
+
+- The web process decodes the image (preprocessing.load_batch_uint8) and
+  copies the uint8 tensor into a shared-memory slot owned by the chosen
+  worker. Only a small (request id, slot, shape, model) tuple goes through
+  the pipe; image data is never pickled.
+- Each worker holds its own models (inference.load_cached_model) and sends
+  back the probabilities.
+- Requests go to the live worker with the fewest outstanding requests.
+- A monitor thread restarts crashed workers; requests that were in flight
+  on a crashed worker fail with WorkerCrashed instead of hanging.
+
+Workers are started with the 'spawn' method so they never inherit a
+TensorFlow runtime from the parent, and the pool is created lazily per
+process (so each gunicorn worker gets its own pool after fork).
+"""
+
+import os
+import time
+import atexit
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', '0'))
+SLOTS_PER_WORKER = int(os.environ.get('INFERENCE_SLOTS_PER_WORKER', '4'))
+MAX_BATCH = 16
+MAX_IMAGE_SHAPE = (224, 224, 3)
+SLOT_BYTES = MAX_BATCH * MAX_IMAGE_SHAPE[0] * MAX_IMAGE_SHAPE[1] * MAX_IMAGE_SHAPE[2]
+REQUEST_TIMEOUT_SECONDS = 60
+MONITOR_INTERVAL_SECONDS = 0.5
+
+metrics.HELP.update({
+    'inference_pool_pending': 'Requests outstanding per inference worker process',
+    'inference_pool_restarts_total': 'Inference worker processes restarted after a crash',
+})
+
+# Set in worker processes so inference.py runs models locally there
+IN_WORKER = False
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process handling a request exited before answering."""
+
+
+def _worker_main(conn, shm_names, intra_threads):
+    """Entry point of an inference worker process."""
+    global IN_WORKER
+    IN_WORKER = True
+
+    from multiprocessing import resource_tracker
+    import cpu_tuning
+    cpu_tuning.apply_environment('serving')
+    cpu_tuning.apply_threads('serving', intra=intra_threads, inter=1)
+
+    import inference
+
+    # The parent owns the shared memory; don't let this process unlink it on exit
+    blocks = []
+    for name in shm_names:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        blocks.append(shm)
+
+    try:
+        inference.warm_up()
+    except Exception as e:
+        print(f"Inference worker {os.getpid()} warm-up skipped: {str(e)}")
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        request_id, slot, shape, model_name, tta_budget_ms = message
+        try:
+            images = np.ndarray(shape, dtype=np.uint8, buffer=blocks[slot].buf)
+            probabilities = inference.predict_local(model_name, images, tta_budget_ms)
+            del images
+            conn.send((request_id, probabilities, None))
+        except Exception as e:
+            conn.send((request_id, None, f"{type(e).__name__}: {str(e)}"))
+
+    for shm in blocks:
+        shm.close()
+
+
+class _Worker:
+    """Parent-side handle for one worker process and its shared-memory slots."""
+
+    def __init__(self, index, context, intra_threads):
+        self.index = index
+        self.context = context
+        self.intra_threads = intra_threads
+        self.blocks = [shared_memory.SharedMemory(create=True, size=SLOT_BYTES)
+                       for _ in range(SLOTS_PER_WORKER)]
+        self.free_slots = list(range(SLOTS_PER_WORKER))
+        self.pending = {}          # request_id -> (Future, slot)
+        self.send_lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.start()
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, [b.name for b in self.blocks], self.intra_threads),
+            name=f"inference-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        threading.Thread(target=self._read_responses, args=(parent_conn,), daemon=True).start()
+
+    def _read_responses(self, conn):
+        while True:
+            try:
+                request_id, probabilities, error = conn.recv()
+            except (EOFError, OSError):
+                return
+            with _pool_lock:
+                future, slot = self.pending.pop(request_id, (None, None))
+                if slot is not None:
+                    self.free_slots.append(slot)
+                _pool_cond.notify_all()
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(probabilities)
+            else:
+                future.set_exception(RuntimeError(f"Inference worker error: {error}"))
+
+    def fail_pending(self):
+        """Fail every outstanding request (worker crashed). Caller holds _pool_lock."""
+        for future, slot in self.pending.values():
+            self.free_slots.append(slot)
+            future.set_exception(WorkerCrashed(f"Inference worker {self.index} exited"))
+        self.pending.clear()
+
+    def stop(self):
+        try:
+            with self.send_lock:
+                self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+_pool_lock = threading.Lock()
+_pool_cond = threading.Condition(_pool_lock)
+
+
+class InferencePool:
+    """A set of inference worker processes with least-outstanding load balancing."""
+
+    def __init__(self, num_workers=INFERENCE_WORKERS):
+        context = multiprocessing.get_context('spawn')
+        import cpu_tuning
+        total_threads = cpu_tuning.profile_settings('serving')['intra_op_threads'] or os.cpu_count() or 1
+        intra_threads = max(1, total_threads // num_workers)
+        self.workers = [_Worker(i, context, intra_threads) for i in range(num_workers)]
+        self._ids = itertools.count()
+        self._closed = False
+        threading.Thread(target=self._monitor, daemon=True).start()
+
+    def _monitor(self):
+        while not self._closed:
+            time.sleep(MONITOR_INTERVAL_SECONDS)
+            for worker in self.workers:
+                if self._closed or worker.process.is_alive():
+                    continue
+                print(f"[WARN] Inference worker {worker.index} exited "
+                      f"(code {worker.process.exitcode}); restarting")
+                with _pool_lock:
+                    worker.fail_pending()
+                    _pool_cond.notify_all()
+                metrics.inc('inference_pool_restarts_total')
+                worker.start()
+            for worker in self.workers:
+                metrics.set_gauge('inference_pool_pending', len(worker.pending), worker=worker.index)
+
+    def _reserve(self, deadline):
+        """Pick the live worker with the fewest outstanding requests and take one of its slots."""
+        with _pool_lock:
+            while True:
+                candidates = [w for w in self.workers if w.free_slots and w.process.is_alive()]
+                if candidates:
+                    worker = min(candidates, key=lambda w: SLOTS_PER_WORKER - len(w.free_slots))
+                    return worker, worker.free_slots.pop()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("No inference worker available")
+                _pool_cond.wait(remaining)
+
+    def submit(self, model_name, images, tta_budget_ms=None):
+        """
+        Send a uint8 (N, H, W, 3) batch to a worker. Returns a Future of the
+        inference.predict_local() result (probabilities).
+        """
+        images = np.ascontiguousarray(images, dtype=np.uint8)
+        if images.nbytes > SLOT_BYTES:
+            raise ValueError(f"Batch of {images.nbytes} bytes exceeds the {SLOT_BYTES}-byte slot")
+
+        deadline = time.monotonic() + REQUEST_TIMEOUT_SECONDS
+        worker, slot = self._reserve(deadline)
+        np.ndarray(images.shape, dtype=np.uint8, buffer=worker.blocks[slot].buf)[...] = images
+
+        request_id = next(self._ids)
+        future = Future()
+        with _pool_lock:
+            worker.pending[request_id] = (future, slot)
+        try:
+            with worker.send_lock:
+                worker.conn.send((request_id, slot, images.shape, model_name, tta_budget_ms))
+        except OSError:
+            with _pool_lock:
+                if worker.pending.pop(request_id, None) is not None:
+                    worker.free_slots.append(slot)
+            raise WorkerCrashed(f"Inference worker {worker.index} is not accepting requests")
+        return future
+
+    def predict(self, model_name, images, tta_budget_ms=None):
+        """Blocking submit(); returns the probabilities array."""
+        return self.submit(model_name, images, tta_budget_ms).result(timeout=REQUEST_TIMEOUT_SECONDS)
+
+    def close(self):
+        self._closed = True
+        for worker in self.workers:
+            worker.stop()
+
+
+_pool = None
+_pool_pid = None
+_create_lock = threading.Lock()
+
+
+def pool_enabled():
+    # Spawned workers re-import the main module (e.g. app.py); they must
+    # never start a pool of their own.
+    return INFERENCE_WORKERS > 0 and not IN_WORKER and multiprocessing.parent_process() is None
+
+
+def get_pool():
+    """Return this process's pool, starting it on first use (None when disabled)."""
+    global _pool, _pool_pid
+    if not pool_enabled():
+        return None
+    with _create_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            print(f"[INFO] Starting {INFERENCE_WORKERS} inference worker processes...")
+            _pool = InferencePool(INFERENCE_WORKERS)
+            _pool_pid = os.getpid()
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,58 @@
+"""
+Production WSGI entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module in the gunicorn master (preload_app = True) imports
+Flask, TensorFlow, PIL and every app module once, so forked workers share
+the imported code copy-on-write and start faster. The models are not
+loaded in the master: building a Keras model starts TensorFlow's runtime,
+whose thread pools do not survive fork(). Each worker therefore loads and
+warms its own copy of the weights in configure_worker(), which is also
+where its intra/inter-op thread counts are applied, so N workers don't
+oversubscribe the cores.
+"""
+
+import os
+
+# Must be set before app/metrics are imported
+os.environ.setdefault('PLANT_WARMUP', '0')        # the master must not start the TF runtime
+os.environ.setdefault('METRICS_DIR', 'metrics_data')
+
+import cpu_tuning
+cpu_tuning.apply_environment('serving')
+
+import tensorflow as tf
+
+import inference
+import batch_jobs
+from app import app
+
+
+def worker_thread_counts(num_workers):
+    """
+    TF thread counts for one of num_workers workers: TF_INTRA_OP_THREADS /
+    TF_INTER_OP_THREADS if set, else the tuned serving profile, else the
+    cores split evenly.
+    """
+    settings = cpu_tuning.profile_settings('serving')
+    total = settings['intra_op_threads'] or os.cpu_count() or 1
+    intra = int(os.environ.get('TF_INTRA_OP_THREADS', max(1, total // max(1, num_workers))))
+    inter = int(os.environ.get('TF_INTER_OP_THREADS', settings['inter_op_threads'] or 1))
+    return intra, inter
+
+
+def configure_worker(num_workers):
+    """
+    Run in each worker after fork: size TF thread pools, load and warm the
+    models, and start the batch job runner.
+    """
+    intra, inter = worker_thread_counts(num_workers)
+    cpu_tuning.apply_threads('serving', intra=intra, inter=inter)
+    print(f"[INFO] Worker {os.getpid()}: TF intra-op threads={intra}, inter-op threads={inter}")
+
+    try:
+        inference.warm_up()
+    except Exception as e:
+        print(f"Model warm-up skipped: {str(e)}")
+    batch_jobs.start_runner()